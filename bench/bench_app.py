@@ -0,0 +1,275 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import platform
+import multiprocessing
+import resource
+import tempfile
+import threading
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from streamlit.testing.v1 import AppTest
+
+import metrics
+import storage
+from fake_n2yo import FakeN2YO, serve
+
+# ========================
+# アプリのヘッドレス負荷試験
+# ========================
+# demo_app.main() を AppTest で動かし、偽N2YOサーバーに対して N 人が同時に
+# リンク→トラック→もう一回 を繰り返す。結果は JSON で書き出して実行毎に比較する。
+# 例: python bench/bench_app.py --players 8 --workers 2 --games 3 --latency 0.1 --out bench_results.json
+
+APP_PATH = os.path.join(REPO_DIR, "demo_app.py")
+LINK_LABEL = "現在地から見える衛星を探す"
+TRACK_LABEL = "トラック！"
+REPLAY_LABEL = "もう一回プレイする"
+LIFE_REFRESH_SECONDS = 1 #demo_app のライフ欄の自動更新間隔（秒）
+
+
+# ========================
+# DB文の計測
+# ========================
+class StatementCounter:
+    def __init__(self):
+        self.statements = 0
+        self.commits = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, sql):
+        with self._lock:
+            self.statements += 1
+            if sql.lstrip().upper().startswith("COMMIT"):
+                self.commits += 1
+
+    def snapshot(self):
+        with self._lock:
+            return self.statements, self.commits
+
+
+def install_statement_counter(counter):
+    # StorageEngine が作る接続すべてに trace コールバックを付ける
+    connect = storage.StorageEngine._connect
+
+    def traced_connect(self):
+        conn = connect(self)
+        conn.set_trace_callback(counter)
+        return conn
+
+    storage.StorageEngine._connect = traced_connect
+
+
+# ========================
+# プレイヤー
+# ========================
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    index = min(len(samples) - 1, max(0, int(round(p / 100 * (len(samples) - 1)))))
+    return samples[index]
+
+
+class Player:
+    def __init__(self, index, secrets, db_path, counter, timeout):
+        self.index = index
+        self.db_path = db_path
+        self.counter = counter
+        self.timeout = timeout
+        self.at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        for key, value in secrets.items():
+            self.at.secrets[key] = value
+        self.latencies = []
+        self.cpu = []
+        self.statements = []
+        self.commits = []
+        self.errors = 0
+
+    def rerun(self, action=None):
+        statements, commits = self.counter.snapshot()
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        if action is None:
+            self.at.run(timeout=self.timeout)
+        else:
+            action().run(timeout=self.timeout)
+        self.latencies.append((time.perf_counter() - start) * 1000)
+        # プロセス全体のCPU時間（バックグラウンドスレッドの分も含む）
+        self.cpu.append((time.process_time() - cpu_start) * 1000)
+        after_statements, after_commits = self.counter.snapshot()
+        # 同じワーカー内では1セッションずつ動くので、この差分がこのリランの文数になる
+        self.statements.append(after_statements - statements)
+        self.commits.append(after_commits - commits)
+        if self.at.exception:
+            self.errors += 1
+
+    def button(self, label):
+        for button in self.at.button:
+            if button.label == label:
+                return button
+        return None
+
+    def top_up_lives(self):
+        # ライフ切れで試験が止まらないように、試験用DBだけ直接満タンに戻す
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        with conn:
+            conn.execute(
+                "UPDATE users SET lives=5, last_recharge=? WHERE user_id=?",
+                (datetime.now().isoformat(), self.at.session_state["user_id"])
+            )
+        conn.close()
+
+
+# ========================
+# 実行
+# ========================
+# AppTest はプロセス内で1つずつしか動かせないので、サーバープロセス相当のワーカーを
+# 複数起動し、各ワーカーの中で複数セッションを交互に進める。
+# DB・偽N2YOサーバーは全ワーカーで共有する。
+
+def run_worker(worker_index, n_players, args, secrets, workdir, results):
+    os.chdir(workdir)
+    random.seed(worker_index)
+    counter = StatementCounter()
+    install_statement_counter(counter)
+    players = [
+        Player(i, secrets, os.path.join(workdir, "game.db"), counter, args.timeout)
+        for i in range(n_players)
+    ]
+    for player in players:
+        player.rerun()
+    for _ in range(args.games):
+        for player in players:
+            player.top_up_lives()
+        for label in (LINK_LABEL, TRACK_LABEL, REPLAY_LABEL):
+            for player in players:
+                button = player.button(label)
+                if button is None:
+                    player.errors += 1
+                    continue
+                player.rerun(button.click)
+                if args.think_time:
+                    time.sleep(random.uniform(0, args.think_time))
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == "Darwin":
+        peak_rss_kb //= 1024
+    results.put({
+        "latencies": [x for player in players for x in player.latencies],
+        "cpu": [x for player in players for x in player.cpu],
+        "spans": metrics.summary(),
+        "statements": [x for player in players for x in player.statements],
+        "commits": [x for player in players for x in player.commits],
+        "errors": sum(player.errors for player in players),
+        "peak_rss_kb": peak_rss_kb,
+    })
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="satrack-bench-")
+    fake = FakeN2YO(args.latency, args.error_rate, args.constellation)
+    server = serve(fake)
+    secrets = {
+        "N2YO_API_KEY": "bench",
+        "N2YO_BASE_URL": f"http://127.0.0.1:{server.server_port}/rest/v1/satellite",
+        "N2YO_QUOTA_ENABLED": args.quota,
+        "METRICS_ENABLED": True, #フラグメント毎の描画時間を測る（エクスポートはしない）
+    }
+    if args.catalog:
+        shutil.copy(args.catalog, os.path.join(workdir, "catalog.tle"))
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    workers = min(args.workers, args.players)
+    per_worker = [args.players // workers + (1 if i < args.players % workers else 0) for i in range(workers)]
+    try:
+        start = time.perf_counter()
+        processes = [
+            ctx.Process(target=run_worker, args=(i, n, args, secrets, workdir, results), name=f"bench-worker-{i}")
+            for i, n in enumerate(per_worker)
+        ]
+        for process in processes:
+            process.start()
+        worker_results = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = [x for r in worker_results for x in r["latencies"]]
+    cpu = [x for r in worker_results for x in r["cpu"]]
+    # スパン毎の平均時間。AppTest はボタン操作でもスクリプト全体を再実行するので、
+    # 実際のサーバーでの操作1回のコストは、全体（rerun）ではなくそのフラグメント（render.*）の分になる
+    spans = {}
+    for r in worker_results:
+        for labels, (count, total) in r["spans"].items():
+            name = dict(labels)["span"]
+            if name == "rerun" or name.startswith("render."):
+                n, t = spans.get(name, (0, 0.0))
+                spans[name] = (n + count, t + total)
+    render_ms = {name: total / count * 1000 for name, (count, total) in sorted(spans.items()) if count}
+    statements = [x for r in worker_results for x in r["statements"]]
+    commits = [x for r in worker_results for x in r["commits"]]
+    games = args.players * args.games
+    calls = fake.snapshot()
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "config": vars(args),
+        "elapsed_s": elapsed,
+        "reruns": len(latencies),
+        "errors": sum(r["errors"] for r in worker_results),
+        "rerun_latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else 0.0,
+        },
+        "cpu_ms_per_rerun": sum(cpu) / len(cpu) if cpu else 0.0,
+        "render_ms": render_ms,
+        # ライフ欄は開いているセッション毎に LIFE_REFRESH_SECONDS 秒毎に単独で再実行される
+        "life_refresh_cores_per_1000_sessions": render_ms.get("render.life", 0.0) / 1000 / LIFE_REFRESH_SECONDS * 1000,
+        "db_statements_per_rerun": sum(statements) / len(statements) if statements else 0.0,
+        "db_commits_per_rerun": sum(commits) / len(commits) if commits else 0.0,
+        "api_calls": calls,
+        "api_calls_per_game": (calls["above"] + calls["positions"]) / games if games else 0.0,
+        "peak_rss_mb_per_worker": max(r["peak_rss_kb"] for r in worker_results) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=2, help="サーバープロセス相当のワーカー数")
+    parser.add_argument("--games", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.05, help="偽N2YOの応答遅延（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="偽N2YOのエラー率")
+    parser.add_argument("--constellation", type=int, default=300, help="above が返す衛星数")
+    parser.add_argument("--catalog", default=None, help="ローカルTLEカタログを使う場合のファイル")
+    parser.add_argument("--think-time", type=float, default=0.0, help="操作間の最大待ち時間（秒）")
+    parser.add_argument("--quota", action="store_true", help="N2YOの利用上限（トークンバケット）を有効にする")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--out", default=None, help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+
+    result = run(args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
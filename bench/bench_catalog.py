@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import statistics
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+# ========================
+# カタログのコールドスタートとメモリ量
+# ========================
+# ワーカープロセスを起動してカタログを開き、最初の1衛星の伝播・最初の一括伝播が終わるまでの時間と
+# RSS / PSS（共有ページをプロセス数で割った量）を、次の3通りで比べる。
+#   json   : プロセス毎に OMM JSON をパースする
+#   tle    : プロセス毎に TLE をパースする（TLECatalog）
+#   satcat : バイナリカタログを mmap で開く（MappedCatalog）
+# 例: python bench/bench_catalog.py --tle catalog.tle --workers 4
+
+def memory_kib():
+    # /proc/self/smaps_rollup の Rss / Pss（KiB）。無い環境では None
+    values = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    values[key] = int(rest.split()[0])
+    except OSError:
+        return None, None
+    return values.get("Rss"), values.get("Pss")
+
+
+def child(mode, path):
+    # 子プロセス: import 済みの状態から計測する（ライブラリの import 時間は含めない）
+    import numpy as np
+    from sgp4.api import SatrecArray
+    from orbit import TLECatalog, julian_date
+    from satcat import MappedCatalog, read_omm_json
+
+    start = time.perf_counter()
+    if mode == "json":
+        records = read_omm_json(path)
+        satrecs = {satid: sat for satid, _, sat in records}
+        names = {satid: name for satid, name, _ in records}
+        opened = time.perf_counter()
+        satid = next(iter(satrecs))
+        satrecs[satid].sgp4(*julian_date(datetime.now(timezone.utc)))
+        names[satid]
+        single = time.perf_counter()
+        jd, fr = julian_date(datetime.now(timezone.utc))
+        SatrecArray(list(satrecs.values())).sgp4(np.array([jd]), np.array([fr]))
+        count = len(names)
+    else:
+        catalog = TLECatalog(path) if mode == "tle" else MappedCatalog(path)
+        opened = time.perf_counter()
+        satid = int(catalog.arrays[0][0])
+        catalog.position(satid)
+        catalog.name(satid)
+        single = time.perf_counter()
+        catalog.propagate_all()
+        count = len(catalog)
+    end = time.perf_counter()
+    print(json.dumps({"open": opened - start, "single": single - start, "full": end - start, "count": count}), flush=True)
+
+    # 全ワーカーが揃ってからメモリ量を測る（同時に生きているプロセス間で共有ページの PSS を分け合う）
+    sys.stdin.readline()
+    rss, pss = memory_kib()
+    print(json.dumps({"rss": rss, "pss": pss}), flush=True)
+    sys.stdin.read()
+
+
+def run(mode, path, workers):
+    # 時間は1プロセスずつ測り（CPUの取り合いを避ける）、メモリは全プロセスが生きている状態で測る
+    procs, results = [], []
+    for _ in range(workers):
+        p = subprocess.Popen(
+            [sys.executable, __file__, "--child", mode, path],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        )
+        procs.append(p)
+        results.append(json.loads(p.stdout.readline()))
+    for p, result in zip(procs, results):
+        p.stdin.write("\n")
+        p.stdin.flush()
+        result.update(json.loads(p.stdout.readline()))
+    for p in procs:
+        p.stdin.close()
+        p.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tle", default="catalog.tle")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PATH"))
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    from sgp4 import exporter
+    from satcat import build_catalog, read_tle
+
+    base = os.path.splitext(args.tle)[0]
+    json_path, satcat_path = f"{base}.json", f"{base}.satcat"
+    records = read_tle(args.tle)
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump([exporter.export_omm(sat, name) for _, name, sat in records], f)
+    start = time.perf_counter()
+    build_catalog(records, satcat_path)
+    print(f"{len(records)} satellites, satcat {os.path.getsize(satcat_path) / 1024:.0f} KiB "
+          f"(build {time.perf_counter() - start:.2f}s), json {os.path.getsize(json_path) / 1024:.0f} KiB")
+    # open: カタログを開くまで / single: 最初の1衛星の位置と名前まで / full: 最初の一括伝播まで
+    print(f"{'mode':<8}{'open ms':>10}{'single ms':>11}{'full ms':>10}{'RSS MiB':>10}{'PSS MiB':>10}")
+    for mode, path in (("json", json_path), ("tle", args.tle), ("satcat", satcat_path)):
+        results = run(mode, path, args.workers)
+        median = lambda key: statistics.median(r[key] for r in results)
+        print(f"{mode:<8}{median('open') * 1000:>10.1f}{median('single') * 1000:>11.1f}{median('full') * 1000:>10.1f}"
+              f"{(median('rss') or 0) / 1024:>10.1f}{(median('pss') or 0) / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
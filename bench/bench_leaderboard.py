@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import leaderboard
+from storage import StorageEngine
+
+# ========================
+# ランキングのベンチマーク
+# ========================
+# 例: python bench/bench_leaderboard.py --games 2000000 --users 200000
+
+def seed(storage, games, users, days, seed_value=0):
+    # 大量のゲームは一時テーブルに入れてから集計表をSQLでまとめて作る
+    rnd = random.Random(seed_value)
+    now = datetime.now()
+    with storage.transaction() as conn:
+        conn.execute("CREATE TEMP TABLE games (user_id TEXT, day TEXT, week TEXT, score INTEGER)")
+        batch = []
+        for _ in range(games):
+            when = now - timedelta(days=rnd.random() * days)
+            batch.append((
+                f"user{rnd.randrange(users)}",
+                leaderboard.period_start(leaderboard.PERIOD_DAY, when),
+                leaderboard.period_start(leaderboard.PERIOD_WEEK, when),
+                rnd.randrange(0, 3500),
+            ))
+            if len(batch) >= 100000:
+                conn.executemany("INSERT INTO games VALUES (?, ?, ?, ?)", batch)
+                batch = []
+        conn.executemany("INSERT INTO games VALUES (?, ?, ?, ?)", batch)
+        for period, column in ((leaderboard.PERIOD_ALL, "''"), (leaderboard.PERIOD_DAY, "day"), (leaderboard.PERIOD_WEEK, "week")):
+            conn.execute(f"""
+                INSERT INTO leaderboard (period, period_start, user_id, best_score, games)
+                SELECT '{period}', {column}, user_id, MAX(score), COUNT(*) FROM games GROUP BY {column}, user_id
+            """)
+            conn.execute(f"""
+                INSERT INTO leaderboard_counts (period, period_start, score, users)
+                SELECT period, period_start, best_score, COUNT(*) FROM leaderboard
+                WHERE period='{period}' GROUP BY period_start, best_score
+            """)
+        conn.execute("DROP TABLE games")
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {"p50_ms": statistics.median(samples), "max_ms": samples[-1]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=28)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = StorageEngine(os.path.join(tmp, "bench.db"))
+        start = time.perf_counter()
+        seed(storage, args.games, args.users, args.days)
+        print(f"seed: {args.games} games / {args.users} users in {time.perf_counter() - start:.1f}s")
+
+        rnd = random.Random(1)
+        with storage.connection() as conn:
+            for period in leaderboard.PERIODS:
+                print(period, "top10", timed(lambda: leaderboard.top(conn, period, 10), args.repeat))
+                print(period, "rank_of", timed(lambda: leaderboard.rank_of(conn, f"user{rnd.randrange(args.users)}", period), args.repeat))
+
+        # 1ゲーム分の記録（ランキング3期間の更新）のコスト
+        print("record_score", timed(lambda: _record(storage, rnd, args.users), args.repeat))
+        storage.close()
+
+
+def _record(storage, rnd, users):
+    with storage.transaction() as conn:
+        leaderboard.record_score(conn, f"user{rnd.randrange(users)}", rnd.randrange(0, 3500), datetime.now())
+
+
+if __name__ == "__main__":
+    main()
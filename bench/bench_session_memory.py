@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+import random
+import argparse
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_n2yo import FakeN2YO
+from satlist import SatelliteList
+from scoring import CategoryTable, link_score
+
+# ========================
+# セッション毎の衛星リストのメモリ量
+# ========================
+# リンク直後のセッション状態を多数作り、生の dict のリストを保持する従来の形と
+# SatelliteList の形で tracemalloc の確保量を比べる。
+# 例: python bench/bench_session_memory.py --sessions 5000 --constellation 300
+
+SAMPLE_SIZE = 20
+
+
+def above_payloads(fake, n_locations, rnd):
+    # 観測地点は少数に偏る（同じ衛星名が多くのセッションに現れる）
+    payloads = []
+    for _ in range(n_locations):
+        lat, lon = round(rnd.uniform(-60, 60), 1), round(rnd.uniform(-180, 180), 1)
+        status, payload = fake.handle(f"/rest/v1/satellite/above/{lat}/{lon}/0.0/90/0")
+        payloads.append(json.dumps(payload))
+    return payloads
+
+
+def link_text(sat_list, indices):
+    return "\n".join(
+        f"**{sat_list[i]['satname']}**  " + f"(ID: {sat_list[i]['satid']}, 打ち上げ: {sat_list[i]['launchDate']})\n"
+        for i in indices
+    )
+
+
+class LegacyLinkScore:
+    # 変更前のセッションに残していたリンク毎のメモ（比較用にここだけで再現する）
+    def __init__(self, sat_list, category_table):
+        self.sat_list = sat_list
+        self.categories = category_table.categories(sat_list)
+        self.score = link_score(self.categories)
+        self._expected = {}
+
+
+def legacy_session(above, table, rnd):
+    # 変更前: 生のリスト・添字・表示文字列・選択肢・リンク毎のメモをセッションに保持
+    indices = sorted(rnd.sample(range(len(above)), k=min(SAMPLE_SIZE, len(above))))
+    return {
+        "sat_list": above,
+        "sat_random_index_list": indices,
+        "link_data": link_text(above, indices),
+        "memo_sat_options": ((id(above), tuple(indices)), [(above[i]["satname"], above[i]["satid"]) for i in indices]),
+        "link_score": LegacyLinkScore(above, table),
+    }
+
+
+def compact_session(above, table, rnd):
+    indices = sorted(rnd.sample(range(len(above)), k=min(SAMPLE_SIZE, len(above))))
+    sat_list = SatelliteList.from_above(above, table, indices)
+    return {
+        "sat_list": sat_list,
+        "link_data": link_text(sat_list, range(len(sat_list))),
+    }
+
+
+def measure(build, args):
+    fake = FakeN2YO(constellation=args.constellation)
+    table = CategoryTable()
+    rnd = random.Random(0)
+    payloads = above_payloads(fake, args.locations, rnd)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = []
+    for i in range(args.sessions):
+        # セッション毎に JSON をデコードし直して、実際の応答と同じく文字列を別オブジェクトにする
+        above = json.loads(payloads[i % len(payloads)])["above"]
+        sessions.append(build(above, table, rnd))
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / args.sessions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--constellation", type=int, default=300, help="above が返す衛星数")
+    parser.add_argument("--locations", type=int, default=50, help="観測地点の種類")
+    args = parser.parse_args()
+
+    legacy = measure(legacy_session, args)
+    compact = measure(compact_session, args)
+    print(f"sessions: {args.sessions}, satellites per link: {args.constellation}")
+    print(f"legacy : {legacy / 1024:.1f} KiB/session")
+    print(f"compact: {compact / 1024:.1f} KiB/session ({legacy / compact:.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import os
+import sys
+import math
+import time
+import argparse
+import statistics
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from orbit import ecef_to_geodetic_array, geodetic_to_ecef
+from visibility import CELL_DEG, EARTH_R, VisibilityEngine, VisibilitySlice
+
+# ========================
+# 可視衛星の問い合わせ1回あたりのコスト
+# ========================
+# カタログの大きさを変えて、空間インデックス経由の問い合わせと全件走査を比べる。
+# 探索半径 90 度では見える衛星数がカタログに比例するので、候補数/可視数（余分に調べた割合）も出す。
+# 例: python bench/bench_visibility.py --sizes 1000 10000 40000 --queries 500
+
+
+def constellation(rnd, n):
+    # LEO（うち6割は高度 550 km 付近のシェル）が9割、MEO・GEO が1割
+    unit = rnd.normal(size=(n, 3))
+    unit /= np.linalg.norm(unit, axis=1)[:, None]
+    band = rnd.random(n)
+    alt = np.where(band < 0.6, rnd.uniform(540, 560, n), np.where(
+        band < 0.9, rnd.uniform(300, 1300, n), np.where(band < 0.95, rnd.uniform(19000, 24000, n), 35786.0)))
+    return unit * (EARTH_R + alt)[:, None]
+
+
+def brute_force(ecef, lat, lon):
+    # VisibilityEngine.visible と同じ判定を全衛星に対して行う
+    obs = np.array(geodetic_to_ecef(lat, lon, 0.0))
+    zenith = np.array([
+        math.cos(math.radians(lat)) * math.cos(math.radians(lon)),
+        math.cos(math.radians(lat)) * math.sin(math.radians(lon)),
+        math.sin(math.radians(lat)),
+    ])
+    d = ecef - obs
+    idx = np.nonzero((d @ zenith) / np.maximum(np.linalg.norm(d, axis=1), 1e-9) >= 0)[0]
+    return idx, ecef_to_geodetic_array(ecef[idx])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 40000, 100000])
+    parser.add_argument("--queries", type=int, default=300)
+    args = parser.parse_args()
+
+    rnd = np.random.default_rng(0)
+    engine = VisibilityEngine(catalog=None)
+    print(f"{'satellites':>10}{'visible':>10}{'cand/vis':>10}{'index ms':>10}{'brute ms':>10}{'index us/vis':>14}")
+    for n in args.sizes:
+        ecef = constellation(rnd, n)
+        sl = VisibilitySlice(np.arange(n), ecef, CELL_DEG)
+        observers = [(math.degrees(math.asin(rnd.uniform(-1, 1))), rnd.uniform(-180, 180)) for _ in range(args.queries)]
+        index_times, brute_times, visible, candidates = [], [], 0, 0
+        for lat, lon in observers:
+            start = time.perf_counter()
+            found = engine.visible(sl, lat, lon, 0.0)[0]
+            index_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            brute_force(ecef, lat, lon)
+            brute_times.append(time.perf_counter() - start)
+            visible += len(found)
+            candidates += len(sl.candidates(lat, lon))
+        index_ms = statistics.median(index_times) * 1000
+        print(f"{n:>10}{visible / len(observers):>10.0f}{candidates / max(visible, 1):>10.2f}{index_ms:>10.2f}"
+              f"{statistics.median(brute_times) * 1000:>10.2f}{index_ms * 1000 / max(visible / len(observers), 1):>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
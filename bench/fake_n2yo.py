@@ -0,0 +1,148 @@
+import re
+import sys
+import math
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# ========================
+# N2YO の偽サーバー（ベンチマーク用）
+# ========================
+# satellite/above と satellite/positions に合成データを返す。ネットワーク不要。
+# 例: python bench/fake_n2yo.py --port 8765 --latency 0.2 --error-rate 0.01 --constellation 300
+
+ABOVE_PATH = re.compile(r"/rest/v1/satellite/above/([-\d.]+)/([-\d.]+)/([-\d.]+)/(\d+)/(\d+)")
+POSITIONS_PATH = re.compile(r"/rest/v1/satellite/positions/(\d+)/([-\d.]+)/([-\d.]+)/([-\d.]+)/(\d+)")
+NAMES = ("STARLINK", "ISS", "NOAA", "GPS", "COSMOS", "IRIDIUM")
+
+
+def satellite(satid):
+    # satid から決定的に衛星の属性と軌道（簡易な円軌道）を決める
+    rnd = random.Random(satid)
+    return {
+        "satid": satid,
+        "satname": f"{rnd.choice(NAMES)}-{satid}",
+        "intDesignator": f"{rnd.randint(1990, 2025)}-{rnd.randint(1, 200):03d}A",
+        "launchDate": f"{rnd.randint(1990, 2025)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+        "inclination": rnd.uniform(0, 98),
+        "phase": rnd.uniform(0, 360),
+        "node": rnd.uniform(0, 360),
+        "period": rnd.uniform(90, 110) * 60,
+        "alt": rnd.uniform(350, 1200),
+    }
+
+
+def subpoint(sat, t):
+    angle = (sat["phase"] + 360 * t / sat["period"]) % 360
+    lat = sat["inclination"] * math.sin(math.radians(angle))
+    lon = (sat["node"] + angle - 360 * t / 86164) % 360 - 180
+    return lat, lon
+
+
+class FakeN2YO:
+    def __init__(self, latency=0.0, error_rate=0.0, constellation=300, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.constellation = constellation
+        self.random = random.Random(seed)
+        self.counts = {"above": 0, "positions": 0, "errors": 0}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def handle(self, path):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            fail = self.random.random() < self.error_rate
+        m = ABOVE_PATH.match(path)
+        if m:
+            self.count("above")
+            if fail:
+                self.count("errors")
+                return 503, {"error": "fake failure"}
+            lat, lon = float(m.group(1)), float(m.group(2))
+            base = int((lat + 90) * 1000 + (lon + 180)) * 10000
+            above = []
+            for satid in range(base, base + self.constellation):
+                sat = satellite(satid)
+                sat_lat, sat_lon = subpoint(sat, time.time())
+                above.append({
+                    "satid": satid,
+                    "satname": sat["satname"],
+                    "intDesignator": sat["intDesignator"],
+                    "launchDate": sat["launchDate"],
+                    "satlat": sat_lat,
+                    "satlng": sat_lon,
+                    "satalt": sat["alt"],
+                })
+            return 200, {"info": {"category": "ANY", "transactionscount": 0, "satcount": len(above)}, "above": above}
+        m = POSITIONS_PATH.match(path)
+        if m:
+            self.count("positions")
+            if fail:
+                self.count("errors")
+                return 503, {"error": "fake failure"}
+            satid, seconds = int(m.group(1)), int(m.group(5))
+            sat = satellite(satid)
+            now = int(time.time())
+            positions = []
+            for i in range(seconds):
+                sat_lat, sat_lon = subpoint(sat, now + i)
+                positions.append({
+                    "satlatitude": sat_lat,
+                    "satlongitude": sat_lon,
+                    "sataltitude": sat["alt"],
+                    "timestamp": now + i,
+                })
+            return 200, {"info": {"satid": satid, "satname": sat["satname"], "transactionscount": 0}, "positions": positions}
+        return 404, {"error": "not found"}
+
+
+def serve(fake, host="127.0.0.1", port=0):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, payload = fake.handle(self.path)
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-n2yo", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--constellation", type=int, default=300)
+    args = parser.parse_args()
+    server = serve(FakeN2YO(args.latency, args.error_rate, args.constellation), port=args.port)
+    print(f"fake N2YO: http://127.0.0.1:{server.server_port}/rest/v1/satellite", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,128 @@
 import streamlit as st
-import sqlite3
 import uuid
-import requests
 import random
 import json
-import math
 import time
-from datetime import datetime, timedelta
+import functools
+from collections import deque
+from datetime import datetime
+
+import leaderboard
+import lives
+import metrics
+from n2yo_client import BASE_URL as N2YO_BASE_URL, N2YOClient, N2YOError, QuotaExceeded
+from orbit import TLE_PATH
+from passes import PASS_WINDOWS, PassTracker
+from precompute import DEFAULT_HOT_CELLS, VisibilityIndex
+from prefetch import PositionPrefetcher
+from quota import QuotaManager
+from satcat import SATCAT_PATH, open_catalog
+from satlist import SatelliteList
+from scoring import CategoryTable, expected_track_scores, haversine, track_scores
+from storage import DB_PATH, StorageEngine, HistoryWriter, get_or_create_user, get_history
+from visibility import VisibilityEngine
+
+# ========================
+# 定数
+# ========================
+MAX_LIVES = lives.MAX_LIVES
+HISTORY_MAX_SIZE = 10
+RECOVER_INTERVAL = lives.RECOVER_INTERVAL
+LIFE_REFRESH_SECONDS = 1 #ライフのカウントダウンを更新する間隔（秒）
+DEBUG_TRACES = 5 #デバッグパネルに表示する直近のリラン数（ルートのスパン名毎）
+INSTANT_MODE = "瞬間トラック" #今この瞬間の距離で採点する
+PASS_MODE = "パストラック" #これからN秒間のパス全体で採点する
+
+# ========================
+# 計測
+# ========================
+@st.cache_resource
+def init_metrics():
+    # secrets の METRICS_ENABLED が真の時だけ計測する（無効時の計測コストはほぼゼロ）
+    # METRICS_PORT でローカルの /metrics エンドポイント、METRICS_FILE でファイルに Prometheus 形式で出力する
+    if st.secrets.get("METRICS_ENABLED", False):
+        metrics.configure(True)
+        metrics.start_exporter(port=st.secrets.get("METRICS_PORT"), path=st.secrets.get("METRICS_FILE"))
+    return metrics.enabled()
+
+def traced(name):
+    # リラン（フラグメント単体の再実行を含む）全体のスパンの木をデバッグパネル用に直近分だけ残す
+    # （st.rerun() の直後のリランで上書きされないように複数保持する）。
+    # 1秒毎に自動更新されるフラグメントで他のリランが押し出されないよう、ルートのスパン名毎に分けて残す
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            span = metrics.span(name)
+            try:
+                with span:
+                    return func(*args, **kwargs)
+            finally:
+                if metrics.last_trace() is span:
+                    traces = st.session_state.setdefault("traces", {})
+                    traces.setdefault(name, deque(maxlen=DEBUG_TRACES)).append(span)
+        return wrapper
+    return decorator
 
 # ========================
 # SQLite 初期化
 # ========================
+@st.cache_resource
 def init_db():
-    conn = sqlite3.connect("game.db")
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id TEXT PRIMARY KEY,
-            lives INTEGER,
-            last_recharge TEXT
-        )
-    """)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT,
-            timestamp TEXT,
-            log TEXT
-        )
-    """)
-    conn.commit()
-    return conn
+    # プロセス全体で1つのストレージエンジンを共有する（リラン毎に接続しない）
+    with metrics.span("init_db"):
+        return StorageEngine(DB_PATH)
+
+@st.cache_resource
+def init_history_writer():
+    # 終了したゲームの履歴は全セッション分をまとめてバックグラウンドで書き込む
+    return HistoryWriter(init_db())
+
+@st.cache_resource
+def init_n2yo_client(api_key):
+    # keep-alive の接続プールとレスポンスキャッシュを全セッションで共有する
+    # （N2YO_BASE_URL を secrets に書くとベンチマーク用の偽サーバー等に向けられる）
+    # APIキーの利用上限は DB に置いたトークンバケットで全プロセス共通に管理する
+    # （N2YO_QUOTA_ENABLED を偽にすると制限しない）
+    quota = QuotaManager(init_db()) if st.secrets.get("N2YO_QUOTA_ENABLED", True) else None
+    return N2YOClient(api_key, base_url=st.secrets.get("N2YO_BASE_URL", N2YO_BASE_URL), quota=quota)
+
+@st.cache_resource
+def init_orbit_catalog():
+    # ローカルのカタログからSGP4で衛星位置を計算する（ファイル更新は自動で再読込）
+    # バイナリカタログ（satcat.py で作成）があれば mmap で開き、無ければTLEをパースする
+    return open_catalog(SATCAT_PATH, TLE_PATH)
+
+@st.cache_resource
+def init_visibility_engine():
+    # カタログ全体の伝播結果と空間インデックスを全セッションで共有する
+    return VisibilityEngine(init_orbit_catalog())
+
+@st.cache_resource
+def init_visibility_index():
+    # 利用者の多いセル（secrets の HOT_CELLS = [[緯度, 経度], ...]）の可視衛星をバックグラウンドで先読みする
+    cells = [tuple(cell) for cell in st.secrets.get("HOT_CELLS", DEFAULT_HOT_CELLS)]
+    return VisibilityIndex(init_db(), init_visibility_engine(), cells).start()
+
+@st.cache_resource
+def init_category_table():
+    # satid毎の衛星カテゴリ（リンクスコア用）を全セッションで共有する
+    return CategoryTable(init_orbit_catalog())
+
+@st.cache_resource
+def init_prefetcher(api_key):
+    # リンク直後に候補衛星の位置を先読みする（同時リクエスト数は全セッションで共有の上限）
+    return PositionPrefetcher(init_n2yo_client(api_key), init_orbit_catalog())
+
+@st.cache_resource
+def init_pass_tracker(api_key):
+    # パストラック用の軌道は satid・時間バケット毎に全セッションで共有する
+    return PassTracker(init_orbit_catalog(), init_n2yo_client(api_key))
+
+@st.cache_data(ttl=10)
+def load_leaderboard(user_id, k=10):
+    # ランキングは全セッション共通なので短時間キャッシュする
+    with init_db().connection() as conn:
+        return leaderboard.top(conn, leaderboard.PERIOD_ALL, k), leaderboard.rank_of(conn, user_id, leaderboard.PERIOD_ALL)
 
 # ========================
 # Cookie に user_id を保存
@@ -49,98 +141,24 @@ def get_or_set_user_id():
     return st.session_state.user_id
 
 # ========================
-# ユーザー管理
-# ========================
-def get_or_create_user(conn, user_id):
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
-    row = cur.fetchone()
-
-    if row is None:
-        cur.execute(
-            "INSERT INTO users (user_id, lives, last_recharge) VALUES (?, ?, ?)",
-            (user_id, 5, datetime.now().isoformat())
-        )
-        conn.commit()
-        return {"user_id": user_id, "lives": 5, "last_recharge": datetime.now().isoformat()}
-    else:
-        return {
-            "user_id": row[0],
-            "lives": row[1],
-            "last_recharge": row[2]
-        }
-
-def update_user(conn, user):
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE users SET lives=?, last_recharge=? WHERE user_id=?",
-        (user["lives"], user["last_recharge"], user["user_id"])
-    )
-    conn.commit()
-
-def add_history(conn, user_id, log, max_size=10):
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO history (user_id, timestamp, log) VALUES (?, ?, ?)",
-        (user_id, datetime.now().isoformat(), log)
-    )
-    conn.commit()
-    #履歴件数の取得
-    cur.execute("SELECT id FROM history WHERE user_id=? ORDER BY id DESC", (user_id,))
-    rows = cur.fetchall()
-    #max_sizeを超えていたら古いものを削除
-    if len(rows) > max_size:
-        # 超過分を取得（古い方）
-        ids_to_delete = [row[0] for row in rows[max_size:]]
-        cur.executemany("DELETE FROM history WHERE id=?", [(i,) for i in ids_to_delete])
-        conn.commit()
-
-def get_history(conn, user_id):
-    cur = conn.cursor()
-    cur.execute("SELECT timestamp, log FROM history WHERE user_id=? ORDER BY id DESC", (user_id,))
-    return cur.fetchall()
-
-# ========================
-# アプリ本体
+# セッション状態
 # ========================
 
 #cookieに渡すデータ：st.session_state["game_data"]に集約されている
 #基本的にはそことuser(cookie)のやり取りおよびuserのアウトプットだけを考えれば良いはず（オブジェクト化）
 
-def main():
-    # --- cookieデータに基づくユーザデータ取得 ---
-    conn = init_db() #dbの初期化
-    user_id = get_or_set_user_id() #user_idをcookieから取得
-    user = get_or_create_user(conn, user_id) #user_id毎にユーザーデータを保管する
-
-    st.set_page_config(
-        page_title="衛星トラッキングデモ",
-        layout="wide"   # <- ここで全幅レイアウトに変更
-    )
-
-    # --- Cookieのセーブフラグ管理 ---
-    cookie_save_needed_flag = False
-    def save_game_data_to_cookie():
-        st.session_state["game_data"]["lives"] = st.session_state["lives"]
-        st.session_state["game_data"]["last_recharge"] = st.session_state["last_recharge"].isoformat()
-        st.session_state["game_data"]["history"] = st.session_state["history"]
-        # user["game_data"] = json.dumps(st.session_state["game_data"])
-        return True
-
-    # ----------------------
-    # 状態量初期化
-    # ----------------------
-    API_KEY = st.secrets["N2YO_API_KEY"]
-    MAX_LIVES = 5
-    HISTORY_MAX_SIZE = 10
-    RECOVER_INTERVAL = timedelta(hours=1)
-
+def init_session_state(storage, user_id):
     if "game_data" not in st.session_state:
+        # DBからの読み込みはセッションの初回のみ
+        metrics.count("sessions_total")
+        with storage.transaction() as conn:
+            user = get_or_create_user(conn, user_id) #user_id毎にユーザーデータを保管する
+            history = get_history(conn, user_id)
         st.session_state["game_data"] = {
-            "user_id": user["user_id"], 
+            "user_id": user["user_id"],
             "lives": user["lives"],
             "last_recharge": user["last_recharge"],
-            "history": get_history(conn, user_id)
+            "history": history
         }
     if "lives" not in st.session_state:
         st.session_state["lives"] = st.session_state["game_data"]["lives"]  # 最大ライフ5
@@ -171,18 +189,132 @@ def main():
     if len(st.session_state["history"]) > HISTORY_MAX_SIZE:
         st.session_state["history"] = st.session_state["history"][-HISTORY_MAX_SIZE:]
 
-    # --- タイトル ---
-    st.title("衛星トラックゲーム デモ")
+# --- Cookieのセーブフラグ管理 ---
+def save_game_data_to_cookie():
+    st.session_state["game_data"]["lives"] = st.session_state["lives"]
+    st.session_state["game_data"]["last_recharge"] = st.session_state["last_recharge"].isoformat()
+    st.session_state["game_data"]["history"] = st.session_state["history"]
+    # user["game_data"] = json.dumps(st.session_state["game_data"])
+
+def apply_lives(state):
+    # ライフはDB側で原子的に更新するので、画面はその結果を読むだけ
+    st.session_state["lives"] = state["lives"]
+    st.session_state["last_recharge"] = datetime.fromisoformat(state["last_recharge"])
+    save_game_data_to_cookie()
+
+def persist_game_data():
+    # --- cookieの保存 ---
+    # フラグメント単体のリランでも保存されるように、各フラグメントの最後と st.rerun() の前に呼ぶ
+    if st.session_state["history_renew_flag"] == True:
+        date_history, score_history = st.session_state["history"][-1]
+        init_history_writer().submit(
+            st.session_state["user_id"], score_history, max_size=HISTORY_MAX_SIZE, timestamp=date_history,
+            game=st.session_state.get("last_game")
+        )
+        st.session_state["history_renew_flag"] = False
+
+def session_memo(name, key, build):
+    # 入力(key)が変わった時だけ表示用データを作り直す
+    cached = st.session_state.get(f"memo_{name}")
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    value = build()
+    st.session_state[f"memo_{name}"] = (key, value)
+    return value
+
+def flash(panel, kind, text):
+    # st.rerun() の後にも表示したいメッセージを次の描画まで保持する
+    st.session_state.setdefault("flash", {}).setdefault(panel, []).append((kind, text))
+
+def show_flash(panel):
+    for kind, text in st.session_state.get("flash", {}).pop(panel, []):
+        getattr(st, kind)(text)
+
+def current_position():
+    lat = st.session_state["lat"]
+    lon = st.session_state["lon"]
+    alt_km = st.session_state["alt_m"] / 1000 #kmに換算する
+    return lat, lon, alt_km
+
+def track_instant(n2yo, orbit_catalog, sat_id, lat, lon, alt_km):
+    # 今この瞬間の衛星位置で採点する。戻り値: ((距離, トラックスコア, 表示行, 結果行) または None, クォータ不足か)
+    # カタログにある衛星はローカルで計算し、無ければ先読み結果かN2YOを使う
+    with metrics.span("orbit.position"):
+        pos = orbit_catalog.position(sat_id)
+    if pos is None and "prefetch" in st.session_state:
+        pos = st.session_state["prefetch"].position(sat_id)
+    if pos is None:
+        try:
+            pos = n2yo.positions(sat_id, lat, lon, alt_km, 1).get("positions", [])[0]
+        except QuotaExceeded:
+            return None, True
+        except (N2YOError, IndexError):
+            return None, False
+
+    sat_lat = pos["satlatitude"]
+    sat_lon = pos["satlongitude"]
+
+    # 距離計算（簡易：地表での距離）
+    distance = float(haversine(lat, lon, sat_lat, sat_lon))
+    # 距離スコア判定
+    with metrics.span("scoring.track"):
+        track_score = float(track_scores(distance))
+    lines = [f"衛星位置: 緯度 {sat_lat:.2f}, 経度 {sat_lon:.2f}", f"観測地点との距離: 約 {distance:.1f} km"]
+    return (distance, track_score, lines, lines[1:]), False
+
+def track_pass(pass_tracker, sat_id, lat, lon, alt_km, seconds):
+    # これから seconds 秒間のパス全体（最接近距離・平均距離・地平線上の時間）で採点する
+    prefetched = st.session_state["prefetch"].positions(sat_id) if "prefetch" in st.session_state else None
+    try:
+        with metrics.span("scoring.pass"):
+            result = pass_tracker.track(sat_id, lat, lon, alt_km, seconds, prefetched=prefetched)
+    except QuotaExceeded:
+        return None, True
+    except N2YOError:
+        return None, False
+    if result is None:
+        return None, False
+    lines = [
+        f"追跡時間: {result['seconds']:.0f} 秒",
+        f"最接近距離: 約 {result['closest']:.1f} km",
+        f"平均距離: 約 {result['average']:.1f} km",
+        f"地平線上にいた時間: {result['visible_seconds']:.0f} 秒（最大仰角 {result['max_elevation']:.1f}˚）",
+    ]
+    return (result["closest"], result["score"], lines, lines), False
+
+def expected_scores(sat_list, lat, lon):
+    # 候補衛星全部の予想トラックスコア（リンク時点の位置からまとめて計算）。リンクと観測地点が同じ間は再計算しない
+    def build():
+        with metrics.span("scoring.expected"):
+            return expected_track_scores(lat, lon, sat_list, range(len(sat_list)))
+    return session_memo("expected_scores", (tuple(sat_list.satids()), lat, lon), build)
+
+def sample_sat_indices(sat_list):
+    if len(sat_list) <= 20:
+        sat_index_list = [int(x) for x in range(len(sat_list))]
+    else:
+        sat_index_list = random.sample(range(len(sat_list)), k=20)
+    sat_index_list.sort()
+    return sat_index_list
 
+
+# ========================
+# ライフ（定期更新）
+# ========================
+@st.fragment(run_every=LIFE_REFRESH_SECONDS)
+@traced("render.life")
+def life_panel():
     # --- ライフの回復 ---
+    # 回復時刻を過ぎた時だけDB側で回復させる（回復数の計算は保存済みの時刻に対して行う）
     now = datetime.now()
-    elapsed = now - st.session_state["last_recharge"]
-
-    recovered = elapsed // RECOVER_INTERVAL  # 1時間ごとに1回復
-    if recovered > 0:
-        st.session_state["lives"] = min(MAX_LIVES, st.session_state["lives"] + recovered)
-        st.session_state["last_recharge"] = st.session_state["last_recharge"] + RECOVER_INTERVAL * recovered
-        cookie_save_needed_flag = save_game_data_to_cookie()
+    if now - st.session_state["last_recharge"] >= RECOVER_INTERVAL:
+        was_empty = st.session_state["lives"] == 0
+        with metrics.span("lives.recharge"), init_db().transaction() as conn:
+            apply_lives(lives.recharge(conn, st.session_state["user_id"], now))
+        # ライフ切れから回復したら、リンク欄（ライフ切れの表示のまま）も描き直す
+        if was_empty and st.session_state["lives"] > 0:
+            persist_game_data()
+            st.rerun(scope="app")
 
     if st.session_state["lives"] == 5:
         minutes, seconds = 0, 0
@@ -190,61 +322,48 @@ def main():
         next_recover = st.session_state["last_recharge"] + RECOVER_INTERVAL
         remaining = next_recover - now
         minutes, seconds = divmod(int(remaining.total_seconds()), 60)
-    life_placeholder = st.subheader(f"残りライフ❤️ : {st.session_state['lives']}/{MAX_LIVES} ({str(minutes).zfill(2)}:{str(seconds).zfill(2)})")
+    st.subheader(f"残りライフ❤️ : {st.session_state['lives']}/{MAX_LIVES} ({str(minutes).zfill(2)}:{str(seconds).zfill(2)})")
+    persist_game_data()
 
-    # --- 表示の左右分割 ---
+
+# ========================
+# 現在位置の入力
+# ========================
+@st.fragment
+@traced("render.input")
+def input_panel():
     col_left, col_center, col_right = st.columns([4, 1, 4])  # 左:操作, 右:結果
 
-    # --- 現在位置の入力 ---
     with col_left:
         st.subheader("現在地を入力してください")
-        lat = st.number_input("緯度 (例: 35.0)", value=35.0, format="%.4f")
-        lon = st.number_input("経度 (例: 139.0)", value=139.0, format="%.4f")
-        alt_m = st.number_input("高度 (例: 20 (m))", value=0.0, format="%.1f")
+        lat = st.number_input("緯度 (例: 35.0)", value=35.0, format="%.4f", key="lat")
+        lon = st.number_input("経度 (例: 139.0)", value=139.0, format="%.4f", key="lon")
+        alt_m = st.number_input("高度 (例: 20 (m))", value=0.0, format="%.1f", key="alt_m")
 
         current_position = f"現在地: (緯度{round(lat, 4)}˚, 経度{round(lon, 4)}˚, 高度{round(alt_m, 4)}m)"
         st.session_state["position_data"] = current_position
 
-        alt_km = alt_m / 1000 #kmに換算する
+    with col_right:
+        st.subheader("現在位置📍")
+        st.write(f"{st.session_state['position_data']}")
 
-    # ----------------------
-    # プレースホルダー作成
-    # ----------------------
+
+# =======================
+# 衛星リスト取得
+# =======================
+@st.fragment
+@traced("render.link")
+def link_panel():
+    API_KEY = st.secrets["N2YO_API_KEY"]
+    n2yo = init_n2yo_client(API_KEY)
+    visibility = init_visibility_engine()
+    visibility_index = init_visibility_index()
+    prefetcher = init_prefetcher(API_KEY)
+    col_left, col_center, col_right = st.columns([4, 1, 4])
 
     with col_right:
-        st.subheader("現在位置📍")
-        position_placeholder = st.empty() #リンクデータの表示領域
         st.subheader("衛星リンク📡")
-        link_placeholder = st.empty() #リンクデータの表示領域
-        st.subheader("衛星トラック⚡️")
-        track_placeholder = st.empty() #トラックデータの表示領域
-        st.subheader("スコア")
-        score_placeholder = st.empty() #スコアの表示領域
-        additional_placeholder = st.empty() #追加データの表示領域
-        st.subheader("履歴")
-        history_placeholder = st.empty() #過去データの表示領域
-
-        position_placeholder.write(f"{st.session_state['position_data']}")
-        link_placeholder.write(f"{st.session_state['link_data']}")
-        track_placeholder.write(f"{st.session_state['track_data']}")
-        score_placeholder.write(f"リンクスコア: {st.session_state['score_link']}\n\nトラックスコア: {st.session_state['score_track']}\n\nトータルスコア: {st.session_state['score_total']}")
-        history_texts = []
-        for index in range(len(st.session_state["history"])):
-            date, score = st.session_state["history"][index]
-            history_texts.append(f"{date} : {score}\n")
-        history_placeholder.write("\n".join(history_texts))
-
-        # st.subheader("履歴")
-        # if st.session_state["history"]:
-        #     for entry in st.session_state["history"]:
-        #         st.write(entry)
-        # else:
-        #     st.write("ー")
-
-
-    # =======================
-    # 衛星リスト取得
-    # =======================
+        st.write(f"{st.session_state['link_data']}")
 
     with col_left:
         if st.session_state["lives"] > 0:
@@ -252,97 +371,117 @@ def main():
                 if st.session_state["link_flag"] == True:
                     st.warning("リンクできるのは1度のみです")
                 else:
+                    lat, lon, alt_km = current_position()
                     with st.spinner("衛星リンク中…"):
-                        url = f"https://api.n2yo.com/rest/v1/satellite/above/{lat}/{lon}/{alt_km}/90/0/&apiKey={API_KEY}"
-                        response = requests.get(url)
-
-                    if response.status_code == 200:
-                        data = response.json()
-                        sat_list = data.get("above", [])
+                        # 先読み済みのセルならインデックスを引くだけ、それ以外はローカルカタログでその場で求め、
+                        # カタログが無ければN2YOに問い合わせる
+                        with metrics.span("visibility.index"):
+                            data = visibility_index.lookup(lat, lon)
+                        if data is None:
+                            with metrics.span("visibility.above"):
+                                data = visibility.above(lat, lon, alt_km, 90)
+                        quota_exceeded = False
+                        if data is None:
+                            try:
+                                data = n2yo.above(lat, lon, alt_km, 90, 0)
+                            except QuotaExceeded:
+                                data = None
+                                quota_exceeded = True
+                            except N2YOError:
+                                data = None
+
+                    if data is not None:
+                        # ライフの回復と消費は1文でまとめて行う（別タブと同時でも二重消費しない）
+                        with metrics.span("lives.consume"), init_db().transaction() as conn:
+                            consumed, state = lives.consume(conn, st.session_state["user_id"])
+                        apply_lives(state)
+                        if not consumed:
+                            st.error("ライフが足りません。")
+                            st.stop()
+
+                        # セッションには抽選した候補衛星とリンクスコアの集計だけを残す
+                        above = data.get("above", [])
+                        with metrics.span("scoring.link"):
+                            sat_list = SatelliteList.from_above(above, init_category_table(), sample_sat_indices(above))
+                        metrics.count("games_started_total")
                         st.session_state["sat_list"] = sat_list
-                        st.session_state["lives"] -= 1
-                        cookie_save_needed_flag = save_game_data_to_cookie()
                         st.session_state["track_flag"] = False
                         st.session_state["link_flag"] = True
-                        if st.session_state["lives"] == 4:
-                            st.session_state["last_recharge"] = datetime.now()
-                        st.success(f"{len(st.session_state['sat_list'])} 個の衛星とリンクしました！")
+                        flash("link", "success", f"{sat_list.total} 個の衛星とリンクしました！")
 
-                        if len(st.session_state["sat_list"]) <= 20:
-                            sat_index_list = [int(x) for x in range(len(st.session_state["sat_list"]))]
-                        else:
-                            sat_index_list = random.sample(range(len(st.session_state["sat_list"])), k=20)
-                        sat_index_list.sort()
-                        st.session_state["sat_random_index_list"] = sat_index_list
+                        # 最初に選ばれている候補衛星の位置を先読みしておく
+                        if "prefetch" in st.session_state:
+                            st.session_state["prefetch"].cancel()
+                        st.session_state["prefetch"] = prefetcher.start(sat_list.satids()[:1], lat, lon, alt_km)
 
                         if sat_list:
                             link_placeholder_texts = []
                             # link_placeholder_texts.append("### 衛星一覧（上位20件）")
-                            for index in sat_index_list:
-                                sat = sat_list[index]
+                            for sat in sat_list:
                                 link_placeholder_texts.append(f"**{sat['satname']}**  " + f"(ID: {sat['satid']}, 打ち上げ: {sat['launchDate']})\n")
                             st.session_state["link_data"] = "\n".join(link_placeholder_texts)
-                            link_placeholder.write(st.session_state["link_data"])
                         else:
-                            st.warning("衛星が見つかりませんでした。")
+                            flash("link", "warning", "衛星が見つかりませんでした。")
 
+                        # トラック・スコア欄も新しいリンク結果で描き直す
+                        persist_game_data()
+                        st.rerun()
+
+                    elif quota_exceeded:
+                        st.error("APIの利用上限に達しました。しばらく待ってからもう一度お試しください。")
                     else:
                         st.error("APIリクエストに失敗しました。APIキーやリクエスト制限を確認してください。")
         else:
             next_recover = st.session_state["last_recharge"] + RECOVER_INTERVAL
-            remaining = next_recover - now
+            remaining = next_recover - datetime.now()
             minutes, seconds = divmod(int(remaining.total_seconds()), 60)
             st.error(f"ライフが足りません。次の回復まで {minutes}分 {seconds}秒")
+        show_flash("link")
+    persist_game_data()
 
 
-    # =======================
-    # リンクスコア計算
-    # =======================
+# =======================
+# リンクスコア計算・トラック
+# =======================
+@st.fragment
+@traced("render.track")
+def track_panel():
+    API_KEY = st.secrets["N2YO_API_KEY"]
+    n2yo = init_n2yo_client(API_KEY)
+    orbit_catalog = init_orbit_catalog()
+    pass_tracker = init_pass_tracker(API_KEY)
+    prefetcher = init_prefetcher(API_KEY)
+    col_left, col_center, col_right = st.columns([4, 1, 4])
+
+    with col_right:
+        st.subheader("衛星トラック⚡️")
+        st.write(f"{st.session_state['track_data']}")
+
     with col_left:
         if "sat_list" in st.session_state and st.session_state["sat_list"]:
-            # 基本スコア計算（リンク取得分）
-            basic_score = 0
-            for sat in st.session_state["sat_list"]:
-                satname = sat['satname']
-                # 高度による簡易スコア
-                if "STARLINK" in satname.upper():
-                    basic_score += 2
-                elif "ISS" in satname.upper():
-                    basic_score += 3
-                else:
-                    basic_score += 1
+            # 基本スコア計算（リンク取得分）: リンク時に集計済み
+            sat_list = st.session_state["sat_list"]
+            basic_score = sat_list.score
             st.session_state["score_link"] = basic_score
             st.session_state["score_total"] = st.session_state["score_link"] + st.session_state["score_track"]
-            score_placeholder.write(f"リンクスコア: {st.session_state['score_link']}\nトラックスコア: {st.session_state['score_track']}\nトータルスコア: {st.session_state['score_total']}")
             st.write(f"リンクスコア: {basic_score} 点")
             # =======================
             # トラック選択
             # =======================
-            if not "sat_random_index_list" in st.session_state:
-                if len(st.session_state["sat_list"]) <= 20:
-                    sat_index_list = [int(x) for x in range(len(st.session_state["sat_list"]))]
-                else:
-                    sat_index_list = random.sample(range(len(st.session_state["sat_list"])), k=20)
-                sat_index_list.sort()
-                st.session_state["sat_random_index_list"] = sat_index_list
-            else:
-                sat_index_list = st.session_state["sat_random_index_list"]
-
-            sat_names = []
-            for index in sat_index_list:
-                sat = st.session_state['sat_list'][index]
-                sat_names.append(f"{sat['satname']} (ID:{sat['satid']})")
-
-            sat_options = [(sat['satname'], sat['satid']) 
-                        for index in sat_index_list 
-                        for sat in [st.session_state['sat_list'][index]]
-                        ]
+            # 選択肢は候補衛星の添字（表示名は候補衛星から引く）
+            lat, lon, _ = current_position()
+            expected = expected_scores(sat_list, lat, lon)
             choice = st.selectbox(
-                "トラックする衛星を選んでください", 
-                sat_options, 
-                format_func=lambda x: f"{x[0]} (ID:{x[1]})"
+                "トラックする衛星を選んでください",
+                range(len(sat_list)),
+                format_func=lambda x: f"{sat_list[x].satname} (ID:{sat_list[x].satid}) 予想 {expected[x]} 点"
                 )
-
+            # 選択を変えたらその候補衛星の位置を先読みする（済みなら何もしない）
+            if "prefetch" in st.session_state and not st.session_state["track_flag"]:
+                prefetcher.prefetch(st.session_state["prefetch"], sat_list[choice].satid)
+            mode = st.radio("トラックモード", (INSTANT_MODE, PASS_MODE), horizontal=True, key="track_mode")
+            if mode == PASS_MODE:
+                pass_seconds = st.select_slider("追跡時間（秒）", options=PASS_WINDOWS, value=120, key="pass_seconds")
 
             if st.button("トラック！"):
                 if st.session_state["link_flag"] == False:
@@ -351,47 +490,23 @@ def main():
                     st.warning("衛星のトラックできるのは1度のみです")
                 else:
                     # 衛星IDを取得
-                    sat_name, sat_id = choice
-                    st.write(f"選んだ衛星: {sat_name}, ID: {sat_id}")
+                    sat_name, sat_id = sat_list[choice].satname, sat_list[choice].satid
+                    lat, lon, alt_km = current_position()
 
-                    # 衛星位置を取得
+                    # 衛星位置を取得して採点
                     with st.spinner("衛星トラック中…"):
-                        url = f"https://api.n2yo.com/rest/v1/satellite/positions/{sat_id}/{lat}/{lon}/{alt_km}/1/&apiKey={API_KEY}"
-                        response = requests.get(url)
-
-                    if response.status_code == 200:
-                        sat_data = response.json()
-                        pos = sat_data.get("positions", [])[0]
-
-                        sat_lat = pos["satlatitude"]
-                        sat_lon = pos["satlongitude"]
-
-                        # 距離計算（簡易：地表での距離）
-                        def haversine(lat1, lon1, lat2, lon2):
-                            R = 6371.0  # 地球半径 km
-                            phi1, phi2 = math.radians(lat1), math.radians(lat2)
-                            dphi = math.radians(lat2 - lat1)
-                            dlambda = math.radians(lon2 - lon1)
-                            a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
-                            return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1-a))
-
-                        distance = haversine(lat, lon, sat_lat, sat_lon)
+                        if mode == PASS_MODE:
+                            result, quota_exceeded = track_pass(pass_tracker, sat_id, lat, lon, alt_km, pass_seconds)
+                        else:
+                            result, quota_exceeded = track_instant(n2yo, orbit_catalog, sat_id, lat, lon, alt_km)
+
+                    if result is not None:
+                        distance, track_score, track_lines, result_lines = result
                         track_placeholder_texts = []
                         track_placeholder_texts.append(f"選んだ衛星: {sat_name}, ID: {sat_id}\n")
-                        track_placeholder_texts.append(f"衛星位置: 緯度 {sat_lat:.2f}, 経度 {sat_lon:.2f}\n")
-                        track_placeholder_texts.append(f"観測地点との距離: 約 {distance:.1f} km\n")
-                        st.write(f"観測地点との距離: 約 {distance:.1f} km")
+                        for line in track_lines:
+                            track_placeholder_texts.append(f"{line}\n")
                         st.session_state["track_data"] = "\n".join(track_placeholder_texts)
-                        track_placeholder.write(st.session_state["track_data"])
-                        # 距離スコア判定
-                        if distance < 1000:
-                            track_score = 3000 - distance
-                        elif distance < 3000:
-                            track_score = 2000 - (distance-1000) / 2
-                        elif distance < 7000:
-                            track_score = 1000 - (distance-3000) / 4
-                        else:
-                            track_score = 0
 
                         # キャラクターボーナス（例）
                         bonus_multiplier = 1.0
@@ -402,26 +517,37 @@ def main():
                         st.session_state["score_track"] = total_track_score
                         total_score = st.session_state["score_link"] + st.session_state["score_track"]
                         st.session_state["score_total"] = total_score
-                        score_text = []
-                        score_text.append(f"リンクスコア: {st.session_state['score_link']}\n")
-                        score_text.append(f"トラックスコア: {st.session_state['score_track']}\n")
-                        score_text.append(f"トータルスコア: {st.session_state['score_total']}\n")
-                        score_text_sum = "\n".join(score_text)
-                        score_placeholder.write(score_text_sum)
-                        st.write(f"トラックスコア: {total_track_score} 点")
-                        st.write(f"トータルスコア: {total_score} 点")
+                        flash("track", "write", f"選んだ衛星: {sat_name}, ID: {sat_id}")
+                        for line in result_lines:
+                            flash("track", "write", line)
+                        flash("track", "write", f"トラックスコア: {total_track_score} 点")
+                        flash("track", "write", f"トータルスコア: {total_score} 点")
                         # 履歴へ残す
                         date_history = datetime.now().isoformat()
                         score_history = f"リンクスコア: {st.session_state['score_link']}\t\tトラックスコア: {st.session_state['score_track']}\t\tトータルスコア: {st.session_state['score_total']}"
                         st.session_state["history"].append([date_history, score_history])
+                        st.session_state["last_game"] = {
+                            "score_link": st.session_state["score_link"],
+                            "score_track": st.session_state["score_track"],
+                            "score_total": st.session_state["score_total"],
+                            "satid": sat_id,
+                            "distance": distance,
+                        }
                         st.session_state["history_renew_flag"] = True
-                        cookie_save_needed_flag = save_game_data_to_cookie()
+                        metrics.count("games_finished_total")
+                        save_game_data_to_cookie()
+
+                        # スコア・履歴欄を描き直す
+                        persist_game_data()
+                        st.rerun()
+                    elif quota_exceeded:
+                        st.error("APIの利用上限に達しました。しばらく待ってからもう一度お試しください。")
                     else:
                         st.error("APIエラー: 衛星位置を取得できませんでした。")
+            show_flash("track")
 
-    with col_left:
         if st.button("もう一回プレイする"):
-            st.success("データはリセットされました。")
+            flash("reset", "success", "データはリセットされました。")
             st.session_state["track_flag"] = False
             st.session_state["link_flag"] = False
             st.session_state["link_data"] = "ー"
@@ -429,24 +555,98 @@ def main():
             st.session_state["score_link"] = 0
             st.session_state["score_track"] = 0
             st.session_state["score_total"] = 0
-            link_placeholder.write("ー") #リンクデータの表示領域
-            track_placeholder.write("ー") #トラックデータの表示領域
-            score_placeholder.write("ー") #スコアの表示領域
-            # additional_placeholder.write("-") #追加データの表示領域
-            cookie_save_needed_flag = save_game_data_to_cookie()
+            if "prefetch" in st.session_state:
+                st.session_state["prefetch"].cancel()
+                del st.session_state["prefetch"]
+            save_game_data_to_cookie()
+            persist_game_data()
+            st.rerun()
+        show_flash("reset")
+    persist_game_data()
+
+
+# =======================
+# スコア・履歴
+# =======================
+@st.fragment
+@traced("render.score")
+def score_panel():
+    col_left, col_center, col_right = st.columns([4, 1, 4])
 
-    # --- cookieの保存 ---
-    if cookie_save_needed_flag == True:
-        update_user(conn, {
-            "user_id": st.session_state["user_id"],
-            "lives": st.session_state["game_data"]["lives"],
-            "last_recharge": st.session_state["game_data"]["last_recharge"],
-        })
-    if st.session_state["history_renew_flag"] == True:
-        date_history, score_history = st.session_state["history"][-1]
-        add_history(conn, user_id, score_history, max_size=HISTORY_MAX_SIZE)
-        st.session_state["history_renew_flag"] = False
+    with col_right:
+        st.subheader("スコア")
+        st.write(f"リンクスコア: {st.session_state['score_link']}\n\nトラックスコア: {st.session_state['score_track']}\n\nトータルスコア: {st.session_state['score_total']}")
+        additional_placeholder = st.empty() #追加データの表示領域
+
+        st.subheader("履歴")
+        history = st.session_state["history"]
+        history_text = session_memo(
+            "history",
+            (len(history), tuple(history[-1]) if history else None),
+            lambda: "\n".join(f"{date} : {score}\n" for date, score in history),
+        )
+        st.write(history_text)
+
+        st.subheader("ランキング🏆")
+        ranking, my_rank = load_leaderboard(st.session_state["user_id"])
+        ranking_texts = []
+        for index, entry in enumerate(ranking):
+            ranking_texts.append(f"{index + 1}位 : {entry['best_score']}点 ({entry['user_id'][:8]})\n")
+        if my_rank is not None:
+            ranking_texts.append(f"あなたの順位: {my_rank['rank']}位 / {my_rank['users']}人 (ベスト {my_rank['best_score']}点)\n")
+        st.write("\n".join(ranking_texts) if ranking_texts else "ー")
+
+
+# ========================
+# デバッグ表示
+# ========================
+def debug_panel():
+    # 計測が有効で URL に ?debug=1 を付けた時だけ、直近のリランのスパンの木を新しい順に表示する
+    if not metrics.enabled() or st.query_params.get("debug") != "1":
+        return
+    with st.expander("デバッグ: 直近のリランの処理時間"):
+        traces = sorted(
+            (trace for recent in st.session_state.get("traces", {}).values() for trace in recent),
+            key=lambda trace: trace.start,
+        )
+        st.code("\n\n".join(trace.format() for trace in reversed(traces)) if traces else "ー")
+
+
+# ========================
+# アプリ本体
+# ========================
+# 各パネルはフラグメントなので、ボタン等の操作ではそのパネルだけが再実行される。
+# パネルをまたいで状態が変わる操作（リンク・トラック・リセット）だけ st.rerun() で全体を描き直す。
+
+@traced("rerun")
+def main():
+    # --- cookieデータに基づくユーザデータ取得 ---
+    init_metrics()
+    storage = init_db() #dbの初期化（キャッシュ済みのエンジンを取得）
+    user_id = get_or_set_user_id() #user_idをcookieから取得
+
+    st.set_page_config(
+        page_title="衛星トラッキングデモ",
+        layout="wide"   # <- ここで全幅レイアウトに変更
+    )
+
+    # ----------------------
+    # 状態量初期化
+    # ----------------------
+    init_session_state(storage, user_id)
+
+    # --- タイトル ---
+    st.title("衛星トラックゲーム デモ")
+
+    life_panel()
+    input_panel()
+    link_panel()
+    track_panel()
+    score_panel()
+    debug_panel()
+
+    persist_game_data()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+
+# ========================
+# 設定
+# ========================
+PERIOD_ALL = "all"
+PERIOD_DAY = "day"
+PERIOD_WEEK = "week"
+PERIODS = (PERIOD_ALL, PERIOD_DAY, PERIOD_WEEK)
+
+# leaderboard: 期間毎・ユーザー毎のベストスコア
+# leaderboard_counts: 期間毎に「ベストスコアが score のユーザー数」を持つ集計表（順位計算用）
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS leaderboard (
+        period TEXT NOT NULL,
+        period_start TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        best_score INTEGER NOT NULL,
+        games INTEGER NOT NULL,
+        PRIMARY KEY (period, period_start, user_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_leaderboard_score ON leaderboard (period, period_start, best_score DESC)",
+    """
+    CREATE TABLE IF NOT EXISTS leaderboard_counts (
+        period TEXT NOT NULL,
+        period_start TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        users INTEGER NOT NULL,
+        PRIMARY KEY (period, period_start, score)
+    )
+    """,
+]
+
+SQL_SELECT_BEST = "SELECT best_score FROM leaderboard WHERE period=? AND period_start=? AND user_id=?"
+SQL_INSERT_BEST = "INSERT INTO leaderboard (period, period_start, user_id, best_score, games) VALUES (?, ?, ?, ?, 1)"
+SQL_UPDATE_BEST = "UPDATE leaderboard SET best_score=max(best_score, ?), games=games+1 WHERE period=? AND period_start=? AND user_id=?"
+SQL_BUMP_COUNT = """
+    INSERT INTO leaderboard_counts (period, period_start, score, users) VALUES (?, ?, ?, ?)
+    ON CONFLICT (period, period_start, score) DO UPDATE SET users=users+excluded.users
+"""
+SQL_TOP = """
+    SELECT user_id, best_score, games FROM leaderboard
+    WHERE period=? AND period_start=? ORDER BY best_score DESC, user_id LIMIT ?
+"""
+SQL_RANK = "SELECT COALESCE(SUM(users), 0) + 1 FROM leaderboard_counts WHERE period=? AND period_start=? AND score>?"
+SQL_USERS = "SELECT COALESCE(SUM(users), 0) FROM leaderboard_counts WHERE period=? AND period_start=?"
+
+
+def period_start(period, when):
+    if isinstance(when, str):
+        when = datetime.fromisoformat(when)
+    if period == PERIOD_DAY:
+        return when.date().isoformat()
+    elif period == PERIOD_WEEK:
+        return (when.date() - timedelta(days=when.weekday())).isoformat() #月曜始まり
+    return ""
+
+
+# ========================
+# 記録
+# ========================
+def record_score(conn, user_id, score, when):
+    # 全期間・日・週の各ランキングを1ゲーム分だけ更新する（トランザクションは呼び出し側）
+    for period in PERIODS:
+        start = period_start(period, when)
+        row = conn.execute(SQL_SELECT_BEST, (period, start, user_id)).fetchone()
+        if row is None:
+            conn.execute(SQL_INSERT_BEST, (period, start, user_id, score))
+            conn.execute(SQL_BUMP_COUNT, (period, start, score, 1))
+            continue
+        conn.execute(SQL_UPDATE_BEST, (score, period, start, user_id))
+        if score > row[0]:
+            conn.execute(SQL_BUMP_COUNT, (period, start, row[0], -1))
+            conn.execute(SQL_BUMP_COUNT, (period, start, score, 1))
+
+
+# ========================
+# 参照
+# ========================
+def top(conn, period=PERIOD_ALL, k=10, when=None):
+    start = period_start(period, when or datetime.now())
+    return [
+        {"user_id": user_id, "best_score": best_score, "games": games}
+        for user_id, best_score, games in conn.execute(SQL_TOP, (period, start, k)).fetchall()
+    ]
+
+def rank_of(conn, user_id, period=PERIOD_ALL, when=None):
+    # 自分より高いベストスコアのユーザー数 + 1（未プレイなら None）
+    start = period_start(period, when or datetime.now())
+    row = conn.execute(SQL_SELECT_BEST, (period, start, user_id)).fetchone()
+    if row is None:
+        return None
+    rank = conn.execute(SQL_RANK, (period, start, row[0])).fetchone()[0]
+    users = conn.execute(SQL_USERS, (period, start)).fetchone()[0]
+    return {"user_id": user_id, "best_score": row[0], "rank": rank, "users": users}
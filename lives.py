@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+# ========================
+# 設定
+# ========================
+MAX_LIVES = 5
+RECOVER_INTERVAL = timedelta(hours=1) #1時間ごとに1回復
+
+# 保存済みの last_recharge から回復数 n を求め、回復後のライフと回復時刻を計算する副問い合わせ
+# （時刻は ISO 形式の文字列のまま julianday で計算する）
+_RECHARGED = """
+    SELECT
+        user_id,
+        MIN(:max_lives, lives + n) AS lives,
+        CASE WHEN n > 0
+            THEN strftime('%Y-%m-%dT%H:%M:%f', julianday(last_recharge) + n * :interval / 86400.0)
+            ELSE last_recharge
+        END AS last_recharge,
+        n
+    FROM (
+        SELECT user_id, lives, last_recharge,
+            MAX(0, CAST((julianday(:now) - julianday(last_recharge)) * 86400.0 / :interval AS INTEGER)) AS n
+        FROM users WHERE user_id=:user_id
+    )
+"""
+
+# 回復だけ行う（回復が無ければ更新しない）
+SQL_RECHARGE = f"""
+    UPDATE users SET lives=calc.lives, last_recharge=calc.last_recharge
+    FROM ({_RECHARGED}) AS calc
+    WHERE users.user_id=calc.user_id AND calc.n > 0
+    RETURNING users.lives, users.last_recharge
+"""
+
+# 回復してから1つ消費する。満タンから減った時は回復タイマーをその時刻から始める
+SQL_CONSUME = f"""
+    UPDATE users SET
+        lives=calc.lives - 1,
+        last_recharge=CASE WHEN calc.lives = :max_lives THEN :now ELSE calc.last_recharge END
+    FROM ({_RECHARGED}) AS calc
+    WHERE users.user_id=calc.user_id AND calc.lives > 0
+    RETURNING users.lives, users.last_recharge
+"""
+
+SQL_SELECT_LIVES = "SELECT lives, last_recharge FROM users WHERE user_id=?"
+
+
+# ========================
+# ライフの回復・消費
+# ========================
+# どちらも1文の UPDATE ... RETURNING で保存済みの値に対して評価するので、
+# 同じユーザーを複数タブで開いていても二重消費・二重回復にならない
+
+def _params(user_id, now):
+    return {
+        "user_id": user_id,
+        "now": (now or datetime.now()).isoformat(),
+        "max_lives": MAX_LIVES,
+        "interval": RECOVER_INTERVAL.total_seconds(),
+    }
+
+def _result(row):
+    return {"lives": row[0], "last_recharge": row[1]}
+
+def get_lives(conn, user_id):
+    row = conn.execute(SQL_SELECT_LIVES, (user_id,)).fetchone()
+    return _result(row) if row is not None else None
+
+def recharge(conn, user_id, now=None):
+    # 回復後の値を返す（回復が無ければ保存済みの値）
+    row = conn.execute(SQL_RECHARGE, _params(user_id, now)).fetchone()
+    if row is None:
+        return get_lives(conn, user_id)
+    return _result(row)
+
+def consume(conn, user_id, now=None):
+    # ライフを1つ消費できたら (True, 消費後の値)、足りなければ (False, 回復後の値)
+    row = conn.execute(SQL_CONSUME, _params(user_id, now)).fetchone()
+    if row is None:
+        return False, recharge(conn, user_id, now)
+    return True, _result(row)
@@ -0,0 +1,215 @@
+import os
+import time
+import bisect
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# ========================
+# 設定
+# ========================
+PREFIX = "satrack"
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) #秒
+EXPORT_INTERVAL = 10 #ファイル出力の間隔（秒）
+
+# 無効時は span() も count() も何もしない（呼び出しのコストだけ）
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+_histograms = {} #(名前, ラベル) -> [バケット毎の件数..., 合計, 件数]
+_counters = {} #(名前, ラベル) -> 値
+_gauges = {} #(名前, ラベル) -> 値
+
+
+def configure(enabled=True):
+    global _enabled
+    _enabled = enabled
+
+def enabled():
+    return _enabled
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _gauges.clear()
+
+
+# ========================
+# 計測
+# ========================
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def count(name, value=1, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def gauge(name, value, **labels):
+    if not _enabled:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def observe(name, seconds, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        h[bisect.bisect_left(BUCKETS, seconds)] += 1
+        h[-2] += seconds
+        h[-1] += 1
+
+
+class Span:
+    # 処理時間を計測し、親スパンの子として記録する（スレッド毎にスパンの木を作る）
+    __slots__ = ("name", "start", "duration", "children")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = 0.0
+        self.duration = 0.0
+        self.children = []
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        if stack:
+            stack[-1].children.append(self)
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.duration = time.perf_counter() - self.start
+        stack = _local.stack
+        stack.pop()
+        observe("span_duration_seconds", self.duration, span=self.name)
+        if not stack:
+            _local.last_trace = self
+        return False
+
+    def walk(self, depth=0):
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth + 1)
+
+    def format(self):
+        return "\n".join(f"{'  ' * depth}{span.name}: {span.duration * 1000:.2f} ms" for depth, span in self.walk())
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+def span(name):
+    if not _enabled:
+        return _NOOP
+    return Span(name)
+
+def summary(name="span_duration_seconds"):
+    # ヒストグラムのラベル毎の (件数, 合計秒)（ベンチマーク・デバッグ用）
+    with _lock:
+        return {labels: (h[-1], h[-2]) for (metric, labels), h in _histograms.items() if metric == name}
+
+def last_trace():
+    # このスレッドで最後に完了したルートスパン
+    return getattr(_local, "last_trace", None)
+
+
+# ========================
+# Prometheus 形式での出力
+# ========================
+def _labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+def render_prometheus():
+    with _lock:
+        histograms = {k: list(v) for k, v in _histograms.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+
+    lines = []
+    typed = set()
+    for (name, labels), value in sorted(counters.items()):
+        metric = f"{PREFIX}_{name}"
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} counter")
+            typed.add(metric)
+        lines.append(f"{metric}{_labels(labels)} {value}")
+    for (name, labels), value in sorted(gauges.items()):
+        metric = f"{PREFIX}_{name}"
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} gauge")
+            typed.add(metric)
+        lines.append(f"{metric}{_labels(labels)} {value}")
+    for (name, labels), h in sorted(histograms.items()):
+        metric = f"{PREFIX}_{name}"
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} histogram")
+            typed.add(metric)
+        cumulative = 0
+        for bound, n in zip(BUCKETS, h):
+            cumulative += n
+            lines.append(f"{metric}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{metric}_bucket{_labels(labels, [('le', '+Inf')])} {h[-1]}")
+        lines.append(f"{metric}_sum{_labels(labels)} {h[-2]}")
+        lines.append(f"{metric}_count{_labels(labels)} {h[-1]}")
+    return "\n".join(lines) + "\n"
+
+def write_prometheus(path):
+    # node_exporter の textfile collector 等で読めるようにアトミックに書き出す
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+
+def start_exporter(port=None, path=None, interval=EXPORT_INTERVAL, host="127.0.0.1"):
+    # port を指定するとローカルの /metrics エンドポイント、path を指定すると定期的なファイル出力
+    server = None
+    if port is not None:
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+
+    if path is not None:
+        def write_loop():
+            while True:
+                time.sleep(interval)
+                write_prometheus(path)
+
+        threading.Thread(target=write_loop, name="metrics-file", daemon=True).start()
+    return server
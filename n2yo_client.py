@@ -0,0 +1,312 @@
+import time
+import threading
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from quota import PRIORITY_INTERACTIVE, PRIORITY_WAIT
+
+# ========================
+# 設定
+# ========================
+BASE_URL = "https://api.n2yo.com/rest/v1/satellite"
+TIMEOUT = (3.05, 10) #(接続, 読み込み) タイムアウト秒
+RETRY_TOTAL = 3 #リトライ回数の上限（送信は最大 RETRY_TOTAL + 1 回で、1回毎にクォータを1つ使う）
+RETRY_BACKOFF = 0.5 #リトライ間隔 0.5, 1.0, 2.0 ...秒
+RETRY_STATUS = (500, 502, 503, 504) #429 は送り直すと制限が長引くだけなのでリトライしない
+POOL_MAXSIZE = 16 #keep-alive で保持する接続数
+
+CACHE_SIZE = 1024 #レスポンスキャッシュの最大件数
+CACHE_TTL = 10 #キャッシュの有効期間（秒）
+GRID_DEG = 0.05 #緯度経度の量子化幅（度）
+GRID_ALT_KM = 0.5 #高度の量子化幅（km）
+POSITIONS_MAX_SECONDS = 300 #positions で1回に取れる軌道の長さの上限（秒）
+STALE_TTL = 600 #クォータ不足の時に代わりに返す古い結果の有効期間（秒）
+# 同じリクエストの完了を待つ最大時間（秒）。先行リクエストの最悪の所要時間
+# （送信毎のトークン待ち + 接続・読み込みタイムアウト、リトライ間隔）より長くする
+SINGLE_FLIGHT_TIMEOUT = (
+    (RETRY_TOTAL + 1) * (PRIORITY_WAIT[PRIORITY_INTERACTIVE] + sum(TIMEOUT))
+    + RETRY_BACKOFF * (2 ** RETRY_TOTAL - 1)
+    + 5
+)
+
+
+def positions_from(positions, now):
+    # N2YO positions の軌道（1秒毎）のうち現在時刻 now 以降の部分。now を含まなければ None
+    if not positions or not positions[0]["timestamp"] <= now <= positions[-1]["timestamp"]:
+        return None
+    return positions[min(now - positions[0]["timestamp"], len(positions) - 1):]
+
+
+class N2YOError(Exception):
+    pass
+
+
+class QuotaExceeded(N2YOError):
+    # APIの利用上限に達していて、代わりに返せる結果も無い
+    pass
+
+
+# ========================
+# レスポンスキャッシュ（TTL + LRU）
+# ========================
+class ResponseCache:
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if self.clock() - stored_at < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def peek(self, key):
+        # 統計を数えずに有効な値を返す（取得直前の再確認用）
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.clock() - entry[0] < self.ttl:
+                return entry[1]
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (self.clock(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "size": len(self._data),
+            }
+
+
+# ========================
+# 同一リクエストの集約（single-flight）
+# ========================
+# 同じキーのリクエストが実行中なら新たに送らず、その結果（または例外）を全員で共有する
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self.leaders = 0 #実際に送信したリクエスト数
+        self.followers = 0 #実行中のリクエストに相乗りした数
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.leaders += 1
+                leader = True
+            else:
+                self.followers += 1
+                leader = False
+            in_flight = len(self._flights)
+        metrics.count("n2yo_singleflight_total", role="leader" if leader else "follower")
+        metrics.gauge("n2yo_singleflight_in_flight", in_flight)
+
+        if not leader:
+            if not flight.done.wait(self.timeout if timeout is None else timeout):
+                raise N2YOError("同一リクエストの完了待ちがタイムアウトしました")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                in_flight = len(self._flights)
+            metrics.gauge("n2yo_singleflight_in_flight", in_flight)
+            flight.done.set()
+        return flight.result
+
+    def stats(self):
+        with self._lock:
+            total = self.leaders + self.followers
+            return {
+                "leaders": self.leaders,
+                "followers": self.followers,
+                "in_flight": len(self._flights),
+                "coalescing_ratio": self.followers / total if total else 0.0,
+            }
+
+
+# ========================
+# N2YO クライアント
+# ========================
+# プロセス全体で1つだけ生成し（st.cache_resource でキャッシュ）、全セッションで共有する
+
+class N2YOClient:
+    def __init__(self, api_key, base_url=BASE_URL, grid_deg=GRID_DEG, grid_alt_km=GRID_ALT_KM, cache=None, session=None, quota=None,
+                 clock=time.time, sleep=time.sleep):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.grid_deg = grid_deg
+        self.grid_alt_km = grid_alt_km
+        self.cache = cache if cache is not None else ResponseCache()
+        # 最後に取得できた結果（時間バケットを除いたキー毎）。クォータ不足の時だけ使う
+        self.stale = ResponseCache(ttl=STALE_TTL)
+        self.quota = quota #QuotaManager（None なら制限しない）
+        self.flights = SingleFlight()
+        self.clock = clock #時間バケットと古い軌道の判定に使う UNIX 時刻
+        self.sleep = sleep
+        self.session = session if session is not None else self._make_session()
+
+    def _make_session(self):
+        # リトライは urllib3 に任せず _fetch で行う（送り直す度にクォータを取るため）
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def quantize(self, lat, lon, alt_km):
+        # 近い観測地点は同じグリッドセルの中心にまとめる
+        cell_lat = round(round(lat / self.grid_deg) * self.grid_deg, 6)
+        cell_lon = round(round(lon / self.grid_deg) * self.grid_deg, 6)
+        cell_alt = round(round(alt_km / self.grid_alt_km) * self.grid_alt_km, 3)
+        return cell_lat, cell_lon, cell_alt
+
+    def _time_bucket(self):
+        return int(self.clock() // self.cache.ttl)
+
+    def _get(self, key, stale_key, path, priority):
+        data = self.cache.get(key)
+        metrics.count("n2yo_cache_requests_total", result="miss" if data is None else "hit")
+        if metrics.enabled():
+            metrics.gauge("n2yo_cache_hit_ratio", self.cache_stats()["hit_ratio"])
+        if data is not None:
+            return data
+        return self.flights.do(key, lambda: self._load(key, stale_key, path, priority))
+
+    def _load(self, key, stale_key, path, priority):
+        # 先行のリクエストが終わった直後にキャッシュを外した呼び出しは、送り直さずにその結果を使う
+        data = self.cache.peek(key)
+        if data is not None:
+            return data
+        return self._fetch_with_quota(key, stale_key, path, priority)
+
+    def _fetch_with_quota(self, key, stale_key, path, priority):
+        if self.quota is None:
+            return self._fetch(key, stale_key, path)
+        endpoint = path.split("/", 1)[0]
+        acquire = lambda: self.quota.acquire(endpoint, priority)
+        # 縮退モードでは古い結果があればそれを返し、残りのトークンは結果が無い人のために残す
+        if self.quota.degraded(endpoint):
+            data = self._stale(stale_key)
+            if data is not None:
+                metrics.count("n2yo_degraded_responses_total", endpoint=endpoint)
+                return data
+        if acquire():
+            return self._fetch(key, stale_key, path, acquire)
+        data = self._stale(stale_key)
+        if data is not None:
+            metrics.count("n2yo_degraded_responses_total", endpoint=endpoint)
+            return data
+        raise QuotaExceeded(f"{endpoint}: quota exhausted")
+
+    def _stale(self, stale_key):
+        # 古い結果のうち今も使える分。positions は現在時刻を含む軌道だけを、現在時刻のサンプルから返す
+        data = self.stale.get(stale_key)
+        if data is None or stale_key[0] != "positions":
+            return data
+        positions = positions_from(data.get("positions", []), int(self.clock()))
+        if positions is None:
+            return None
+        return {**data, "positions": positions}
+
+    def _send(self, url, endpoint):
+        # 1回だけ送信する。戻り値: (レスポンス, リトライしてよい失敗の例外)
+        try:
+            with metrics.span(f"n2yo.{endpoint}"):
+                response = self.session.get(url, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            metrics.count("n2yo_requests_total", endpoint=endpoint, status="error")
+            error = N2YOError(str(e))
+            error.__cause__ = e
+            return None, error
+        metrics.count("n2yo_requests_total", endpoint=endpoint, status=response.status_code)
+        if response.status_code in RETRY_STATUS:
+            return None, N2YOError(f"HTTP {response.status_code}")
+        return response, None
+
+    def _fetch(self, key, stale_key, path, acquire=None):
+        # 最初の送信分のトークンは呼び出し側で取得済み。リトライの度に acquire でもう1つ取り、
+        # 取れなければ直前の失敗をそのまま返す
+        url = f"{self.base_url}/{path}/&apiKey={self.api_key}"
+        endpoint = path.split("/", 1)[0]
+        response, error = self._send(url, endpoint)
+        for attempt in range(RETRY_TOTAL):
+            if error is None:
+                break
+            self.sleep(RETRY_BACKOFF * 2 ** attempt)
+            if acquire is not None and not acquire():
+                break
+            response, error = self._send(url, endpoint)
+        if error is not None:
+            raise error
+        if response.status_code != 200:
+            raise N2YOError(f"HTTP {response.status_code}")
+        try:
+            data = response.json()
+        except ValueError as e:
+            raise N2YOError("invalid JSON response") from e
+        if "error" in data:
+            raise N2YOError(data["error"])
+        self.cache.put(key, data)
+        self.stale.put(stale_key, data)
+        return data
+
+    def above(self, lat, lon, alt_km, radius=90, category=0, priority=PRIORITY_INTERACTIVE):
+        lat, lon, alt_km = self.quantize(lat, lon, alt_km)
+        stale_key = ("above", lat, lon, alt_km, radius, category)
+        return self._get(stale_key + (self._time_bucket(),), stale_key, f"above/{lat}/{lon}/{alt_km}/{radius}/{category}", priority)
+
+    def positions(self, sat_id, lat, lon, alt_km, seconds=1, priority=PRIORITY_INTERACTIVE):
+        lat, lon, alt_km = self.quantize(lat, lon, alt_km)
+        key = ("positions", sat_id, lat, lon, alt_km, seconds, self._time_bucket())
+        # 衛星の緯度経度は観測地点によらないので、古い結果は観測地点を問わず使い回す
+        stale_key = ("positions", sat_id, seconds)
+        return self._get(key, stale_key, f"positions/{sat_id}/{lat}/{lon}/{alt_km}/{seconds}", priority)
+
+    def cache_stats(self):
+        return self.cache.stats()
+
+    def flight_stats(self):
+        return self.flights.stats()
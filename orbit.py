@@ -0,0 +1,283 @@
+import os
+import sys
+import math
+import time
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+import requests
+from sgp4.api import Satrec, SatrecArray, jday
+
+# ========================
+# 設定
+# ========================
+TLE_PATH = "catalog.tle" #TLEカタログ（refresh_catalog で別ジョブから更新する）
+TLE_SOURCE_URL = "https://celestrak.org/NORAD/elements/gp.php?GROUP=active&FORMAT=tle"
+RELOAD_CHECK_INTERVAL = 60 #カタログファイルの更新を確認する間隔（秒）
+
+# WGS84
+EARTH_A = 6378.137 #赤道半径 km
+EARTH_F = 1 / 298.257223563
+EARTH_E2 = EARTH_F * (2 - EARTH_F)
+
+
+# ========================
+# 座標変換
+# ========================
+def gmst(jd, fr):
+    # グリニッジ平均恒星時（IAU-82）[rad]（jd, fr は配列でもよい）
+    t = (jd - 2451545.0 + fr) / 36525.0
+    g = 67310.54841 + (876600.0 * 3600 + 8640184.812866) * t + 0.093104 * t * t - 6.2e-6 * t * t * t
+    return np.radians((g % 86400.0) / 240.0)
+
+def teme_to_ecef(r, jd, fr):
+    # 極運動は無視して地球自転（GMST）だけ回す
+    theta = gmst(jd, fr)
+    c, s = math.cos(theta), math.sin(theta)
+    x, y, z = r
+    return (c * x + s * y, -s * x + c * y, z)
+
+def ecef_to_geodetic(x, y, z):
+    lon = math.atan2(y, x)
+    p = math.hypot(x, y)
+    lat = math.atan2(z, p * (1 - EARTH_E2))
+    for _ in range(5):
+        sin_lat = math.sin(lat)
+        n = EARTH_A / math.sqrt(1 - EARTH_E2 * sin_lat * sin_lat)
+        lat = math.atan2(z + EARTH_E2 * n * sin_lat, p)
+    sin_lat = math.sin(lat)
+    n = EARTH_A / math.sqrt(1 - EARTH_E2 * sin_lat * sin_lat)
+    if abs(lat) < math.radians(89.0):
+        alt = p / math.cos(lat) - n
+    else:
+        alt = z / sin_lat - n * (1 - EARTH_E2)
+    return math.degrees(lat), math.degrees(lon), alt
+
+def teme_to_ecef_array(r, jd, fr):
+    # r: (N, 3) のTEME座標をまとめてECEFへ
+    theta = gmst(jd, fr)
+    c, s = math.cos(theta), math.sin(theta)
+    x, y, z = r[:, 0], r[:, 1], r[:, 2]
+    return np.column_stack((c * x + s * y, -s * x + c * y, z))
+
+def teme_to_ecef_series(r, jd, fr):
+    # r: (N, 3) の1衛星の時系列（時刻毎に自転角が違う）
+    theta = gmst(jd, fr)
+    c, s = np.cos(theta), np.sin(theta)
+    x, y, z = r[:, 0], r[:, 1], r[:, 2]
+    return np.column_stack((c * x + s * y, -s * x + c * y, z))
+
+def ecef_to_geodetic_array(xyz):
+    x, y, z = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+    lon = np.arctan2(y, x)
+    p = np.hypot(x, y)
+    lat = np.arctan2(z, p * (1 - EARTH_E2))
+    for _ in range(5):
+        sin_lat = np.sin(lat)
+        n = EARTH_A / np.sqrt(1 - EARTH_E2 * sin_lat * sin_lat)
+        lat = np.arctan2(z + EARTH_E2 * n * sin_lat, p)
+    sin_lat = np.sin(lat)
+    n = EARTH_A / np.sqrt(1 - EARTH_E2 * sin_lat * sin_lat)
+    # 極付近は cos(lat) での割り算を避ける
+    alt = np.where(
+        np.abs(lat) < math.radians(89.0),
+        p / np.maximum(np.cos(lat), 1e-12) - n,
+        z / np.where(sin_lat == 0, 1.0, sin_lat) - n * (1 - EARTH_E2),
+    )
+    return np.degrees(lat), np.degrees(lon), alt
+
+def geodetic_to_ecef(lat, lon, alt_km):
+    lat, lon = math.radians(lat), math.radians(lon)
+    sin_lat = math.sin(lat)
+    n = EARTH_A / math.sqrt(1 - EARTH_E2 * sin_lat * sin_lat)
+    return (
+        (n + alt_km) * math.cos(lat) * math.cos(lon),
+        (n + alt_km) * math.cos(lat) * math.sin(lon),
+        (n * (1 - EARTH_E2) + alt_km) * sin_lat,
+    )
+
+def geodetic_to_ecef_array(lat, lon, alt_km):
+    lat, lon = np.radians(lat), np.radians(lon)
+    sin_lat = np.sin(lat)
+    n = EARTH_A / np.sqrt(1 - EARTH_E2 * sin_lat * sin_lat)
+    return np.column_stack((
+        (n + alt_km) * np.cos(lat) * np.cos(lon),
+        (n + alt_km) * np.cos(lat) * np.sin(lon),
+        (n * (1 - EARTH_E2) + alt_km) * sin_lat,
+    ))
+
+def observer_frame(lat, lon, alt_km):
+    # 観測地点の ECEF 座標と天頂方向の単位ベクトル（衛星方向との内積で仰角・天頂角を求める）
+    lat_r, lon_r = math.radians(lat), math.radians(lon)
+    obs = np.array(geodetic_to_ecef(lat, lon, alt_km))
+    zenith = np.array([
+        math.cos(lat_r) * math.cos(lon_r),
+        math.cos(lat_r) * math.sin(lon_r),
+        math.sin(lat_r),
+    ])
+    return obs, zenith
+
+def julian_date(when):
+    when = when.astimezone(timezone.utc)
+    return jday(when.year, when.month, when.day, when.hour, when.minute, when.second + when.microsecond / 1e6)
+
+def julian_date_array(timestamps):
+    # UNIX時刻の配列を (jd, fr) の配列に分ける（fr を小さく保って精度を落とさない）
+    days = np.asarray(timestamps, dtype=float) / 86400.0
+    whole = np.floor(days)
+    return 2440587.5 + whole, days - whole
+
+
+# ========================
+# TLE カタログ
+# ========================
+def parse_tle(text):
+    # 3行形式（衛星名 / 1行目 / 2行目）と2行形式の両方を読む
+    records = []
+    name = None
+    line1 = None
+    for raw in text.splitlines():
+        line = raw.rstrip()
+        if not line:
+            continue
+        if line.startswith("1 ") and len(line) >= 69:
+            line1 = line
+        elif line.startswith("2 ") and line1 is not None:
+            satid = int(line1[2:7])
+            records.append((satid, (name or str(satid)).strip(), line1, line))
+            name = None
+            line1 = None
+        else:
+            name = line[2:] if line.startswith("0 ") else line
+    return records
+
+
+class TLECatalog:
+    def __init__(self, path=TLE_PATH, reload_check_interval=RELOAD_CHECK_INTERVAL):
+        self.path = path
+        self.reload_check_interval = reload_check_interval
+        self.satrecs = {}
+        self.names = {}
+        self.arrays = (np.zeros(0, dtype=np.int64), None) #(satid配列, SatrecArray) 一括伝播用
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+        with open(self.path, encoding="utf-8") as f:
+            records = parse_tle(f.read())
+        satrecs = {}
+        names = {}
+        for satid, name, line1, line2 in records:
+            satrecs[satid] = Satrec.twoline2rv(line1, line2)
+            names[satid] = name
+        satids = np.fromiter(satrecs.keys(), dtype=np.int64, count=len(satrecs))
+        arrays = (satids, SatrecArray(list(satrecs.values())) if satrecs else None)
+        # 参照の差し替えだけなので読み込み中のスレッドには影響しない
+        with self._lock:
+            self.satrecs = satrecs
+            self.names = names
+            self.arrays = arrays
+            self._mtime = mtime
+        return True
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_check_interval:
+            return
+        self._checked_at = now
+        self.reload()
+
+    def __contains__(self, satid):
+        return int(satid) in self.satrecs
+
+    def __len__(self):
+        return len(self.satrecs)
+
+    def satrec(self, satid):
+        return self.satrecs.get(int(satid))
+
+    def name(self, satid):
+        return self.names.get(int(satid), str(satid))
+
+    def intldesg(self, satid):
+        sat = self.satrec(satid)
+        return sat.intldesg.strip() if sat is not None else ""
+
+    def satrec_array(self):
+        # (satid配列, SatrecArray) 一括伝播用
+        return self.arrays
+
+    def position(self, satid, when=None):
+        # N2YO の positions[0] と同じ形で衛星直下点を返す（カタログに無ければ None）
+        self._maybe_reload()
+        sat = self.satrec(satid)
+        if sat is None:
+            return None
+        if when is None:
+            when = datetime.now(timezone.utc)
+        jd, fr = julian_date(when)
+        error, r, v = sat.sgp4(jd, fr)
+        if error != 0:
+            return None
+        lat, lon, alt = ecef_to_geodetic(*teme_to_ecef(r, jd, fr))
+        return {
+            "satlatitude": lat,
+            "satlongitude": lon,
+            "sataltitude": alt,
+            "timestamp": int(when.timestamp()),
+        }
+
+    def trajectory(self, satid, timestamps):
+        # 1衛星を複数時刻まとめて伝播し、ECEF座標 (N, 3) を返す（カタログに無い・伝播エラーなら None）
+        self._maybe_reload()
+        sat = self.satrec(satid)
+        if sat is None:
+            return None
+        jd, fr = julian_date_array(timestamps)
+        error, r, v = sat.sgp4_array(jd, fr)
+        if np.any(error != 0):
+            return None
+        return teme_to_ecef_series(r, jd, fr)
+
+    def propagate_all(self, when=None):
+        # カタログ全体を1時刻分まとめて伝播し、(satid配列, ECEF座標 (N, 3)) を返す
+        self._maybe_reload()
+        satids, satrec_array = self.satrec_array()
+        if satrec_array is None:
+            return satids, np.zeros((0, 3))
+        if when is None:
+            when = datetime.now(timezone.utc)
+        jd, fr = julian_date(when)
+        error, r, v = satrec_array.sgp4(np.array([jd]), np.array([fr]))
+        ok = error[:, 0] == 0
+        return satids[ok], teme_to_ecef_array(r[ok, 0, :], jd, fr)
+
+
+# ========================
+# カタログ更新ジョブ
+# ========================
+# 例: cron で `python orbit.py catalog.tle` を定期実行する
+
+def refresh_catalog(path=TLE_PATH, url=TLE_SOURCE_URL):
+    response = requests.get(url, timeout=(3.05, 30))
+    response.raise_for_status()
+    if not parse_tle(response.text):
+        raise ValueError("TLEが含まれていません")
+    # 書きかけのファイルを読ませないように置き換えはアトミックに行う
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(response.text)
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    refresh_catalog(*sys.argv[1:2])
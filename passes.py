@@ -0,0 +1,126 @@
+import time
+
+import numpy as np
+
+from n2yo_client import POSITIONS_MAX_SECONDS, ResponseCache
+from orbit import ecef_to_geodetic_array, geodetic_to_ecef_array, observer_frame
+from scoring import haversine, pass_scores
+
+# ========================
+# 設定
+# ========================
+PASS_MAX_SECONDS = POSITIONS_MAX_SECONDS #N2YO positions で1回に取れる長さ（秒）
+# 選べる追跡時間（秒）。取得した軌道の長さより短くして、先読みや他のセッションが
+# 少し前に取った軌道でも追跡時間を覆えるようにする
+PASS_WINDOWS = (30, 60, 120, 240)
+PASS_SAMPLE_STEP = 1 #スコア計算のサンプル間隔（秒）
+BUCKET_SECONDS = 60 #軌道をキャッシュする時間バケット（秒）
+CATALOG_STEP = 10 #カタログから伝播する軌道の間隔（秒、間は補間する）
+START_TOLERANCE = 2 #軌道の先頭が追跡開始より遅れていても使う範囲（秒、N2YO との時計のずれ）
+TRAJECTORY_CACHE_SIZE = 1024
+
+
+# ========================
+# 軌道（時系列）
+# ========================
+# 衛星の位置は ECEF 座標で持ち、サンプル時刻の間は線形補間する
+# （緯度経度で補間すると日付変更線をまたぐ所で壊れる）
+
+class Trajectory:
+    __slots__ = ("times", "ecef")
+
+    def __init__(self, times, ecef):
+        self.times = times #UNIX時刻 (N,)
+        self.ecef = ecef #(N, 3) km
+
+    @classmethod
+    def from_positions(cls, positions):
+        # N2YO の positions 配列から作る
+        times = np.array([p["timestamp"] for p in positions], dtype=float)
+        lat = np.array([p["satlatitude"] for p in positions], dtype=float)
+        lon = np.array([p["satlongitude"] for p in positions], dtype=float)
+        alt = np.array([p["sataltitude"] for p in positions], dtype=float)
+        return cls(times, geodetic_to_ecef_array(lat, lon, alt))
+
+    def covers(self, start, end):
+        return len(self.times) > 1 and self.times[0] <= start + START_TOLERANCE and end <= self.times[-1]
+
+    def clip(self, start, end):
+        # 軌道がある範囲に追跡時間を切り詰める
+        return max(start, self.times[0]), min(end, self.times[-1])
+
+    def at(self, times):
+        return np.column_stack([np.interp(times, self.times, self.ecef[:, axis]) for axis in range(3)])
+
+
+# ========================
+# パストラック
+# ========================
+class PassTracker:
+    # 軌道は satid と時間バケット毎に1回だけ取得・伝播し、全セッションで共有する
+    def __init__(self, catalog, n2yo, cache=None):
+        self.catalog = catalog
+        self.n2yo = n2yo
+        self.cache = cache if cache is not None else ResponseCache(TRAJECTORY_CACHE_SIZE, ttl=BUCKET_SECONDS + PASS_MAX_SECONDS)
+
+    def _from_catalog(self, satid, bucket):
+        # バケットの先頭から、バケット内のどの時刻に始めても最長の追跡時間を覆う範囲を伝播する
+        start = bucket * BUCKET_SECONDS
+        times = np.arange(start, start + BUCKET_SECONDS + PASS_MAX_SECONDS + CATALOG_STEP, CATALOG_STEP, dtype=float)
+        ecef = self.catalog.trajectory(satid, times)
+        if ecef is None:
+            return None
+        return Trajectory(times, ecef)
+
+    def trajectory(self, satid, start, seconds, lat, lon, alt_km, prefetched=None):
+        # prefetched: 先読み済みの N2YO positions 配列（あれば API を呼ばない）
+        end = start + seconds
+        bucket = int(start // BUCKET_SECONDS)
+        key = (satid, bucket)
+        trajectory = self.cache.get(key)
+        if trajectory is not None and trajectory.covers(start, end):
+            return trajectory
+
+        trajectory = self._from_catalog(satid, bucket) if satid in self.catalog else None
+        if trajectory is None:
+            # カタログに無い・伝播できない（減衰済み等）衛星は、先読み済みの軌道か N2YO を使う
+            trajectory = Trajectory.from_positions(prefetched) if prefetched else None
+            if trajectory is None or not trajectory.covers(start, end):
+                positions = self.n2yo.positions(satid, lat, lon, alt_km, PASS_MAX_SECONDS).get("positions", [])
+                trajectory = Trajectory.from_positions(positions) if len(positions) > 1 else None
+        if trajectory is not None:
+            self.cache.put(key, trajectory)
+        return trajectory
+
+    def score(self, trajectory, lat, lon, alt_km, start, seconds, step=PASS_SAMPLE_STEP):
+        # 追跡時間全体をまとめて評価する（ループはサンプル数ではなく numpy 側で回る）
+        start, end = trajectory.clip(start, start + seconds)
+        if end <= start:
+            return None
+        # 両端を含めて追跡時間をちょうど覆うように等間隔に取る（間隔の合計が追跡時間になる）
+        n = max(2, int(round((end - start) / step)) + 1)
+        times = np.linspace(start, end, n)
+        ecef = trajectory.at(times)
+
+        sat_lat, sat_lon, _ = ecef_to_geodetic_array(ecef)
+        distance = haversine(lat, lon, sat_lat, sat_lon)
+
+        # 観測地点の天頂方向との角度から仰角を求める
+        obs, zenith = observer_frame(lat, lon, alt_km)
+        d = ecef - obs
+        sin_elevation = (d @ zenith) / np.maximum(np.linalg.norm(d, axis=1), 1e-9)
+        elevation = np.degrees(np.arcsin(np.clip(sin_elevation, -1.0, 1.0)))
+
+        result = pass_scores(distance, elevation, (end - start) / (n - 1))
+        result["seconds"] = float(end - start)
+        return result
+
+    def track(self, satid, lat, lon, alt_km, seconds, now=None, prefetched=None):
+        # 今から seconds 秒間のパスを評価する（軌道が取れなければ None）
+        if now is None:
+            now = time.time()
+        start = float(int(now))
+        trajectory = self.trajectory(satid, start, seconds, lat, lon, alt_km, prefetched)
+        if trajectory is None:
+            return None
+        return self.score(trajectory, lat, lon, alt_km, start, seconds)
@@ -0,0 +1,164 @@
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+import metrics
+
+# ========================
+# 設定
+# ========================
+PRECOMPUTE_CELL_DEG = 0.25 #先読みするグリッドセルの幅（度）。セル内の観測地点はセル中心の結果を使う
+PRECOMPUTE_BUCKET_SECONDS = 60 #時間バケットの幅（秒）
+PRECOMPUTE_HORIZON = 10 #何バケット先まで計算しておくか
+PRECOMPUTE_INTERVAL = 10 #計算済みか確認する間隔（秒）
+PRECOMPUTE_RADIUS = 90 #リンクで使う探索半径（度）
+
+# 利用者が多い地点（緯度, 経度）。入力欄の初期値の地点も含める
+DEFAULT_HOT_CELLS = (
+    (35.0, 139.0), #入力欄の初期値
+    (35.68, 139.77), #東京
+    (34.69, 135.50), #大阪
+    (35.18, 136.91), #名古屋
+    (33.59, 130.40), #福岡
+    (43.06, 141.35), #札幌
+)
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS visibility_index (
+        cell_lat REAL NOT NULL,
+        cell_lon REAL NOT NULL,
+        bucket INTEGER NOT NULL,
+        satids BLOB NOT NULL,
+        coords BLOB NOT NULL,
+        PRIMARY KEY (cell_lat, cell_lon, bucket)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_visibility_index_bucket ON visibility_index (bucket)",
+]
+
+SQL_SELECT_ENTRY = "SELECT satids, coords FROM visibility_index WHERE cell_lat=? AND cell_lon=? AND bucket=?"
+SQL_SELECT_KEYS = "SELECT cell_lat, cell_lon, bucket FROM visibility_index WHERE bucket >= ?"
+SQL_INSERT_ENTRY = "INSERT OR IGNORE INTO visibility_index (cell_lat, cell_lon, bucket, satids, coords) VALUES (?, ?, ?, ?, ?)"
+SQL_EVICT = "DELETE FROM visibility_index WHERE bucket < ?"
+
+logger = logging.getLogger(__name__)
+
+
+# ========================
+# 可視衛星の先読みインデックス
+# ========================
+# 利用者の多いグリッドセルについて、これからの時間バケット毎に見える衛星を
+# バックグラウンドで計算してDBに置いておく。リンク時は (セル, バケット) の主キーで
+# 1回引くだけにする（対象外のセルは呼び出し側でその場で計算する）。
+# 値は satid 配列と (緯度, 経度, 高度) 配列のバイト列で持ち、名前等は引く時にカタログから付ける。
+# 過去のバケットは計算のたびに削除する。
+
+class VisibilityIndex:
+    def __init__(self, storage, engine, cells=DEFAULT_HOT_CELLS, cell_deg=PRECOMPUTE_CELL_DEG,
+                 bucket_seconds=PRECOMPUTE_BUCKET_SECONDS, horizon=PRECOMPUTE_HORIZON, interval=PRECOMPUTE_INTERVAL,
+                 clock=time.time):
+        self.storage = storage
+        self.engine = engine
+        self.cell_deg = cell_deg
+        self.cells = sorted({self.cell_of(lat, lon) for lat, lon in cells})
+        self._cell_set = set(self.cells)
+        self.bucket_seconds = bucket_seconds
+        self.horizon = horizon
+        self.interval = interval
+        self.clock = clock
+        self._stop = threading.Event()
+        self._thread = None
+
+        with storage.transaction() as conn:
+            for sql in SCHEMA:
+                conn.execute(sql)
+
+    def cell_of(self, lat, lon):
+        # セル中心の緯度経度
+        return (
+            round(round(lat / self.cell_deg) * self.cell_deg, 6),
+            round(round(lon / self.cell_deg) * self.cell_deg, 6),
+        )
+
+    def bucket_of(self, timestamp):
+        return int(timestamp // self.bucket_seconds)
+
+    def bucket_time(self, bucket):
+        return datetime.fromtimestamp(bucket * self.bucket_seconds, timezone.utc)
+
+    # --- 参照 ---
+    def lookup(self, lat, lon, when=None):
+        # 対象セルで計算済みなら satellite/above と同じ形を返す。無ければ None
+        cell = self.cell_of(lat, lon)
+        if cell not in self._cell_set or len(self.engine.catalog) == 0:
+            metrics.count("visibility_index_requests_total", result="uncovered")
+            return None
+        timestamp = when.timestamp() if when is not None else self.clock()
+        with self.storage.connection() as conn:
+            row = conn.execute(SQL_SELECT_ENTRY, (cell[0], cell[1], self.bucket_of(timestamp))).fetchone()
+        if row is None:
+            metrics.count("visibility_index_requests_total", result="miss")
+            return None
+        metrics.count("visibility_index_requests_total", result="hit")
+        satids = np.frombuffer(row[0], dtype=np.int64)
+        coords = np.frombuffer(row[1], dtype=np.float64).reshape(-1, 3)
+        return self.engine.payload(satids, coords[:, 0], coords[:, 1], coords[:, 2])
+
+    # --- 計算 ---
+    def precompute(self, now=None):
+        # 現在から horizon バケット先まで、未計算の (セル, バケット) を埋めて過去分を消す
+        if len(self.engine.catalog) == 0:
+            return 0
+        current = self.bucket_of(self.clock() if now is None else now)
+        with self.storage.connection() as conn:
+            done = set(conn.execute(SQL_SELECT_KEYS, (current,)).fetchall())
+        added = 0
+        for bucket in range(current, current + self.horizon + 1):
+            missing = [cell for cell in self.cells if (cell[0], cell[1], bucket) not in done]
+            if not missing:
+                continue
+            # 1バケットにつき全体の伝播は1回だけ行い、各セルはそれを引くだけにする
+            with metrics.span("precompute.bucket"):
+                sl = self.engine.slice_at(self.bucket_time(bucket))
+                rows = []
+                for cell_lat, cell_lon in missing:
+                    satids, sat_lat, sat_lng, sat_alt = self.engine.visible(sl, cell_lat, cell_lon, 0.0, PRECOMPUTE_RADIUS)
+                    rows.append((
+                        cell_lat, cell_lon, bucket,
+                        np.ascontiguousarray(satids, dtype=np.int64).tobytes(),
+                        np.column_stack((sat_lat, sat_lng, sat_alt)).astype(np.float64).tobytes(),
+                    ))
+            with self.storage.transaction() as conn:
+                conn.executemany(SQL_INSERT_ENTRY, rows)
+            added += len(rows)
+        with self.storage.transaction() as conn:
+            conn.execute(SQL_EVICT, (current,))
+        return added
+
+    # --- バックグラウンド実行 ---
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="visibility-precompute", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                self.precompute()
+            except Exception:
+                logger.exception("可視衛星の先読み計算に失敗しました")
+            if self._stop.wait(self.interval):
+                break
+
+    def stop(self):
+        if self._thread is not None and not self._stop.is_set():
+            self._stop.set()
+            self._thread.join()
+            atexit.unregister(self.stop)
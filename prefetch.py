@@ -0,0 +1,85 @@
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError
+
+from n2yo_client import POSITIONS_MAX_SECONDS, N2YOError, positions_from
+from quota import PRIORITY_PREFETCH
+
+# ========================
+# 設定
+# ========================
+PREFETCH_WORKERS = 4 #同時に投げる先読みリクエスト数の上限（全セッション合計）
+PREFETCH_SECONDS = POSITIONS_MAX_SECONDS #先読みする軌道の長さ（秒）
+PREFETCH_WAIT = 5 #トラック時に先読みの完了を待つ最大時間（秒）
+PREFETCH_MAX_PER_LINK = 2 #1回のリンクで先読みする衛星数の上限（選んだ候補だけを先読みする）
+
+
+# ========================
+# 候補衛星の位置の先読み
+# ========================
+# リンク直後と候補の選択を変えた時に、選ばれている候補衛星の位置を先読みしておき、
+# トラック時はそれを読むだけにする。候補全部は先読みしない（N2YO の positions の上限を
+# 1ゲームで使い切らないように、1リンクあたり PREFETCH_MAX_PER_LINK 件まで）。
+# ローカルカタログにある衛星はトラック時に計算しても一瞬なので先読みしない。
+# クォータの残りが先読みの予約分を割っている時も先読みしない（トラック時に直接取得する）。
+
+class PrefetchBatch:
+    # 1回のリンク分の先読み結果（セッション毎に st.session_state に保持する）
+    def __init__(self, futures, observer):
+        self.futures = futures
+        self.observer = observer #(緯度, 経度, 高度 km) リンクした観測地点
+
+    def cancel(self):
+        for future in self.futures.values():
+            future.cancel()
+
+    def positions(self, sat_id, timeout=PREFETCH_WAIT):
+        # 先読みした軌道（N2YO positions の配列）。無い・失敗した時は None
+        future = self.futures.get(sat_id)
+        if future is None:
+            return None
+        try:
+            positions = future.result(timeout=timeout)
+        except (CancelledError, TimeoutError, N2YOError):
+            return None
+        return positions or None
+
+    def position(self, sat_id, now=None, timeout=PREFETCH_WAIT):
+        positions = self.positions(sat_id, timeout)
+        if positions is None:
+            return None
+        # 先読みした軌道から現在時刻の位置を取り出す（範囲外なら使わない）
+        positions = positions_from(positions, int(time.time()) if now is None else now)
+        return positions[0] if positions else None
+
+
+class PositionPrefetcher:
+    # スレッドプールはプロセス全体で1つだけ持ち、外部へのリクエスト数を抑える
+    def __init__(self, n2yo, catalog, max_workers=PREFETCH_WORKERS, seconds=PREFETCH_SECONDS, max_per_link=PREFETCH_MAX_PER_LINK):
+        self.n2yo = n2yo
+        self.catalog = catalog
+        self.seconds = seconds
+        self.max_per_link = max_per_link
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+
+    def _fetch(self, sat_id, lat, lon, alt_km):
+        # 先読みは最低優先度（ボタン操作の分のクォータを残す）
+        return self.n2yo.positions(sat_id, lat, lon, alt_km, self.seconds, priority=PRIORITY_PREFETCH).get("positions", [])
+
+    def _quota_available(self):
+        quota = self.n2yo.quota
+        return quota is None or quota.available("positions", PRIORITY_PREFETCH)
+
+    def prefetch(self, batch, sat_id):
+        # 先読みを始めたら True（済み・カタログにある・上限・クォータ不足なら False）
+        if sat_id in batch.futures or sat_id in self.catalog or len(batch.futures) >= self.max_per_link:
+            return False
+        if not self._quota_available():
+            return False
+        batch.futures[sat_id] = self.executor.submit(self._fetch, sat_id, *batch.observer)
+        return True
+
+    def start(self, sat_ids, lat, lon, alt_km):
+        batch = PrefetchBatch({}, (lat, lon, alt_km))
+        for sat_id in sat_ids:
+            self.prefetch(batch, sat_id)
+        return batch
@@ -0,0 +1,132 @@
+import time
+
+import metrics
+
+# ========================
+# 設定
+# ========================
+# N2YO のエンドポイント毎の1時間あたりの上限（APIキー単位）
+HOURLY_LIMITS = {
+    "tle": 1000,
+    "positions": 1000,
+    "visualpasses": 100,
+    "radiopasses": 100,
+    "above": 100,
+}
+WINDOW_SECONDS = 3600
+# 一度に使える量（上限に対する割合）。残りは一定速度で補充する。
+# バケット容量 C と補充速度 r を C + r * 1時間 = 上限 にしているので、
+# どの1時間を切り出しても上限を超えない
+BURST_RATIO = 0.2
+
+# 優先度。数字が大きいほど優先度が低い
+PRIORITY_INTERACTIVE = 0 #ボタン操作（リンク・トラック）
+PRIORITY_PREFETCH = 1 #先読み
+PRIORITY_RESERVE = (0.0, 0.5) #優先度毎に、上位の優先度のために残しておく割合（容量に対する割合）
+PRIORITY_WAIT = (2.0, 0.0) #優先度毎の、トークンの補充を待つ最大時間（秒）
+MIN_SLEEP = 0.01 #補充待ちの最短間隔（秒）
+DEGRADED_RATIO = 0.1 #残りがこの割合を下回ったら縮退モード（キャッシュ済みの結果を優先する）
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS api_quota (
+        endpoint TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated REAL NOT NULL
+    )
+    """,
+]
+
+# 補充してから cost 分を消費する。予約分（reserve）を残せない時は更新しない
+SQL_ACQUIRE = """
+    UPDATE api_quota SET
+        tokens=MIN(:capacity, tokens + MAX(0, :now - updated) * :rate) - :cost,
+        updated=MAX(updated, :now)
+    WHERE endpoint=:endpoint AND MIN(:capacity, tokens + MAX(0, :now - updated) * :rate) >= :reserve + :cost
+    RETURNING tokens
+"""
+SQL_INSERT_BUCKET = "INSERT OR IGNORE INTO api_quota (endpoint, tokens, updated) VALUES (?, ?, ?)"
+SQL_SELECT_BUCKET = "SELECT tokens, updated FROM api_quota WHERE endpoint=?"
+
+
+# ========================
+# APIクォータ管理（トークンバケット）
+# ========================
+# バケットはSQLiteに置くので、同じDBファイルを使う全セッション・全ワーカープロセスで共有される。
+# 補充と消費は1文の UPDATE ... RETURNING で行うので同時に取り合っても上限を超えない。
+# clock / sleep を差し替えれば実時間を待たずに試験できる。
+
+class QuotaManager:
+    def __init__(self, storage, limits=None, burst_ratio=BURST_RATIO, clock=time.time, sleep=time.sleep):
+        self.storage = storage
+        self.clock = clock
+        self.sleep = sleep
+        self.buckets = {}
+        for endpoint, limit in (limits or HOURLY_LIMITS).items():
+            capacity = limit * burst_ratio
+            self.buckets[endpoint] = (capacity, (limit - capacity) / WINDOW_SECONDS)
+
+        with storage.transaction() as conn:
+            for sql in SCHEMA:
+                conn.execute(sql)
+            now = self.clock()
+            for endpoint, (capacity, _) in self.buckets.items():
+                conn.execute(SQL_INSERT_BUCKET, (endpoint, capacity, now))
+
+    def _tokens(self, conn, endpoint, now):
+        capacity, rate = self.buckets[endpoint]
+        tokens, updated = conn.execute(SQL_SELECT_BUCKET, (endpoint,)).fetchone()
+        return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+    def _try_acquire(self, endpoint, priority, cost):
+        capacity, rate = self.buckets[endpoint]
+        now = self.clock()
+        with self.storage.transaction() as conn:
+            row = conn.execute(SQL_ACQUIRE, {
+                "endpoint": endpoint,
+                "now": now,
+                "capacity": capacity,
+                "rate": rate,
+                "cost": cost,
+                "reserve": capacity * PRIORITY_RESERVE[priority],
+            }).fetchone()
+            if row is not None:
+                return True, row[0]
+            return False, self._tokens(conn, endpoint, now)
+
+    def acquire(self, endpoint, priority=PRIORITY_INTERACTIVE, cost=1):
+        # トークンを取れたら True。取れなければ優先度毎の最大時間まで補充を待つ
+        if endpoint not in self.buckets:
+            return True
+        capacity, rate = self.buckets[endpoint]
+        deadline = self.clock() + PRIORITY_WAIT[priority]
+        while True:
+            acquired, tokens = self._try_acquire(endpoint, priority, cost)
+            metrics.gauge("n2yo_quota_tokens", tokens, endpoint=endpoint)
+            if acquired:
+                return True
+            wait = max(MIN_SLEEP, (capacity * PRIORITY_RESERVE[priority] + cost - tokens) / rate)
+            if wait > deadline - self.clock():
+                metrics.count("n2yo_quota_rejected_total", endpoint=endpoint, priority=priority)
+                return False
+            self.sleep(wait)
+
+    def available(self, endpoint, priority=PRIORITY_INTERACTIVE, cost=1):
+        # 待たずに取れるだけの残りがあるか（トークンは消費しない）。先読みを始める前の確認用
+        if endpoint not in self.buckets:
+            return True
+        capacity, _ = self.buckets[endpoint]
+        return self.budget(endpoint) >= capacity * PRIORITY_RESERVE[priority] + cost
+
+    def degraded(self, endpoint):
+        # 残りが少ない時は新しいリクエストを控え、キャッシュ済みの結果で済ませる
+        if endpoint not in self.buckets:
+            return False
+        capacity, _ = self.buckets[endpoint]
+        return self.budget(endpoint) < capacity * DEGRADED_RATIO
+
+    def budget(self, endpoint):
+        with self.storage.connection() as conn:
+            tokens = self._tokens(conn, endpoint, self.clock())
+        metrics.gauge("n2yo_quota_tokens", tokens, endpoint=endpoint)
+        return tokens
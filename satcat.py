@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import struct
+import logging
+
+import numpy as np
+from sgp4 import omm
+from sgp4.api import Satrec, SatrecArray, WGS72
+
+from orbit import RELOAD_CHECK_INTERVAL, TLECatalog, parse_tle
+from scoring import classify
+
+# ========================
+# 設定
+# ========================
+SATCAT_PATH = "catalog.satcat" #バイナリカタログ（build_catalog で別ジョブから作る）
+MAGIC = b"SATCAT\x00\x00"
+FORMAT_VERSION = 1
+
+# ヘッダ: magic, 形式バージョン, 衛星数, レコード位置, 文字列表の位置, 文字列表の長さ, 作成時刻（世代）
+HEADER = struct.Struct("<8sIIQQQd")
+HEADER_SIZE = 64 #将来の拡張用に固定長で確保する
+
+# 1衛星1レコードの固定長配列（satid 順に並べる）。軌道要素は sgp4init にそのまま渡せる単位で持つ
+RECORD_DTYPE = np.dtype([
+    ("satid", "<i8"),
+    ("epoch", "<f8"), #1949-12-31 00:00 UT からの日数
+    ("bstar", "<f8"),
+    ("ndot", "<f8"),
+    ("nddot", "<f8"),
+    ("ecco", "<f8"),
+    ("argpo", "<f8"),
+    ("inclo", "<f8"),
+    ("mo", "<f8"),
+    ("no_kozai", "<f8"),
+    ("nodeo", "<f8"),
+    ("category", "<i1"), #scoring の衛星カテゴリ
+    ("intldesg", "S11"),
+    ("name_length", "<u2"),
+    ("name_offset", "<u4"), #文字列表の中の衛星名の位置
+])
+
+JD_1949 = 2433281.5
+
+logger = logging.getLogger(__name__)
+
+
+# ========================
+# 作成（オフライン）
+# ========================
+# 例: python satcat.py catalog.tle catalog.satcat
+#     python satcat.py celestrak.json catalog.satcat （CelesTrak の OMM JSON）
+
+def read_tle(path):
+    with open(path, encoding="utf-8") as f:
+        records = parse_tle(f.read())
+    return [(satid, name, Satrec.twoline2rv(line1, line2)) for satid, name, line1, line2 in records]
+
+def read_omm_json(path):
+    with open(path, encoding="utf-8") as f:
+        fields = json.load(f)
+    records = []
+    for entry in fields:
+        sat = Satrec()
+        omm.initialize(sat, entry)
+        records.append((int(entry["NORAD_CAT_ID"]), entry["OBJECT_NAME"].strip(), sat))
+    return records
+
+def build_catalog(records, path=SATCAT_PATH):
+    # records: [(satid, 衛星名, Satrec)]
+    records = sorted({satid: (satid, name, sat) for satid, name, sat in records}.values())
+    table = np.zeros(len(records), dtype=RECORD_DTYPE)
+    names = bytearray()
+    for i, (satid, name, sat) in enumerate(records):
+        encoded = name.encode("utf-8")[:0xFFFF]
+        table[i] = (
+            satid, sat.jdsatepoch - JD_1949 + sat.jdsatepochF,
+            sat.bstar, sat.ndot, sat.nddot, sat.ecco, sat.argpo, sat.inclo, sat.mo, sat.no_kozai, sat.nodeo,
+            classify(name), sat.intldesg.strip().encode("ascii", "replace")[:11], len(encoded), len(names),
+        )
+        names += encoded
+
+    records_offset = HEADER_SIZE
+    strings_offset = records_offset + table.nbytes
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(table), records_offset, strings_offset, len(names), time.time())
+    # 読み込み中のプロセスに書きかけを見せないように、別ファイルに書いてから置き換える
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\x00"))
+        f.write(table.tobytes())
+        f.write(names)
+    os.replace(tmp_path, path)
+    return len(table)
+
+
+# ========================
+# 参照（memmap）
+# ========================
+# ファイルは読み取り専用で mmap するだけなので、開くのは一瞬で、同じファイルを開いた
+# 全プロセスがページキャッシュを共有する。Satrec は使う衛星の分だけその場で作る
+# （一括伝播用の SatrecArray は最初に必要になった時に1回だけ作る）。
+# ファイルが置き換えられたら次の確認で新しいファイルを開き直す（古い mmap は参照が切れるまで有効）。
+# 置き換えられたファイルが壊れていたら、開き直さずにそれまでのカタログを使い続ける。
+
+def map_catalog(path):
+    # ファイルを mmap して (レコード配列, 文字列表, 世代) を返す。ヘッダや位置がファイルと合わなければ ValueError
+    data = np.memmap(path, dtype=np.uint8, mode="r") #空のファイルは numpy が ValueError にする
+    if len(data) < HEADER_SIZE:
+        raise ValueError(f"{path}: ヘッダが途中で切れています")
+    magic, version, count, records_offset, strings_offset, strings_size, generation = HEADER.unpack(data[:HEADER.size].tobytes())
+    if magic != MAGIC:
+        raise ValueError(f"{path}: バイナリカタログではありません")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"{path}: 未対応の形式バージョンです ({version})")
+    records_end = records_offset + count * RECORD_DTYPE.itemsize
+    if records_offset < HEADER_SIZE or records_end > len(data):
+        raise ValueError(f"{path}: レコードがファイルの範囲外です")
+    if strings_offset < records_end or strings_offset + strings_size > len(data):
+        raise ValueError(f"{path}: 文字列表がファイルの範囲外です")
+    records = data[records_offset:records_end].view(RECORD_DTYPE)
+    strings = data[strings_offset:strings_offset + strings_size]
+    if count and int((records["name_offset"].astype(np.int64) + records["name_length"]).max()) > strings_size:
+        raise ValueError(f"{path}: 衛星名が文字列表の範囲外です")
+    if np.any(np.diff(records["satid"]) <= 0):
+        raise ValueError(f"{path}: レコードが satid 順に並んでいません")
+    return records, strings, generation
+
+
+class MappedCatalog(TLECatalog):
+    def __init__(self, path=SATCAT_PATH, reload_check_interval=RELOAD_CHECK_INTERVAL, strict=True):
+        self._records = np.zeros(0, dtype=RECORD_DTYPE)
+        self._strings = np.zeros(0, dtype=np.uint8)
+        self._satrec_cache = {}
+        self._identity = None
+        self._rejected = None #読み込めなかったファイル（変わるまで開き直さない）
+        self._strict = strict #偽なら最初に開くファイルが壊れていても例外にせず、空のカタログから始める
+        self.generation = None #読み込んだファイルの作成時刻
+        super().__init__(path, reload_check_interval)
+
+    def reload(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if identity == self._identity or identity == self._rejected:
+            return False
+        try:
+            records, strings, generation = map_catalog(self.path)
+        except (OSError, ValueError):
+            if self._identity is None and self._strict:
+                raise
+            logger.exception("バイナリカタログを読み込めません。読み込み済みのカタログ（無ければ空のカタログ）を使い続けます")
+            self._rejected = identity
+            return False
+        # 参照の差し替えだけなので読み込み中のスレッドには影響しない
+        with self._lock:
+            self._records = records
+            self._strings = strings
+            self._satrec_cache = {}
+            self.arrays = (np.asarray(records["satid"]), None)
+            self.generation = generation
+            self._identity = identity
+        return True
+
+    def _index(self, satid):
+        records = self._records
+        satids = records["satid"]
+        i = int(np.searchsorted(satids, int(satid)))
+        if i < len(satids) and satids[i] == int(satid):
+            return records, i
+        return records, None
+
+    def __contains__(self, satid):
+        return self._index(satid)[1] is not None
+
+    def __len__(self):
+        return len(self._records)
+
+    def _make_satrec(self, record):
+        sat = Satrec()
+        sat.sgp4init(
+            WGS72, "i", int(record["satid"]), float(record["epoch"]),
+            float(record["bstar"]), float(record["ndot"]), float(record["nddot"]), float(record["ecco"]),
+            float(record["argpo"]), float(record["inclo"]), float(record["mo"]), float(record["no_kozai"]),
+            float(record["nodeo"]),
+        )
+        return sat
+
+    def satrec(self, satid):
+        satid = int(satid)
+        cache = self._satrec_cache
+        sat = cache.get(satid)
+        if sat is None:
+            records, i = self._index(satid)
+            if i is None:
+                return None
+            sat = cache[satid] = self._make_satrec(records[i])
+        return sat
+
+    def name(self, satid):
+        records, i = self._index(satid)
+        if i is None:
+            return str(satid)
+        offset, length = int(records["name_offset"][i]), int(records["name_length"][i])
+        return self._strings[offset:offset + length].tobytes().decode("utf-8")
+
+    def intldesg(self, satid):
+        records, i = self._index(satid)
+        if i is None:
+            return ""
+        return records["intldesg"][i].decode("ascii")
+
+    def categories(self, satids):
+        # satid 配列に対応するカテゴリ配列（カタログに無い衛星は -1）
+        records = self._records
+        satids = np.asarray(satids, dtype=np.int64)
+        if len(records) == 0:
+            return np.full(len(satids), -1, dtype=np.int8)
+        index = np.minimum(np.searchsorted(records["satid"], satids), len(records) - 1)
+        found = records["satid"][index] == satids
+        return np.where(found, records["category"][index], -1).astype(np.int8)
+
+    def satrec_array(self):
+        satids, satrec_array = self.arrays
+        if satrec_array is None and len(satids):
+            with self._lock:
+                satids, satrec_array = self.arrays
+                if satrec_array is None:
+                    records = self._records
+                    satrec_array = SatrecArray([self._make_satrec(record) for record in records])
+                    self.arrays = (satids, satrec_array)
+        return satids, satrec_array
+
+
+def open_catalog(satcat_path=SATCAT_PATH, tle_path=None):
+    # バイナリカタログがあればそれを、無ければTLEをパースして使う。
+    # st.cache_resource は例外をキャッシュせずリランの度に開き直すことになるので、
+    # バイナリカタログが壊れていても例外にせず、TLE（無ければ空のカタログ）で始める
+    if tle_path is None:
+        return MappedCatalog(satcat_path, strict=False)
+    if not os.path.exists(satcat_path):
+        return TLECatalog(tle_path)
+    try:
+        return MappedCatalog(satcat_path)
+    except (OSError, ValueError):
+        logger.exception("バイナリカタログを開けません。TLE (%s) を使います", tle_path)
+        return TLECatalog(tle_path)
+
+
+if __name__ == "__main__":
+    source = sys.argv[1]
+    target = sys.argv[2] if len(sys.argv) > 2 else SATCAT_PATH
+    records = read_omm_json(source) if source.endswith(".json") else read_tle(source)
+    print(f"{build_catalog(records, target)} satellites -> {target}")
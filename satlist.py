@@ -0,0 +1,62 @@
+import sys
+
+from scoring import link_score
+
+# ========================
+# セッションに保持する衛星リスト
+# ========================
+# リンク結果（satellite/above の生の dict のリスト）はセッションに残さず、
+# 抽選した候補衛星だけを __slots__ のレコードにして保持する。
+# 衛星名・打ち上げ日は sys.intern で全セッション共通の文字列オブジェクトにする。
+# リンクスコアは全衛星分を変換時に集計し、合計点だけ残す。
+
+
+class Satellite:
+    __slots__ = ("satid", "satname", "launchDate", "satlat", "satlng")
+
+    def __init__(self, satid, satname, launchDate, satlat, satlng):
+        self.satid = satid
+        self.satname = satname
+        self.launchDate = launchDate
+        self.satlat = satlat
+        self.satlng = satlng
+
+    def __getitem__(self, key):
+        # 生の dict と同じく sat["satname"] でも読めるようにする
+        return getattr(self, key)
+
+
+class SatelliteList:
+    __slots__ = ("candidates", "total", "score")
+
+    def __init__(self, candidates, total, score):
+        self.candidates = candidates
+        self.total = total #リンクした衛星の総数
+        self.score = score #リンクスコア（全衛星分）
+
+    @classmethod
+    def from_above(cls, above, category_table, indices):
+        # above: satellite/above の "above" 配列, indices: 残す候補衛星の添字
+        candidates = []
+        for index in indices:
+            sat = above[index]
+            candidates.append(Satellite(
+                int(sat["satid"]),
+                sys.intern(str(sat["satname"])),
+                sys.intern(str(sat["launchDate"])),
+                float(sat["satlat"]),
+                float(sat["satlng"]),
+            ))
+        return cls(candidates, len(above), link_score(category_table.categories(above)))
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def __getitem__(self, index):
+        return self.candidates[index]
+
+    def __iter__(self):
+        return iter(self.candidates)
+
+    def satids(self):
+        return [sat.satid for sat in self.candidates]
@@ -0,0 +1,109 @@
+import threading
+
+import numpy as np
+
+# ========================
+# 設定
+# ========================
+EARTH_R = 6371.0 #地球半径 km
+
+# 衛星カテゴリとリンクスコア
+CATEGORY_OTHER = 0
+CATEGORY_STARLINK = 1
+CATEGORY_ISS = 2
+CATEGORY_POINTS = np.array([1, 2, 3], dtype=np.int64) #カテゴリ毎のリンクスコア
+
+# トラックスコアの区分線形カーブ（距離 km の上限, 切片, 傾き）
+TRACK_SCORE_CURVE = (
+    (1000, 3000, -1.0),
+    (3000, 2500, -0.5),
+    (7000, 1750, -0.25),
+)
+
+# パストラックのスコア（最接近・平均距離のトラックスコアの重み, 地平線上1秒あたりの点数）
+PASS_CLOSEST_WEIGHT = 0.5
+PASS_AVERAGE_WEIGHT = 0.5
+PASS_VISIBLE_POINTS = 2
+
+
+# ========================
+# カテゴリ判定
+# ========================
+def classify(satname):
+    name = satname.upper()
+    if "STARLINK" in name:
+        return CATEGORY_STARLINK
+    elif "ISS" in name:
+        return CATEGORY_ISS
+    return CATEGORY_OTHER
+
+
+class CategoryTable:
+    # satid→カテゴリの表をプロセス全体で共有し、衛星名の判定は衛星毎に1回だけ行う
+    # （バイナリカタログを渡すと、作成時に判定済みのカテゴリから始める）
+    def __init__(self, catalog=None):
+        self._table = {}
+        if hasattr(catalog, "categories"):
+            satids = catalog.arrays[0]
+            self._table = dict(zip(satids.tolist(), catalog.categories(satids).tolist()))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._table)
+
+    def categories(self, sat_list):
+        table = self._table
+        missing = [sat for sat in sat_list if sat["satid"] not in table]
+        if missing:
+            with self._lock:
+                for sat in missing:
+                    table[sat["satid"]] = classify(sat["satname"])
+        return np.fromiter((table[sat["satid"]] for sat in sat_list), dtype=np.int64, count=len(sat_list))
+
+
+# ========================
+# スコア計算（ベクトル化）
+# ========================
+def haversine(lat1, lon1, lat2, lon2):
+    # 引数は配列でもスカラーでもよい（地表での距離 km）
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = np.radians(np.subtract(lat2, lat1))
+    dlambda = np.radians(np.subtract(lon2, lon1))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_R * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+def track_scores(distance):
+    d = np.asarray(distance, dtype=float)
+    conditions = [d < limit for limit, _, _ in TRACK_SCORE_CURVE]
+    values = [intercept + slope * d for _, intercept, slope in TRACK_SCORE_CURVE]
+    return np.select(conditions, values, default=0.0)
+
+def pass_scores(distance, elevation, dt):
+    # distance: 各サンプル時刻の地表距離 km, elevation: 仰角 度（どちらも配列）, dt: サンプル間隔 秒
+    closest = float(distance.min())
+    average = float(distance.mean())
+    # サンプルではなく区間を数える（両端が地平線上なら dt、片方だけなら dt/2）
+    above = elevation > 0
+    visible_seconds = float((np.count_nonzero(above[:-1]) + np.count_nonzero(above[1:])) * dt / 2)
+    score = (
+        PASS_CLOSEST_WEIGHT * track_scores(closest)
+        + PASS_AVERAGE_WEIGHT * track_scores(average)
+        + PASS_VISIBLE_POINTS * visible_seconds
+    )
+    return {
+        "closest": closest,
+        "average": average,
+        "visible_seconds": visible_seconds,
+        "max_elevation": float(elevation.max()),
+        "score": int(score),
+    }
+
+def link_score(categories):
+    return int(CATEGORY_POINTS[categories].sum())
+
+def expected_track_scores(lat, lon, sat_list, indices):
+    # リンク時点の衛星位置（satlat/satlng）から各候補の予想トラックスコアをまとめて求める
+    # （リンクスコアの集計はリンク時に1回だけ行い、SatelliteList.score に残す）
+    sat_lat = np.array([sat_list[i]["satlat"] for i in indices], dtype=float)
+    sat_lng = np.array([sat_list[i]["satlng"] for i in indices], dtype=float)
+    return track_scores(haversine(lat, lon, sat_lat, sat_lng)).astype(np.int64)
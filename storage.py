@@ -0,0 +1,324 @@
+import re
+import sqlite3
+import queue
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import leaderboard
+import metrics
+
+# ========================
+# 設定
+# ========================
+DB_PATH = "game.db"
+POOL_SIZE = 4 #プールする接続数の上限
+BUSY_TIMEOUT_MS = 5000 #ロック待ちの最大時間
+STATEMENT_CACHE_SIZE = 128 #接続毎にキャッシュするプリペアドステートメント数
+HISTORY_FLUSH_INTERVAL = 1.0 #履歴の書き込みキューをフラッシュする間隔（秒）
+HISTORY_MAX_BATCH = 500 #1トランザクションで書き込む履歴の最大件数
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id TEXT PRIMARY KEY,
+        lives INTEGER,
+        last_recharge TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT,
+        timestamp TEXT,
+        log TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_history_user_id ON history (user_id, id)",
+]
+
+# SQL文は定数にしておき、sqlite3のステートメントキャッシュで再利用させる
+SQL_SELECT_USER = "SELECT user_id, lives, last_recharge FROM users WHERE user_id=?"
+SQL_INSERT_USER = "INSERT OR IGNORE INTO users (user_id, lives, last_recharge) VALUES (?, ?, ?)"
+SQL_UPDATE_USER = "UPDATE users SET lives=?, last_recharge=? WHERE user_id=?"
+SQL_INSERT_HISTORY = """
+    INSERT INTO history (user_id, timestamp, log, score_link, score_track, score_total, satid, distance)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+# 新しい方から max_size 件目より古い行を1文でまとめて削除する（(user_id, id) インデックスを使う）
+SQL_TRIM_HISTORY = """
+    DELETE FROM history WHERE user_id=? AND id < (
+        SELECT id FROM history WHERE user_id=? ORDER BY id DESC LIMIT 1 OFFSET ?
+    )
+"""
+SQL_SELECT_HISTORY = "SELECT timestamp, log FROM history WHERE user_id=? ORDER BY id DESC"
+
+
+# ========================
+# マイグレーション
+# ========================
+# PRAGMA user_version で適用済みのバージョンを管理する
+
+HISTORY_COLUMNS = (
+    ("score_link", "INTEGER"),
+    ("score_track", "INTEGER"),
+    ("score_total", "INTEGER"),
+    ("satid", "INTEGER"),
+    ("distance", "REAL"),
+)
+LOG_PATTERN = re.compile(r"リンクスコア: (-?\d+)\s+トラックスコア: (-?\d+)\s+トータルスコア: (-?\d+)")
+
+def _migrate_typed_scores(conn):
+    # history に型付きの列を追加し、既存行は log の文字列から復元してランキングにも反映する
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(history)")}
+    for name, decl in HISTORY_COLUMNS:
+        if name not in columns:
+            conn.execute(f"ALTER TABLE history ADD COLUMN {name} {decl}")
+    for sql in leaderboard.SCHEMA:
+        conn.execute(sql)
+    rows = conn.execute("SELECT id, user_id, timestamp, log FROM history WHERE score_total IS NULL ORDER BY id").fetchall()
+    for history_id, user_id, timestamp, log in rows:
+        m = LOG_PATTERN.search(log or "")
+        if m is None:
+            continue
+        score_link, score_track, score_total = (int(x) for x in m.groups())
+        conn.execute(
+            "UPDATE history SET score_link=?, score_track=?, score_total=? WHERE id=?",
+            (score_link, score_track, score_total, history_id)
+        )
+        leaderboard.record_score(conn, user_id, score_total, timestamp)
+
+MIGRATIONS = [
+    _migrate_typed_scores,
+]
+
+
+# ========================
+# ストレージエンジン
+# ========================
+# プロセス全体で1つだけ生成し（st.cache_resource でキャッシュ）、
+# 調整済みの接続をプールして全セッションで使い回す
+
+def _count_statement(sql):
+    metrics.count("db_statements_total")
+
+
+class StorageEngine:
+    def __init__(self, path=DB_PATH, pool_size=POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self._pool = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 1 #作成済み（作成中を含む）の接続数。最初の1本はここで作る
+
+        # スキーマの確認とマイグレーションはエンジン生成時の1回だけ
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        for sql in SCHEMA:
+            conn.execute(sql)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for migrate in MIGRATIONS[version:]:
+            migrate(conn)
+        conn.execute(f"PRAGMA user_version={len(MIGRATIONS)}")
+        conn.execute("COMMIT")
+        self._pool.put(conn)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            isolation_level=None, #トランザクションは transaction() で明示的に張る
+            check_same_thread=False, #Streamlitはリラン毎にスレッドが変わる
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if metrics.enabled():
+            # 計測が有効な時だけ実行された文を数える（無効時はコールバック自体を付けない）
+            conn.set_trace_callback(_count_statement)
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        # 上限を超えて作らないように、接続する前にロック内で枠を確保する
+        with self._lock:
+            can_create = self._created < self.pool_size
+            if can_create:
+                self._created += 1
+        if not can_create:
+            return self._pool.get()
+        try:
+            return self._connect()
+        except BaseException:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        # 読み書きをまとめて1トランザクション（コミット1回）で実行する
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                # COMMIT が失敗した時も、開いたままのトランザクションを閉じてからプールに戻す
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+        with self._lock:
+            self._created = 0
+
+
+# ========================
+# ユーザー管理
+# ========================
+def get_or_create_user(conn, user_id):
+    with metrics.span("storage.get_or_create_user"):
+        row = conn.execute(SQL_SELECT_USER, (user_id,)).fetchone()
+
+        if row is None:
+            now = datetime.now().isoformat()
+            conn.execute(SQL_INSERT_USER, (user_id, 5, now))
+            # 別タブが先に作成していた場合はそちらを正とする
+            row = conn.execute(SQL_SELECT_USER, (user_id,)).fetchone()
+    return {
+        "user_id": row[0],
+        "lives": row[1],
+        "last_recharge": row[2]
+    }
+
+def update_user(conn, user):
+    with metrics.span("storage.update_user"):
+        conn.execute(SQL_UPDATE_USER, (user["lives"], user["last_recharge"], user["user_id"]))
+
+def trim_history(conn, user_id, max_size=10):
+    #max_sizeを超えた古い履歴を削除
+    conn.execute(SQL_TRIM_HISTORY, (user_id, user_id, max_size - 1))
+
+def _history_row(user_id, timestamp, log, game):
+    game = game or {}
+    return (
+        user_id, timestamp, log,
+        game.get("score_link"), game.get("score_track"), game.get("score_total"),
+        game.get("satid"), game.get("distance"),
+    )
+
+def add_history(conn, user_id, log, max_size=10, timestamp=None, game=None):
+    # game: {"score_link", "score_track", "score_total", "satid", "distance"}
+    if timestamp is None:
+        timestamp = datetime.now().isoformat()
+    with metrics.span("storage.add_history"):
+        conn.execute(SQL_INSERT_HISTORY, _history_row(user_id, timestamp, log, game))
+        if game and game.get("score_total") is not None:
+            leaderboard.record_score(conn, user_id, game["score_total"], timestamp)
+        trim_history(conn, user_id, max_size)
+
+def get_history(conn, user_id):
+    return conn.execute(SQL_SELECT_HISTORY, (user_id,)).fetchall()
+
+
+# ========================
+# 履歴の書き込みキュー（write-behind）
+# ========================
+# 終了したゲームの履歴はキューに積むだけにして、バックグラウンドで
+# 複数ユーザー分をまとめて1トランザクションで書き込む
+
+class HistoryWriter:
+    def __init__(self, storage, flush_interval=HISTORY_FLUSH_INTERVAL, max_batch=HISTORY_MAX_BATCH):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._retry = [] #書き込みに失敗したバッチ（次のフラッシュで先に書き直す）
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+        # プロセス終了時にも必ずフラッシュする
+        atexit.register(self.close)
+
+    def submit(self, user_id, log, max_size=10, timestamp=None, game=None):
+        if timestamp is None:
+            timestamp = datetime.now().isoformat()
+        self._queue.put((user_id, timestamp, log, max_size, game))
+        metrics.gauge("history_queue_pending", self._queue.qsize())
+
+    def pending(self):
+        return self._queue.qsize() + len(self._retry)
+
+    def _drain(self):
+        items, self._retry = self._retry, []
+        while len(items) < self.max_batch:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _write(self, items):
+        metrics.count("history_rows_written_total", len(items))
+        with metrics.span("storage.history_write"), self.storage.transaction() as conn:
+            conn.executemany(SQL_INSERT_HISTORY, [
+                _history_row(user_id, timestamp, log, game) for user_id, timestamp, log, _, game in items
+            ])
+            # 削除はユーザー毎に1回だけ
+            trims = {}
+            for user_id, timestamp, _, max_size, game in items:
+                trims[user_id] = max_size
+                if game and game.get("score_total") is not None:
+                    leaderboard.record_score(conn, user_id, game["score_total"], timestamp)
+            for user_id, max_size in trims.items():
+                trim_history(conn, user_id, max_size)
+
+    def flush(self):
+        with self._flush_lock:
+            while True:
+                items = self._drain()
+                if not items:
+                    break
+                try:
+                    self._write(items)
+                except BaseException:
+                    # 取り出したバッチは捨てずに戻しておき、次のフラッシュ（close() を含む）で書き直す
+                    self._retry = items
+                    raise
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("履歴の書き込みに失敗しました")
+
+    def close(self):
+        if not self._stop.is_set():
+            self._stop.set()
+            self._thread.join()
+            atexit.unregister(self.close)
+        self.flush()
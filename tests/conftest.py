@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+# リポジトリ直下のモジュールを import できるようにする（bench/ と同じやり方）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from storage import StorageEngine
+
+
+def pytest_addoption(parser):
+    parser.addoption("--runslow", action="store_true", help="大量データを作る slow のテストも実行する")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: 大量データを作るテスト（--runslow の時だけ実行）")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--runslow"):
+        return
+    skip = pytest.mark.skip(reason="--runslow の時だけ実行")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture
+def storage(tmp_path):
+    engine = StorageEngine(str(tmp_path / "game.db"))
+    yield engine
+    engine.close()
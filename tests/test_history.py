@@ -0,0 +1,127 @@
+import time
+import sqlite3
+import statistics
+
+import pytest
+
+from storage import HistoryWriter, add_history, get_history
+
+MAX_SIZE = 10
+
+
+def seed(storage, rows, users=1000):
+    # 他のユーザーの履歴を rows 件と、対象ユーザーの履歴を max_size 件入れておく
+    with storage.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO history (user_id, timestamp, log) VALUES (?, '2026-01-01T00:00:00', 'x')",
+            ((f"other{i % users}",) for i in range(rows)),
+        )
+        for i in range(MAX_SIZE):
+            add_history(conn, "me", f"game {i}", MAX_SIZE)
+
+
+def measure(conn, games=20):
+    # 1ゲーム分の書き込みで実行された文・VM命令数・時間を測る
+    statements, steps, times = [], [], []
+    counter = [0]
+
+    def step():
+        counter[0] += 1
+        return 0
+
+    conn.set_trace_callback(statements.append)
+    conn.set_progress_handler(step, 1)
+    try:
+        for i in range(games):
+            counter[0] = 0
+            start = time.perf_counter()
+            add_history(conn, "me", f"extra {i}", MAX_SIZE)
+            times.append(time.perf_counter() - start)
+            steps.append(counter[0])
+    finally:
+        conn.set_progress_handler(None, 1)
+        conn.set_trace_callback(None)
+    trims = sum(1 for sql in statements if sql.lstrip().startswith("DELETE FROM history"))
+    return trims, steps, statistics.median(times)
+
+
+def test_add_history_cost_does_not_grow_with_history(storage):
+    results = {}
+    for rows in (10, 100000):
+        with storage.connection() as conn:
+            conn.execute("DELETE FROM history")
+        seed(storage, rows)
+        with storage.connection() as conn:
+            results[rows] = measure(conn)
+            assert len(get_history(conn, "me")) == MAX_SIZE
+
+    small, large = results[10], results[100000]
+    # 1ゲームにつき削除は1文だけ
+    assert small[0] == large[0] == 20
+    # 実行される VM 命令数は履歴の総量に関係なく一定（全件走査していない）
+    assert max(large[1]) <= max(small[1]) * 1.2
+    assert large[2] < small[2] * 5 + 0.001
+
+
+def test_writer_trims_to_max_size_and_close_flushes(storage):
+    writer = HistoryWriter(storage, flush_interval=3600)
+    for i in range(25):
+        writer.submit("me", f"game {i}", MAX_SIZE)
+    writer.submit("you", "game 0", MAX_SIZE)
+    assert writer.pending() == 26
+
+    writer.flush()
+    with storage.connection() as conn:
+        history = get_history(conn, "me")
+    assert len(history) == MAX_SIZE
+    assert [log for _, log in history] == [f"game {i}" for i in range(24, 14, -1)]
+
+    # close() はキューに残った分を書き込んでから止まる
+    writer.submit("me", "last game", MAX_SIZE)
+    writer.close()
+    assert writer.pending() == 0
+    with storage.connection() as conn:
+        history = get_history(conn, "me")
+        assert len(history) == MAX_SIZE
+        assert history[0][1] == "last game"
+        assert len(get_history(conn, "you")) == 1
+
+
+def test_writer_issues_one_trim_per_user(storage):
+    writer = HistoryWriter(storage, flush_interval=3600)
+    statements = []
+    with storage.connection() as conn:
+        conn.set_trace_callback(statements.append)
+    for i in range(30):
+        writer.submit(f"user{i % 3}", f"game {i}", MAX_SIZE)
+    writer.close()
+    with storage.connection() as conn:
+        conn.set_trace_callback(None)
+    trims = [sql for sql in statements if sql.lstrip().startswith("DELETE FROM history")]
+    assert len(trims) == 3
+
+
+def test_writer_keeps_batch_when_write_fails(storage, monkeypatch):
+    writer = HistoryWriter(storage, flush_interval=3600)
+    for i in range(3):
+        writer.submit("me", f"game {i}", MAX_SIZE)
+
+    # 1回だけトランザクションの開始に失敗させる
+    transaction = storage.transaction
+    failures = [sqlite3.OperationalError("database is locked")]
+
+    def flaky_transaction():
+        if failures:
+            raise failures.pop()
+        return transaction()
+
+    monkeypatch.setattr(storage, "transaction", flaky_transaction)
+    with pytest.raises(sqlite3.OperationalError):
+        writer.flush()
+    assert writer.pending() == 3
+
+    writer.submit("me", "game 3", MAX_SIZE)
+    writer.close()
+    assert writer.pending() == 0
+    with storage.connection() as conn:
+        assert [log for _, log in get_history(conn, "me")] == ["game 3", "game 2", "game 1", "game 0"]
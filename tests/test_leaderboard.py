@@ -0,0 +1,136 @@
+import os
+import random
+import sqlite3
+import sys
+from datetime import datetime
+
+import pytest
+
+import leaderboard
+from leaderboard import PERIOD_ALL, PERIOD_DAY, PERIOD_WEEK
+from storage import StorageEngine, get_history
+
+MONDAY = datetime(2026, 10, 12, 12, 0) #週の始まり
+SUNDAY = datetime(2026, 10, 18, 23, 0)
+NEXT_MONDAY = datetime(2026, 10, 19, 0, 30)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bench"))
+from bench_leaderboard import seed, timed
+
+SLOW_GAMES = 2_000_000
+SLOW_USERS = 200_000
+TOP_P50_MS = 10 #実測 0.5ms 未満（余裕を持たせた上限）
+RANK_P50_MS = 20 #実測 3ms 未満
+MAX_MS = 100
+
+
+def record(storage, user_id, score, when):
+    with storage.transaction() as conn:
+        leaderboard.record_score(conn, user_id, score, when.isoformat())
+
+
+def test_top_and_rank_with_ties(storage):
+    for user_id, score in (("a", 300), ("b", 500), ("c", 300), ("d", 100)):
+        record(storage, user_id, score, MONDAY)
+    with storage.connection() as conn:
+        top = leaderboard.top(conn, PERIOD_ALL, k=3, when=MONDAY)
+        # 同点はユーザーID順
+        assert [(row["user_id"], row["best_score"]) for row in top] == [("b", 500), ("a", 300), ("c", 300)]
+        # 同点は同じ順位、その次は飛ばす
+        assert leaderboard.rank_of(conn, "a", when=MONDAY)["rank"] == 2
+        assert leaderboard.rank_of(conn, "c", when=MONDAY)["rank"] == 2
+        assert leaderboard.rank_of(conn, "d", when=MONDAY) == {"user_id": "d", "best_score": 100, "rank": 4, "users": 4}
+        assert leaderboard.rank_of(conn, "nobody", when=MONDAY) is None
+
+
+def test_improving_best_score_moves_user_up(storage):
+    record(storage, "a", 300, MONDAY)
+    record(storage, "b", 500, MONDAY)
+    record(storage, "a", 200, MONDAY) #ベストより低いスコアは順位に影響しない
+    with storage.connection() as conn:
+        assert leaderboard.rank_of(conn, "a", when=MONDAY)["rank"] == 2
+    record(storage, "a", 800, MONDAY)
+    with storage.connection() as conn:
+        assert leaderboard.rank_of(conn, "a", when=MONDAY) == {"user_id": "a", "best_score": 800, "rank": 1, "users": 2}
+        assert leaderboard.rank_of(conn, "b", when=MONDAY)["rank"] == 2
+        assert leaderboard.top(conn, when=MONDAY)[0] == {"user_id": "a", "best_score": 800, "games": 3}
+        # 集計表にはユーザー毎に1件分だけ残る
+        counts = conn.execute(
+            "SELECT score, users FROM leaderboard_counts WHERE period=? AND users != 0 ORDER BY score", (PERIOD_ALL,)
+        ).fetchall()
+        assert counts == [(500, 1), (800, 1)]
+
+
+def test_day_and_week_rollover(storage):
+    record(storage, "a", 900, MONDAY)
+    record(storage, "b", 400, SUNDAY)
+    record(storage, "b", 100, NEXT_MONDAY)
+    with storage.connection() as conn:
+        # 日ランキングはその日のゲームだけ
+        assert [row["user_id"] for row in leaderboard.top(conn, PERIOD_DAY, when=SUNDAY)] == ["b"]
+        assert leaderboard.top(conn, PERIOD_DAY, when=datetime(2026, 10, 13)) == []
+        # 週ランキングは月曜始まり
+        assert [row["user_id"] for row in leaderboard.top(conn, PERIOD_WEEK, when=SUNDAY)] == ["a", "b"]
+        assert leaderboard.top(conn, PERIOD_WEEK, when=NEXT_MONDAY) == [{"user_id": "b", "best_score": 100, "games": 1}]
+        assert leaderboard.rank_of(conn, "b", PERIOD_WEEK, when=NEXT_MONDAY)["rank"] == 1
+        # 全期間はベストスコアのまま
+        assert leaderboard.rank_of(conn, "b", PERIOD_ALL, when=NEXT_MONDAY)["best_score"] == 400
+
+
+def test_migration_backfills_scores_from_log_text(tmp_path):
+    # 型付きの列が無い変更前の形式のDBを作る
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE users (user_id TEXT PRIMARY KEY, lives INTEGER, last_recharge TEXT)")
+    conn.execute("CREATE TABLE history (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, timestamp TEXT, log TEXT)")
+    conn.executemany("INSERT INTO history (user_id, timestamp, log) VALUES (?, ?, ?)", [
+        ("a", MONDAY.isoformat(), "リンクスコア: 120\t\tトラックスコア: 2500\t\tトータルスコア: 2620"),
+        ("a", SUNDAY.isoformat(), "リンクスコア: 80\t\tトラックスコア: 0\t\tトータルスコア: 80"),
+        ("b", SUNDAY.isoformat(), "リンクスコア: 200\t\tトラックスコア: -10\t\tトータルスコア: 190"),
+        ("b", SUNDAY.isoformat(), "壊れたログ"),
+    ])
+    conn.commit()
+    conn.close()
+
+    storage = StorageEngine(path)
+    try:
+        with storage.connection() as conn:
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == 1
+            rows = conn.execute("SELECT user_id, score_link, score_track, score_total FROM history ORDER BY id").fetchall()
+            assert rows == [("a", 120, 2500, 2620), ("a", 80, 0, 80), ("b", 200, -10, 190), ("b", None, None, None)]
+            assert [(row["user_id"], row["best_score"], row["games"]) for row in leaderboard.top(conn, when=SUNDAY)] == [
+                ("a", 2620, 2), ("b", 190, 1),
+            ]
+            assert [row["user_id"] for row in leaderboard.top(conn, PERIOD_DAY, when=SUNDAY)] == ["b", "a"]
+            assert len(get_history(conn, "b")) == 2
+    finally:
+        storage.close()
+
+    # 2回目に開いた時はマイグレーションを繰り返さない
+    storage = StorageEngine(path)
+    try:
+        with storage.connection() as conn:
+            assert leaderboard.top(conn, when=SUNDAY)[0]["games"] == 2
+    finally:
+        storage.close()
+
+
+@pytest.fixture(scope="module")
+def seeded(tmp_path_factory):
+    storage = StorageEngine(str(tmp_path_factory.mktemp("leaderboard") / "bench.db"))
+    seed(storage, SLOW_GAMES, SLOW_USERS, days=28)
+    yield storage
+    storage.close()
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("period", leaderboard.PERIODS)
+def test_latency_with_millions_of_games(seeded, period):
+    rnd = random.Random(1)
+    with seeded.connection() as conn:
+        assert len(leaderboard.top(conn, period, 10)) == 10
+        assert leaderboard.rank_of(conn, "user0", PERIOD_ALL)["users"] > SLOW_USERS * 0.99
+        top = timed(lambda: leaderboard.top(conn, period, 10), 100)
+        rank = timed(lambda: leaderboard.rank_of(conn, f"user{rnd.randrange(SLOW_USERS)}", period), 100)
+    assert top["p50_ms"] < TOP_P50_MS and top["max_ms"] < MAX_MS
+    assert rank["p50_ms"] < RANK_P50_MS and rank["max_ms"] < MAX_MS
@@ -0,0 +1,68 @@
+import threading
+from datetime import datetime, timedelta
+
+import lives
+from storage import get_or_create_user
+
+THREADS = 40
+START = datetime(2026, 10, 12, 9, 0, 0)
+
+
+def run_threads(target, n=THREADS):
+    # 全スレッドを揃えてから同時に走らせる
+    barrier = threading.Barrier(n)
+    results = [None] * n
+    errors = []
+
+    def worker(i):
+        barrier.wait()
+        try:
+            results[i] = target(i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    return results
+
+
+def test_concurrent_consume_succeeds_exactly_max_lives_times(storage):
+    with storage.transaction() as conn:
+        get_or_create_user(conn, "u")
+        conn.execute("UPDATE users SET last_recharge=? WHERE user_id='u'", (START.isoformat(),))
+
+    def play(i):
+        # 消費と回復を交互に混ぜる（同じ時刻なので回復は起きない）
+        with storage.transaction() as conn:
+            if i % 2:
+                lives.recharge(conn, "u", START)
+                return None
+            return lives.consume(conn, "u", START)[0]
+
+    results = run_threads(play)
+    assert sum(1 for r in results if r) == lives.MAX_LIVES
+    with storage.connection() as conn:
+        assert lives.get_lives(conn, "u")["lives"] == 0
+
+    # 2.5時間後は2つだけ回復し、端数の30分は次の回復に持ち越す
+    later = START + timedelta(hours=2, minutes=30)
+    results = run_threads(lambda i: _recharge(storage, later))
+    assert all(r["lives"] == 2 for r in results)
+    assert results[0]["last_recharge"] == (START + 2 * lives.RECOVER_INTERVAL).isoformat(timespec="milliseconds")
+
+
+def test_consume_from_full_starts_timer(storage):
+    with storage.transaction() as conn:
+        get_or_create_user(conn, "u")
+        ok, state = lives.consume(conn, "u", START)
+    assert ok
+    assert state == {"lives": lives.MAX_LIVES - 1, "last_recharge": START.isoformat()}
+
+
+def _recharge(storage, now):
+    with storage.transaction() as conn:
+        return lives.recharge(conn, "u", now)
@@ -0,0 +1,128 @@
+import os
+import sys
+
+import pytest
+
+import metrics
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+
+@pytest.fixture
+def enabled():
+    metrics.reset()
+    metrics.configure(True)
+    yield
+    metrics.configure(False)
+    metrics.reset()
+
+
+@pytest.fixture
+def fake_n2yo():
+    from fake_n2yo import FakeN2YO, serve
+    server = serve(FakeN2YO(constellation=50))
+    yield f"http://127.0.0.1:{server.server_port}/rest/v1/satellite"
+    server.shutdown()
+
+
+def tree(span):
+    # (深さ, スパン名) の一覧
+    return [(depth, s.name) for depth, s in span.walk()]
+
+
+def parent(root, name):
+    # name のスパンの親の名前（無ければ None）
+    for _, span in root.walk():
+        for child in span.children:
+            if child.name == name:
+                return span.name
+    return None
+
+
+def test_spans_nest_under_parent(enabled):
+    with metrics.span("rerun") as root:
+        with metrics.span("render.link"):
+            with metrics.span("lives.consume"):
+                pass
+        with metrics.span("render.track"):
+            pass
+    assert metrics.last_trace() is root
+    assert tree(root) == [(0, "rerun"), (1, "render.link"), (2, "lives.consume"), (1, "render.track")]
+
+
+def test_disabled_records_nothing():
+    metrics.reset()
+    with metrics.span("rerun") as span:
+        metrics.count("games_started_total")
+    assert span is None
+    assert metrics.render_prometheus() == "\n"
+
+
+def test_link_and_track_rerun_traces(enabled, fake_n2yo, tmp_path, monkeypatch):
+    from streamlit.testing.v1 import AppTest
+
+    # game.db やカタログはテスト用の空ディレクトリで扱う（カタログが無いので N2YO の偽サーバーを使う）
+    monkeypatch.chdir(tmp_path)
+    at = AppTest.from_file(os.path.join(ROOT, "demo_app.py"), default_timeout=30)
+    at.secrets["N2YO_API_KEY"] = "test"
+    at.secrets["N2YO_BASE_URL"] = fake_n2yo
+    at.secrets["N2YO_QUOTA_ENABLED"] = False
+    at.run()
+    at.button[0].click().run() #リンク
+    at.selectbox[0].select_index(1).run()
+    at.button[1].click().run() #トラック
+    assert not at.exception
+
+    traces = list(at.session_state["traces"]["rerun"])
+    # 各リランのルートは rerun で、その直下にフラグメント、その下に各処理が付く
+    assert all(trace.name == "rerun" for trace in traces)
+    for trace in traces:
+        assert all(name.startswith("render.") for depth, name in tree(trace) if depth == 1)
+    # リンク: st.rerun() で中断されるのでリンク欄までのスパンだけが残る
+    link = next(tree(t) for t in traces if parent(t, "lives.consume"))
+    assert link[:4] == [(0, "rerun"), (1, "render.life"), (1, "render.input"), (1, "render.link")]
+    assert {name for depth, name in link[4:]} >= {"n2yo.above", "lives.consume", "scoring.link"}
+    assert all(depth == 2 for depth, name in link[4:])
+    # トラック: 位置の取得とスコア計算はトラック欄の下
+    track = next(t for t in traces if parent(t, "scoring.track"))
+    assert parent(track, "scoring.track") == "render.track"
+    assert parent(track, "orbit.position") == "render.track"
+    assert (1, "render.score") in tree(traces[-1])
+
+    text = metrics.render_prometheus()
+    assert "# TYPE satrack_span_duration_seconds histogram" in text
+    assert 'satrack_span_duration_seconds_bucket{span="rerun",le="+Inf"}' in text
+    assert 'satrack_span_duration_seconds_count{span="render.track"}' in text
+    assert "# TYPE satrack_games_started_total counter" in text
+    assert "satrack_games_finished_total 1" in text
+    assert "satrack_db_statements_total" in text
+
+
+def test_auto_refresh_does_not_push_out_rerun_traces(enabled):
+    from streamlit.testing.v1 import AppTest
+
+    from demo_app import DEBUG_TRACES
+
+    def script():
+        from demo_app import DEBUG_TRACES, traced
+
+        @traced("render.life")
+        def life():
+            pass
+
+        @traced("rerun")
+        def main():
+            life()
+
+        main()
+        # 自動更新のフラグメントだけが何度も再実行された状態
+        for _ in range(DEBUG_TRACES * 3):
+            life()
+
+    at = AppTest.from_function(script).run()
+    assert not at.exception
+    traces = at.session_state["traces"]
+    assert len(traces["rerun"]) == 1
+    assert [tree(t) for t in traces["rerun"]] == [[(0, "rerun"), (1, "render.life")]]
+    assert len(traces["render.life"]) == DEBUG_TRACES
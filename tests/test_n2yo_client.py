@@ -0,0 +1,363 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import metrics
+from n2yo_client import (
+    RETRY_BACKOFF, RETRY_TOTAL, SINGLE_FLIGHT_TIMEOUT, TIMEOUT, N2YOClient, N2YOError, QuotaExceeded, ResponseCache, SingleFlight,
+)
+from quota import PRIORITY_INTERACTIVE, PRIORITY_WAIT, QuotaManager
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self._data = data
+        self.status_code = status_code
+
+    def json(self):
+        return self._data
+
+
+class FakeSession:
+    # N2YO の代わりにパス毎の決まった結果を返し、送ったリクエストを記録する
+    def __init__(self, handler):
+        self.handler = handler
+        self.urls = []
+        self._lock = threading.Lock()
+
+    def get(self, url, timeout=None):
+        with self._lock:
+            self.urls.append(url)
+        result = self.handler(url)
+        # (ステータス, 本文) を返すハンドラはエラー応答を再現する
+        return FakeResponse(result[1], result[0]) if isinstance(result, tuple) else FakeResponse(result)
+
+
+def above_payload(url):
+    return {"info": {"satcount": 1}, "above": [{"satid": 25544, "satname": "ISS (ZARYA)"}]}
+
+
+class Clock:
+    def __init__(self, now=1_800_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    clock = Clock()
+    cache = ResponseCache(ttl=10, clock=clock)
+    cache.put("k", 1)
+    clock.now += 9.9
+    assert cache.get("k") == 1
+    clock.now += 0.1
+    assert cache.get("k") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_ratio": 0.5, "size": 0}
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(maxsize=2, clock=Clock())
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a") #a を新しくする
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["size"] == 2
+
+
+def client_with_clock(handler=above_payload):
+    clock = Clock()
+    session = FakeSession(handler)
+    client = N2YOClient("key", session=session, cache=ResponseCache(clock=clock), clock=clock)
+    return clock, session, client
+
+
+def test_nearby_observers_share_grid_cell():
+    clock, session, client = client_with_clock()
+    # GRID_DEG = 0.05, GRID_ALT_KM = 0.5 で同じセル (35.0, 139.0, 0.0) になる
+    first = client.above(35.01, 139.02, 0.1)
+    assert client.above(34.98, 138.99, 0.2) is first
+    assert len(session.urls) == 1
+    assert "/above/35.0/139.0/0.0/" in session.urls[0]
+    client.above(35.1, 139.0, 0.0)
+    assert len(session.urls) == 2
+    assert client.cache_stats()["hits"] == 1
+
+
+def test_time_bucket_rollover_misses():
+    clock, session, client = client_with_clock()
+    clock.now = 1_800_000_000.0 #バケットの先頭
+    client.above(35.0, 139.0, 0.0)
+    clock.now += 9.9
+    client.above(35.0, 139.0, 0.0)
+    assert len(session.urls) == 1
+    # TTL 内でも次の時間バケットに入ったら取り直す
+    clock.now += 0.1
+    client.above(35.0, 139.0, 0.0)
+    assert len(session.urls) == 2
+
+
+def test_retry_is_bounded_with_backoff():
+    sleeps = []
+    session = FakeSession(lambda url: (503, {}))
+    client = N2YOClient("key", session=session, sleep=sleeps.append)
+    with pytest.raises(N2YOError):
+        client.above(35.0, 139.0, 0.0)
+    assert len(session.urls) == RETRY_TOTAL + 1
+    assert sleeps == [RETRY_BACKOFF * 2 ** i for i in range(RETRY_TOTAL)]
+
+
+def test_hit_ratio_is_exported():
+    metrics.reset()
+    metrics.configure(True)
+    try:
+        clock, session, client = client_with_clock()
+        for _ in range(4):
+            client.above(35.0, 139.0, 0.0)
+        text = metrics.render_prometheus()
+    finally:
+        metrics.configure(False)
+        metrics.reset()
+    assert "satrack_n2yo_cache_hit_ratio 0.75" in text
+    assert 'satrack_n2yo_cache_requests_total{result="hit"} 3' in text
+
+
+def test_caller_missing_the_cache_as_leader_finishes_reuses_result():
+    session = FakeSession(above_payload)
+    client = N2YOClient("key", session=session)
+    first = client.above(35.0, 139.0, 0.0)
+
+    # 先行リクエストが結果を入れる直前にキャッシュを見た呼び出しを再現する
+    get = client.cache.get
+    stale_reads = [None]
+    client.cache.get = lambda key: stale_reads.pop() if stale_reads else get(key)
+    second = client.above(35.0, 139.0, 0.0)
+
+    assert second is first
+    assert len(session.urls) == 1
+    assert client.flight_stats()["leaders"] == 2
+
+
+def test_concurrent_identical_requests_send_one_request():
+    release = threading.Event()
+
+    def slow_payload(url):
+        release.wait(5)
+        return above_payload(url)
+
+    session = FakeSession(slow_payload)
+    client = N2YOClient("key", session=session)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.above(35.0, 139.0, 0.0))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(results) == 8
+    assert len(session.urls) == 1
+
+
+def start_followers(flights, key, n, timeout=None):
+    # 先行リクエストの実行中に同じキーで n 件相乗りさせ、それぞれの結果か例外を集める
+    outcomes = []
+
+    def follow():
+        try:
+            outcomes.append(flights.do(key, lambda: "follower sent", timeout=timeout))
+        except Exception as e:
+            outcomes.append(e)
+    threads = [threading.Thread(target=follow) for _ in range(n)]
+    for t in threads:
+        t.start()
+    deadline = time.monotonic() + 5
+    while flights.stats()["followers"] < n and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return threads, outcomes
+
+
+def test_leader_error_reaches_every_follower():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    error = N2YOError("HTTP 503")
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise error
+    leader = []
+
+    def lead():
+        try:
+            flights.do("k", failing)
+        except N2YOError as e:
+            leader.append(e)
+    thread = threading.Thread(target=lead)
+    thread.start()
+    started.wait(5)
+    threads, outcomes = start_followers(flights, "k", 4)
+    release.set()
+    for t in threads + [thread]:
+        t.join()
+    assert leader == [error]
+    assert outcomes == [error] * 4
+    assert flights.stats() == {"leaders": 1, "followers": 4, "in_flight": 0, "coalescing_ratio": 0.8}
+
+
+def test_follower_timeout_is_per_call():
+    flights = SingleFlight(timeout=5)
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return "leader result"
+    thread = threading.Thread(target=lambda: flights.do("k", slow))
+    thread.start()
+    started.wait(5)
+    # 短いタイムアウトを指定した呼び出しだけが先に諦め、既定のタイムアウトの呼び出しは結果を待つ
+    impatient, impatient_outcomes = start_followers(flights, "k", 1, timeout=0.05)
+    for t in impatient:
+        t.join()
+    patient, patient_outcomes = start_followers(flights, "k", 1)
+    release.set()
+    for t in patient + [thread]:
+        t.join()
+    assert isinstance(impatient_outcomes[0], N2YOError)
+    assert patient_outcomes == ["leader result"]
+    # タイムアウトした後も同じキーの新しいリクエストは送れる
+    assert flights.do("k", lambda: "next") == "next"
+
+
+def test_single_flight_outlasts_leader_worst_case():
+    sends = RETRY_TOTAL + 1
+    worst = sends * (PRIORITY_WAIT[PRIORITY_INTERACTIVE] + sum(TIMEOUT)) + sum(RETRY_BACKOFF * 2 ** i for i in range(RETRY_TOTAL))
+    assert SINGLE_FLIGHT_TIMEOUT > worst
+
+
+def test_single_flight_roles_are_exported():
+    metrics.reset()
+    metrics.configure(True)
+    try:
+        client = N2YOClient("key", session=FakeSession(above_payload))
+        client.cache.get = lambda key: None #毎回 single-flight まで進める
+        client.above(35.0, 139.0, 0.0)
+        client.above(35.0, 139.0, 0.0)
+        text = metrics.render_prometheus()
+    finally:
+        metrics.configure(False)
+        metrics.reset()
+    assert 'satrack_n2yo_singleflight_total{role="leader"} 2' in text
+    assert "satrack_n2yo_singleflight_in_flight 0" in text
+
+
+class RefusingQuota:
+    # トークンが取れない状態（古い結果があればそれを返すしかない）
+    def degraded(self, endpoint):
+        return False
+
+    def acquire(self, endpoint, priority=None):
+        return False
+
+
+def positions_payload(first, n):
+    return {"info": {"satid": 25544}, "positions": [
+        {"satlatitude": float(i), "satlongitude": 0.0, "timestamp": first + i} for i in range(n)
+    ]}
+
+
+def test_stale_positions_start_at_current_sample():
+    now = 1_800_000_000
+    clock = Clock(now)
+    session = FakeSession(lambda url: positions_payload(now - 100, 300))
+    client = N2YOClient("key", session=session, clock=clock)
+    client.positions(25544, 35.0, 139.0, 0.0, 300)
+
+    # 別の観測地点（キャッシュは外れる）でクォータが無い時は、古い軌道の現在時刻以降を返す
+    clock.now = now + 30
+    client.quota = RefusingQuota()
+    data = client.positions(25544, 10.0, 20.0, 0.0, 300)
+    assert data["positions"][0]["timestamp"] == now + 30
+    assert data["positions"][-1]["timestamp"] == now + 199
+    assert len(session.urls) == 1
+
+
+def test_stale_positions_not_covering_now_raise():
+    now = 1_800_000_000
+    clock = Clock(now)
+    session = FakeSession(lambda url: positions_payload(now, 1))
+    client = N2YOClient("key", session=session, clock=clock)
+    client.positions(25544, 35.0, 139.0, 0.0)
+
+    # 古い結果（1秒分）はもう現在時刻を含まないので使わない
+    clock.now = now + 300
+    client.quota = RefusingQuota()
+    with pytest.raises(QuotaExceeded):
+        client.positions(25544, 10.0, 20.0, 0.0)
+    assert len(session.urls) == 1
+
+
+def quota_client(storage, status, limit=100):
+    # above の容量は limit の2割。時計は止めておく（補充されない）
+    quota = QuotaManager(storage, limits={"above": limit}, clock=lambda: 1000.0)
+    session = FakeSession(lambda url: (status, {}))
+    return quota, session, N2YOClient("key", session=session, quota=quota, sleep=lambda seconds: None)
+
+
+def test_every_retry_takes_a_token(storage):
+    quota, session, client = quota_client(storage, 503)
+    with pytest.raises(N2YOError):
+        client.above(35.0, 139.0, 0.0)
+    assert len(session.urls) == RETRY_TOTAL + 1
+    assert quota.budget("above") == 20 - (RETRY_TOTAL + 1)
+
+
+def test_throttled_request_is_not_retried(storage):
+    quota, session, client = quota_client(storage, 429)
+    with pytest.raises(N2YOError):
+        client.above(35.0, 139.0, 0.0)
+    assert len(session.urls) == 1
+    assert quota.budget("above") == 19
+
+
+def test_retries_stop_when_quota_runs_out(storage):
+    quota, session, client = quota_client(storage, 503, limit=10)
+    with pytest.raises(N2YOError):
+        client.above(35.0, 139.0, 0.0)
+    # 容量 2 を使い切ったらリトライしない
+    assert len(session.urls) == 2
+    assert quota.budget("above") == 0
+
+
+def test_transport_does_not_retry_on_its_own(storage):
+    # 実際の HTTP サーバーに対して、送信回数とトークンの消費が一致することを確かめる
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            self.send_response(503 if len(requests_seen) == 1 else 429)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        quota = QuotaManager(storage, limits={"above": 100}, clock=lambda: 1000.0)
+        client = N2YOClient("key", base_url=f"http://127.0.0.1:{server.server_port}", quota=quota, sleep=lambda seconds: None)
+        with pytest.raises(N2YOError):
+            client.above(35.0, 139.0, 0.0)
+    finally:
+        server.shutdown()
+    # 503 を1回リトライし、429 で止まる
+    assert len(requests_seen) == 2
+    assert quota.budget("above") == 18
@@ -0,0 +1,71 @@
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from orbit import TLECatalog, geodetic_to_ecef, observer_frame, parse_tle
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+REFERENCE_TLE = os.path.join(DATA_DIR, "reference.tle")
+
+# skyfield 1.55 の wgs84.geographic_position_of で求めた衛星直下点（緯度, 経度, 高度 km）
+# skyfield は UT1 と極運動を使うので、経度は UT1-UTC の分（約0.001度）ずれる
+REFERENCE_POSITIONS = [
+    (5, "2000-06-27T19:20:19", 34.3548, -125.1493, 2816.177),
+    (5, "2000-06-28T00:50:19", -23.6919, -81.1730, 2457.800),
+    (5, "2000-06-28T18:50:19", -34.2688, 61.6819, 1285.139),
+    (6251, "2006-06-25T20:16:43", 49.3133, -30.2017, 385.449),
+    (6251, "2006-06-26T01:46:43", -32.1757, 89.2841, 428.960),
+    (6251, "2006-06-26T19:46:43", -21.3970, 32.3654, 395.786),
+    (28057, "2006-06-26T19:22:04", 70.5070, -112.9723, 785.038),
+    (28057, "2006-06-27T00:52:04", -31.1983, 134.8001, 785.523),
+    (28057, "2006-06-27T18:52:04", 54.3494, -118.2283, 781.930),
+]
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    return TLECatalog(REFERENCE_TLE)
+
+
+@pytest.mark.parametrize("satid, when, lat, lon, alt", REFERENCE_POSITIONS)
+def test_position_matches_reference(catalog, satid, when, lat, lon, alt):
+    when = datetime.fromisoformat(when).replace(tzinfo=timezone.utc)
+    position = catalog.position(satid, when)
+    assert position["timestamp"] == int(when.timestamp())
+    assert position["satlatitude"] == pytest.approx(lat, abs=2e-4)
+    assert position["satlongitude"] == pytest.approx(lon, abs=2e-3)
+    assert position["sataltitude"] == pytest.approx(alt, abs=0.01)
+
+
+def test_trajectory_and_propagate_all_agree_with_position(catalog):
+    when = datetime(2006, 6, 26, 19, 46, 43, tzinfo=timezone.utc)
+    satids, ecef = catalog.propagate_all(when)
+    assert sorted(satids.tolist()) == [5, 6251, 28057]
+    trajectory = catalog.trajectory(6251, [when.timestamp()])
+    assert np.allclose(trajectory[0], ecef[satids.tolist().index(6251)])
+
+
+def test_unknown_satellite(catalog):
+    assert 25544 not in catalog
+    assert catalog.position(25544) is None
+    assert catalog.trajectory(25544, [0.0]) is None
+
+
+def test_parse_tle_formats():
+    with open(REFERENCE_TLE, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    # 3行形式・"0 " 付きの名前・2行形式（名前は satid）を混ぜても読める
+    text = "\n".join([lines[0], lines[1], lines[2], "0 " + lines[3], lines[4], lines[5], "", lines[7], lines[8]])
+    records = parse_tle(text)
+    assert [(satid, name) for satid, name, _, _ in records] == [(5, "VANGUARD 1"), (6251, "COSMOS 1"), (28057, "28057")]
+
+
+@pytest.mark.parametrize("lat, lon, alt_km", [(35.0, 139.0, 0.0), (-89.5, -70.0, 1.2), (0.0, 180.0, 0.0)])
+def test_observer_frame_zenith_is_ellipsoid_normal(lat, lon, alt_km):
+    obs, zenith = observer_frame(lat, lon, alt_km)
+    assert obs == pytest.approx(geodetic_to_ecef(lat, lon, alt_km))
+    assert np.linalg.norm(zenith) == pytest.approx(1.0)
+    # 真上に 100km 上がった点は天頂方向にちょうど 100km 進んだ所
+    assert np.array(geodetic_to_ecef(lat, lon, alt_km + 100.0)) - obs == pytest.approx(100.0 * zenith, abs=1e-6)
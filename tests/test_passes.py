@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+
+from orbit import TLECatalog, geodetic_to_ecef
+from passes import PassTracker, Trajectory
+from scoring import pass_scores
+
+REFERENCE_TLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "reference.tle")
+NOW = 1_800_000_000 #2027年。6251 は減衰済みで SGP4 の伝播がエラーになる
+
+
+class FakeN2YO:
+    def __init__(self):
+        self.requested = []
+
+    def positions(self, sat_id, lat, lon, alt_km, seconds=1, priority=None):
+        self.requested.append(sat_id)
+        return {"positions": [
+            {"satlatitude": lat, "satlongitude": lon, "sataltitude": 500.0, "timestamp": NOW + i} for i in range(seconds)
+        ]}
+
+
+def overhead(lat, lon, start, seconds):
+    # 観測地点の真上に止まっている軌道
+    times = np.arange(start, start + seconds + 1, dtype=float)
+    return Trajectory(times, np.tile(geodetic_to_ecef(lat, lon, 500.0), (len(times), 1)))
+
+
+def test_visible_seconds_count_intervals_not_samples():
+    elevation = np.full(121, 45.0)
+    assert pass_scores(np.zeros(121), elevation, 1.0)["visible_seconds"] == 120
+    # 地平線をまたぐ区間は半分だけ数える
+    elevation[:10] = -5.0
+    assert pass_scores(np.zeros(121), elevation, 1.0)["visible_seconds"] == 110.5
+
+
+def test_visible_seconds_match_window():
+    tracker = PassTracker(catalog=set(), n2yo=FakeN2YO())
+    for seconds in (30, 120, 240):
+        result = tracker.score(overhead(35.0, 139.0, NOW, 300), 35.0, 139.0, 0.0, NOW, seconds)
+        assert result["seconds"] == seconds
+        assert result["visible_seconds"] == seconds
+
+
+def test_catalog_propagation_failure_falls_back_to_n2yo():
+    catalog = TLECatalog(REFERENCE_TLE)
+    assert 6251 in catalog
+    n2yo = FakeN2YO()
+    tracker = PassTracker(catalog, n2yo)
+    result = tracker.track(6251, 35.0, 139.0, 0.0, 60, now=NOW)
+    assert n2yo.requested == [6251]
+    assert result["visible_seconds"] == 60
+
+    # 伝播できる衛星は N2YO を呼ばない
+    assert tracker.track(5, 35.0, 139.0, 0.0, 60, now=NOW) is not None
+    assert n2yo.requested == [6251]
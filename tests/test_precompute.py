@@ -0,0 +1,69 @@
+import math
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+from sgp4 import exporter
+from sgp4.api import WGS72, Satrec
+
+from orbit import TLECatalog
+from precompute import DEFAULT_HOT_CELLS, PRECOMPUTE_RADIUS, VisibilityIndex
+from visibility import VisibilityEngine
+
+NOW = datetime(2026, 10, 12, 3, 0, 25, tzinfo=timezone.utc).timestamp() #バケットの途中
+EPOCH = datetime(2026, 10, 11, 12, 0, 0, tzinfo=timezone.utc)
+JD_1949 = 2433281.5
+
+
+@pytest.fixture(scope="module")
+def tle_path(tmp_path_factory):
+    # LEO の円軌道に近い衛星をランダムに並べた TLE（乱数は固定）
+    rnd = np.random.default_rng(17)
+    epoch = EPOCH.timestamp() / 86400 + 2440587.5 - JD_1949
+    lines = []
+    for i in range(400):
+        sat = Satrec()
+        sat.sgp4init(
+            WGS72, "i", 90000 + i, epoch, 1e-5, 0.0, 0.0, rnd.uniform(0.0001, 0.01),
+            math.radians(rnd.uniform(0, 360)), math.radians(rnd.uniform(30, 98)), math.radians(rnd.uniform(0, 360)),
+            2 * math.pi / rnd.uniform(92, 110), math.radians(rnd.uniform(0, 360)),
+        )
+        line1, line2 = exporter.export_tle(sat)
+        lines += [f"SAT-{i}", line1, line2]
+    path = tmp_path_factory.mktemp("tle") / "fixture.tle"
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path)
+
+
+@pytest.fixture
+def index(storage, tle_path):
+    engine = VisibilityEngine(TLECatalog(tle_path))
+    index = VisibilityIndex(storage, engine, horizon=3, clock=lambda: NOW)
+    assert index.precompute() == len(index.cells) * 4
+    return index
+
+
+def test_lookup_matches_engine_at_bucket_start(index):
+    current = index.bucket_of(NOW)
+    visible = 0
+    for bucket in range(current, current + 4):
+        when = index.bucket_time(bucket)
+        for cell_lat, cell_lon in index.cells:
+            expected = index.engine.above(cell_lat, cell_lon, 0.0, PRECOMPUTE_RADIUS, when=when)
+            # セル内の地点・バケット内の時刻はどれもセル中心・バケット先頭の結果になる
+            for lat, lon, offset in ((cell_lat, cell_lon, 0), (cell_lat + 0.1, cell_lon - 0.1, 59)):
+                got = index.lookup(lat, lon, datetime.fromtimestamp(when.timestamp() + offset, timezone.utc))
+                assert [s["satid"] for s in got["above"]] == [s["satid"] for s in expected["above"]]
+                for a, b in zip(got["above"], expected["above"]):
+                    assert a == pytest.approx(b)
+            visible += len(expected["above"])
+    assert visible > 0
+
+
+def test_lookup_outside_index(index):
+    # 対象外のセル・計算していないバケットは None（呼び出し側でその場で計算する）
+    assert index.lookup(0.0, 0.0) is None
+    lat, lon = DEFAULT_HOT_CELLS[0]
+    after = index.bucket_time(index.bucket_of(NOW) + 4)
+    assert index.lookup(lat, lon, after) is None
+    assert index.lookup(lat, lon) is not None
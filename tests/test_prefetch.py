@@ -0,0 +1,45 @@
+import threading
+
+from prefetch import PositionPrefetcher
+from quota import PRIORITY_INTERACTIVE, QuotaManager
+
+
+class FakeN2YO:
+    def __init__(self, quota=None):
+        self.quota = quota
+        self.requested = []
+        self._lock = threading.Lock()
+
+    def positions(self, sat_id, lat, lon, alt_km, seconds=1, priority=PRIORITY_INTERACTIVE):
+        with self._lock:
+            self.requested.append(sat_id)
+        return {"positions": [{"timestamp": 0, "satlatitude": lat, "satlongitude": lon, "sataltitude": 500.0}]}
+
+
+def wait_all(batch):
+    for future in batch.futures.values():
+        future.result(timeout=5)
+
+
+def test_prefetches_selected_candidates_up_to_limit():
+    n2yo = FakeN2YO()
+    prefetcher = PositionPrefetcher(n2yo, catalog={25544}, max_per_link=2)
+    batch = prefetcher.start([1], 35.0, 139.0, 0.0)
+    assert prefetcher.prefetch(batch, 1) is False #済み
+    assert prefetcher.prefetch(batch, 25544) is False #カタログにある
+    assert prefetcher.prefetch(batch, 2) is True
+    assert prefetcher.prefetch(batch, 3) is False #上限
+    wait_all(batch)
+    assert sorted(n2yo.requested) == [1, 2]
+    assert batch.positions(2)[0]["satlatitude"] == 35.0
+
+
+def test_skips_prefetch_when_quota_has_no_headroom(storage):
+    quota = QuotaManager(storage, limits={"positions": 10}, clock=lambda: 1000.0)
+    n2yo = FakeN2YO(quota)
+    prefetcher = PositionPrefetcher(n2yo, catalog=set())
+    # 容量 2 のうち 1 はボタン操作用に残すので、1 つ使った後は先読みしない
+    assert quota.acquire("positions", PRIORITY_INTERACTIVE)
+    batch = prefetcher.start([1, 2], 35.0, 139.0, 0.0)
+    assert batch.futures == {}
+    assert n2yo.requested == []
@@ -0,0 +1,77 @@
+import threading
+
+from quota import BURST_RATIO, HOURLY_LIMITS, PRIORITY_WAIT, WINDOW_SECONDS, QuotaManager
+
+THREADS = 8
+STEP = 60 #1ラウンドで進める時刻（秒）
+HOURS = 3
+
+
+class RoundClock:
+    # 全スレッド共通のラウンドの時刻に、スレッド毎に sleep した分を足して返す
+    def __init__(self, start):
+        self.now = start
+        self._local = threading.local()
+
+    def start_round(self):
+        self._local.offset = 0.0
+
+    def __call__(self):
+        return self.now + getattr(self._local, "offset", 0.0)
+
+    def sleep(self, seconds):
+        self._local.offset = getattr(self._local, "offset", 0.0) + seconds
+
+
+def max_in_window(times, window=WINDOW_SECONDS):
+    times = sorted(times)
+    best, lo = 0, 0
+    for hi, t in enumerate(times):
+        while times[lo] <= t - window:
+            lo += 1
+        best = max(best, hi - lo + 1)
+    return best
+
+
+def test_concurrent_above_grants_stay_under_hourly_limit(storage):
+    clock = RoundClock(1_000_000.0)
+    quota = QuotaManager(storage, clock=clock, sleep=clock.sleep)
+    rounds = HOURS * WINDOW_SECONDS // STEP
+    # 各ラウンドの付与は [ラウンド時刻, +最大待ち時間] の間に起きるので、ラウンド時刻で数えてよい
+    assert PRIORITY_WAIT[0] < STEP
+
+    def advance():
+        clock.now += STEP
+
+    barrier = threading.Barrier(THREADS, action=advance)
+    grants = []
+    lock = threading.Lock()
+    errors = []
+
+    def worker():
+        try:
+            for _ in range(rounds):
+                barrier.wait()
+                clock.start_round()
+                round_time = clock.now
+                if quota.acquire("above"):
+                    with lock:
+                        grants.append(round_time)
+        except Exception as e:
+            errors.append(e)
+            barrier.abort()
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    limit = HOURLY_LIMITS["above"]
+    assert max_in_window(grants) <= limit
+    # 要求は上限を大きく超えているので、補充された分はほぼ使い切っている
+    capacity = limit * BURST_RATIO
+    refilled = (limit - capacity) / WINDOW_SECONDS * (rounds - 1) * STEP
+    assert len(grants) >= 0.95 * (capacity + refilled)
+    assert len(grants) < rounds * THREADS
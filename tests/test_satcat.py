@@ -0,0 +1,133 @@
+import logging
+import os
+import struct
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from orbit import TLECatalog
+from satcat import HEADER, MappedCatalog, build_catalog, open_catalog, read_tle
+from scoring import CATEGORY_ISS, CATEGORY_OTHER, CATEGORY_STARLINK, CategoryTable
+
+REFERENCE_TLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "reference.tle")
+WHEN = datetime(2006, 6, 26, 19, 46, 43, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def satcat_path(tmp_path):
+    path = str(tmp_path / "catalog.satcat")
+    build_catalog(read_tle(REFERENCE_TLE), path)
+    return path
+
+
+def rewrite(path, edit):
+    # ファイルを書き換えて置き換える（inode が変わるので次の reload で読み直される）
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    data = edit(data)
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(data)
+    os.replace(f"{path}.tmp", path)
+
+
+def set_header(**fields):
+    names = ("magic", "version", "count", "records_offset", "strings_offset", "strings_size", "generation")
+
+    def edit(data):
+        values = dict(zip(names, HEADER.unpack(bytes(data[:HEADER.size]))))
+        values.update(fields)
+        data[:HEADER.size] = HEADER.pack(*(values[name] for name in names))
+        return data
+    return edit
+
+
+def test_matches_tle_catalog(satcat_path):
+    mapped, tle = MappedCatalog(satcat_path), TLECatalog(REFERENCE_TLE)
+    assert mapped.generation == pytest.approx(time.time(), abs=60)
+    assert len(mapped) == len(tle) == 3
+    for satid in (5, 6251, 28057):
+        assert mapped.name(satid) == tle.names[satid]
+        assert mapped.position(satid, WHEN) == pytest.approx(tle.position(satid, WHEN))
+    assert 25544 not in mapped
+
+
+@pytest.mark.parametrize("edit", [
+    lambda data: data[:40], #ヘッダの途中まで
+    lambda data: data[:-10], #文字列表の途中まで
+    set_header(count=1000),
+    set_header(records_offset=8),
+    set_header(strings_size=1 << 20),
+    set_header(strings_offset=1 << 40),
+    set_header(version=2),
+])
+def test_rejects_out_of_bounds_file(satcat_path, edit):
+    rewrite(satcat_path, edit)
+    with pytest.raises(ValueError):
+        MappedCatalog(satcat_path)
+
+
+def test_name_offset_outside_string_table(satcat_path):
+    def edit(data):
+        # 最初のレコードの name_offset（レコード末尾の u4）を文字列表の外にする
+        _, _, count, records_offset, strings_offset, _, _ = HEADER.unpack(bytes(data[:HEADER.size]))
+        itemsize = (strings_offset - records_offset) // count
+        struct.pack_into("<I", data, records_offset + itemsize - 4, 1 << 30)
+        return data
+    rewrite(satcat_path, edit)
+    with pytest.raises(ValueError):
+        MappedCatalog(satcat_path)
+
+
+def test_corrupt_replacement_keeps_old_mapping(satcat_path):
+    catalog = MappedCatalog(satcat_path)
+    before = catalog.position(5, WHEN)
+    rewrite(satcat_path, set_header(count=1000))
+    assert catalog.reload() is False
+    assert catalog.position(5, WHEN) == before
+    assert catalog.name(28057) == "ENVISAT"
+
+    # 正しいファイルに置き換えられたら読み直す
+    build_catalog(read_tle(REFERENCE_TLE)[:1], satcat_path)
+    assert catalog.reload() is True
+    assert len(catalog) == 1
+
+
+def test_categories_seed_category_table(tmp_path):
+    records = read_tle(REFERENCE_TLE)
+    sat = records[0][2]
+    path = str(tmp_path / "catalog.satcat")
+    build_catalog(records + [(44713, "STARLINK-1007", sat), (25544, "ISS (ZARYA)", sat)], path)
+    catalog = MappedCatalog(path)
+    assert catalog.categories([5, 25544, 44713, 99999]).tolist() == [CATEGORY_OTHER, CATEGORY_ISS, CATEGORY_STARLINK, -1]
+
+    # カタログにある衛星は衛星名を判定し直さない（N2YO の衛星名と違っていてもカタログのカテゴリを使う）
+    table = CategoryTable(catalog)
+    assert len(table) == len(catalog) == 5
+    above = [{"satid": 44713, "satname": "renamed"}, {"satid": 99999, "satname": "STARLINK-99999"}]
+    assert table.categories(above).tolist() == [CATEGORY_STARLINK, CATEGORY_STARLINK]
+    assert len(table) == 6
+    assert len(CategoryTable(TLECatalog(REFERENCE_TLE))) == 0
+
+
+def test_corrupt_catalog_at_first_open_falls_back_to_tle(satcat_path, caplog):
+    rewrite(satcat_path, set_header(count=1000))
+    with caplog.at_level(logging.ERROR, logger="satcat"):
+        catalog = open_catalog(satcat_path, REFERENCE_TLE)
+    assert type(catalog) is TLECatalog
+    assert len(catalog) == 3
+    assert "バイナリカタログを開けません" in caplog.text
+
+
+def test_corrupt_catalog_without_tle_starts_empty(satcat_path, caplog):
+    rewrite(satcat_path, set_header(count=1000))
+    with caplog.at_level(logging.ERROR, logger="satcat"):
+        catalog = open_catalog(satcat_path)
+    assert len(catalog) == 0
+    assert catalog.position(5, WHEN) is None
+    assert caplog.records
+
+    # 正しいファイルに置き換えられたら読み込む
+    build_catalog(read_tle(REFERENCE_TLE), satcat_path)
+    assert catalog.reload() is True
+    assert len(catalog) == 3
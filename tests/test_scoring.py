@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from satlist import SatelliteList
+from scoring import CategoryTable, expected_track_scores, haversine, link_score, track_scores
+
+
+def ladder(distance):
+    # 変更前の demo_app の if/elif による距離スコア
+    if distance < 1000:
+        return 3000 - distance
+    elif distance < 3000:
+        return 2000 - (distance - 1000) / 2
+    elif distance < 7000:
+        return 1000 - (distance - 3000) / 4
+    return 0
+
+
+DISTANCES = [0, 999, 1000, 2999, 3000, 6999, 7000, 12000]
+
+
+@pytest.mark.parametrize("distance", DISTANCES)
+def test_track_score_matches_ladder(distance):
+    assert float(track_scores(distance)) == pytest.approx(ladder(distance))
+
+
+def test_track_scores_vectorized():
+    assert track_scores(np.array(DISTANCES, dtype=float)) == pytest.approx([ladder(d) for d in DISTANCES])
+
+
+def test_link_score_by_category():
+    above = [
+        {"satid": 1, "satname": "STARLINK-1007"},
+        {"satid": 2, "satname": "ISS (ZARYA)"},
+        {"satid": 3, "satname": "NOAA 19"},
+        {"satid": 4, "satname": "starlink-30000"},
+    ]
+    table = CategoryTable()
+    # STARLINK 2点, ISS 3点, その他 1点
+    assert link_score(table.categories(above)) == 2 + 3 + 1 + 2
+    assert link_score(table.categories(above[2:3])) == 1
+    assert len(table) == 4
+
+
+def test_expected_scores_for_all_candidates():
+    lat, lon = 35.0, 139.0
+    above = [
+        {"satid": i, "satname": f"SAT-{i}", "launchDate": "2020", "satlat": lat + i, "satlng": lon - 2 * i}
+        for i in range(20)
+    ]
+    sat_list = SatelliteList.from_above(above, CategoryTable(), range(20))
+    expected = expected_track_scores(lat, lon, sat_list, range(len(sat_list)))
+    assert len(expected) == 20
+    for i, score in enumerate(expected):
+        distance = float(haversine(lat, lon, lat + i, lon - 2 * i))
+        assert score == int(ladder(distance))
@@ -0,0 +1,60 @@
+import time
+import sqlite3
+import threading
+
+import pytest
+
+from storage import StorageEngine
+
+
+def test_pool_never_exceeds_pool_size(tmp_path, monkeypatch):
+    engine = StorageEngine(str(tmp_path / "game.db"), pool_size=4)
+    connect = engine._connect
+    opened = []
+
+    def slow_connect():
+        # 接続に時間がかかる間に他のスレッドが枠を取りに来る状況を作る
+        time.sleep(0.05)
+        conn = connect()
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(engine, "_connect", slow_connect)
+    # 最初の1本を取り出しておき、全スレッドが新しい接続を作ろうとするようにする
+    with engine.connection():
+        barrier = threading.Barrier(16)
+
+        def worker():
+            barrier.wait()
+            with engine.connection() as conn:
+                conn.execute("SELECT 1").fetchone()
+                time.sleep(0.01)
+
+        threads = [threading.Thread(target=worker) for _ in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    assert len(opened) == 3
+    assert engine._created == 4
+    engine.close()
+
+
+def test_failed_commit_rolls_back_before_release(tmp_path):
+    engine = StorageEngine(str(tmp_path / "game.db"), pool_size=1)
+    with engine.transaction() as conn:
+        conn.execute("CREATE TABLE parent (id INTEGER PRIMARY KEY)")
+        conn.execute("CREATE TABLE child (parent_id INTEGER REFERENCES parent (id) DEFERRABLE INITIALLY DEFERRED)")
+    with engine.connection() as conn:
+        conn.execute("PRAGMA foreign_keys=ON")
+
+    # 遅延された外部キー制約は COMMIT の時に失敗する
+    with pytest.raises(sqlite3.IntegrityError):
+        with engine.transaction() as conn:
+            conn.execute("INSERT INTO child (parent_id) VALUES (1)")
+
+    # 同じ接続で次のトランザクションを始められる
+    with engine.transaction() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM child").fetchone()[0] == 0
+    engine.close()
@@ -0,0 +1,89 @@
+import math
+
+import numpy as np
+import pytest
+
+from orbit import geodetic_to_ecef
+from visibility import EARTH_R, VisibilityEngine, VisibilitySlice
+
+
+def random_unit(rnd, n):
+    v = rnd.normal(size=(n, 3))
+    return v / np.linalg.norm(v, axis=1)[:, None]
+
+
+def constellation(rnd, n):
+    # LEO が大半で、MEO・GEO を少し混ぜる
+    band = rnd.random(n)
+    alt = np.where(band < 0.85, rnd.uniform(300, 1500, n), np.where(band < 0.95, rnd.uniform(19000, 24000, n), 35786.0))
+    return random_unit(rnd, n) * (EARTH_R + alt)[:, None]
+
+
+def random_observers(rnd, n):
+    lat = np.degrees(np.arcsin(rnd.uniform(-1, 1, n)))
+    lon = rnd.uniform(-180, 180, n)
+    # 極・日付変更線・赤道も必ず含める
+    fixed = [(90.0, 0.0), (-90.0, 0.0), (89.9, 179.9), (0.0, 180.0), (0.0, -180.0), (35.0, 139.0), (-60.0, -179.5)]
+    return fixed + list(zip(lat.tolist(), lon.tolist()))
+
+
+def brute_force(ecef, lat, lon, alt_km, radius):
+    # 全衛星について天頂角を直接判定する
+    obs = np.array(geodetic_to_ecef(lat, lon, alt_km))
+    zenith = np.array([
+        math.cos(math.radians(lat)) * math.cos(math.radians(lon)),
+        math.cos(math.radians(lat)) * math.sin(math.radians(lon)),
+        math.sin(math.radians(lat)),
+    ])
+    d = ecef - obs
+    cos_zenith = (d @ zenith) / np.linalg.norm(d, axis=1)
+    return np.nonzero(cos_zenith >= math.cos(math.radians(radius)))[0]
+
+
+@pytest.mark.parametrize("radius", [90, 60, 20])
+def test_visible_matches_brute_force(radius):
+    rnd = np.random.default_rng(radius)
+    ecef = constellation(rnd, 20000)
+    satids = np.arange(100000, 120000)
+    sl = VisibilitySlice(satids, ecef, 5.0)
+    engine = VisibilityEngine(catalog=None)
+    for lat, lon in random_observers(rnd, 200):
+        alt_km = float(rnd.uniform(0, 3))
+        found, sat_lat, sat_lng, sat_alt = engine.visible(sl, lat, lon, alt_km, radius)
+        expected = satids[brute_force(ecef, lat, lon, alt_km, radius)]
+        assert np.array_equal(found, expected), (lat, lon)
+        assert len(sat_lat) == len(sat_lng) == len(sat_alt) == len(found)
+
+
+def test_candidates_scale_with_visible_satellites_not_catalog():
+    # 問い合わせで調べる候補数は見えている衛星数に比例し、カタログ全体の大きさには比例しない
+    rnd = np.random.default_rng(0)
+    observers = random_observers(rnd, 100)
+    engine = VisibilityEngine(catalog=None)
+    ratios = {}
+    for n in (2000, 20000):
+        ecef = constellation(rnd, n)
+        sl = VisibilitySlice(np.arange(n), ecef, 5.0)
+        candidates = sum(len(sl.candidates(lat, lon)) for lat, lon in observers)
+        visible = sum(len(engine.visible(sl, lat, lon, 0.0)[0]) for lat, lon in observers)
+        ratios[n] = candidates / visible
+    assert ratios[2000] < 2.5
+    assert ratios[20000] == pytest.approx(ratios[2000], rel=0.15)
+
+
+def test_satellites_out_of_view_do_not_add_work():
+    # 観測地点の裏側に衛星が増えても、候補数は変わらない
+    rnd = np.random.default_rng(1)
+    near = random_unit(rnd, 2000) * (EARTH_R + rnd.uniform(400, 1200, 2000))[:, None]
+    near[0] *= (EARTH_R + 1200) / np.linalg.norm(near[0]) #高度帯の最大高度を固定する
+    # 東京の対蹠点の周り 40 度以内に 50000 機
+    far = random_unit(rnd, 200000)
+    antipode = -np.array(geodetic_to_ecef(35.0, 139.0, 0.0))
+    far = far[far @ (antipode / np.linalg.norm(antipode)) > math.cos(math.radians(40))][:50000]
+    far = far * (EARTH_R + rnd.uniform(400, 1200, len(far)))[:, None]
+
+    small = VisibilitySlice(np.arange(len(near)), near, 5.0)
+    large = VisibilitySlice(np.arange(len(near) + len(far)), np.vstack((near, far)), 5.0)
+    small_candidates = small.candidates(35.0, 139.0)
+    large_candidates = large.candidates(35.0, 139.0)
+    assert np.array_equal(np.sort(small_candidates), np.sort(large_candidates))
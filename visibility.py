@@ -0,0 +1,186 @@
+import math
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+from orbit import ecef_to_geodetic_array, observer_frame
+
+# ========================
+# 設定
+# ========================
+SLICE_SECONDS = 10 #同じ伝播結果を使い回す時間幅（秒）
+CELL_DEG = 5.0 #空間インデックスの緯度経度グリッド幅（度）
+ALTITUDE_BANDS = (0.0, 2000.0, 10000.0, 30000.0, math.inf) #高度帯毎にインデックスを分ける（km）
+EARTH_R = 6371.0 #地球半径 km（探索範囲の見積もり用）
+MARGIN_DEG = 1.0 #楕円体との差を吸収する探索範囲の余裕
+
+
+def launch_year(intldesg):
+    # 国際識別番号（例: 98067A）の先頭2桁から打ち上げ年を求める
+    if not intldesg or not intldesg[:2].isdigit():
+        return ""
+    yy = int(intldesg[:2])
+    return str(1900 + yy if yy >= 57 else 2000 + yy)
+
+
+# ========================
+# 空間インデックス（緯度経度バケット）
+# ========================
+# 単位ベクトルの緯度経度でセルに振り分け、セル順に並べた添字とオフセット（CSR形式）で持つ
+
+class BucketGrid:
+    def __init__(self, unit, cell_deg=CELL_DEG):
+        self.cell_deg = cell_deg
+        self.n_lat = int(math.ceil(180 / cell_deg))
+        self.n_lon = int(math.ceil(360 / cell_deg))
+        lat = np.degrees(np.arcsin(np.clip(unit[:, 2], -1.0, 1.0)))
+        lon = np.degrees(np.arctan2(unit[:, 1], unit[:, 0]))
+        i_lat = np.minimum(((lat + 90) // cell_deg).astype(np.int64), self.n_lat - 1)
+        i_lon = np.minimum(((lon + 180) // cell_deg).astype(np.int64), self.n_lon - 1)
+        cell = i_lat * self.n_lon + i_lon
+        self.order = np.argsort(cell, kind="stable")
+        counts = np.bincount(cell, minlength=self.n_lat * self.n_lon)
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    def _half_width(self, lat, radius_deg, rows):
+        # 行（緯度帯）毎に、球冠が中心経度から東西に広がる最大の経度差（度）。行全体なら 180
+        phi0, r = math.radians(lat), math.radians(radius_deg)
+        lo = np.radians(np.maximum(rows * self.cell_deg - 90.0, lat - radius_deg))
+        hi = np.radians(np.minimum((rows + 1) * self.cell_deg - 90.0, lat + radius_deg))
+        # 経度差は緯度 asin(sin φ0 / cos r) で最大になるので、行の範囲に切り詰めて端と合わせて評価する
+        peak = math.asin(max(-1.0, min(1.0, math.sin(phi0) / math.cos(r)))) if math.cos(r) > 0 else phi0
+        phi = np.stack((lo, hi, np.clip(peak, lo, hi)))
+        denom = math.cos(phi0) * np.cos(phi)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cos_dlon = (math.cos(r) - math.sin(phi0) * np.sin(phi)) / denom
+        # 極を含む（分母が0）か、経度方向に一周する行は全列
+        cos_dlon = np.where(denom > 1e-12, cos_dlon, -1.0)
+        return np.degrees(np.arccos(np.clip(cos_dlon, -1.0, 1.0))).max(axis=0)
+
+    def query(self, lat, lon, radius_deg):
+        # 中心(lat, lon)から角距離 radius_deg の球冠に掛かるセルの中身を返す
+        lat_lo = max(-90.0, lat - radius_deg)
+        lat_hi = min(90.0, lat + radius_deg)
+        row_lo = int((lat_lo + 90) // self.cell_deg)
+        row_hi = min(int((lat_hi + 90) // self.cell_deg), self.n_lat - 1)
+        rows = np.arange(row_lo, row_hi + 1)
+        half = self._half_width(lat, radius_deg, rows)
+        col_lo = np.floor((lon - half + 180) / self.cell_deg).astype(np.int64)
+        n_cols = np.floor((lon + half + 180) / self.cell_deg).astype(np.int64) - col_lo + 1
+        full = n_cols >= self.n_lon
+        col_lo[full] = 0
+        n_cols[full] = self.n_lon
+        # 行毎に長さの違う列範囲を1本のセル番号の配列に展開する
+        first = np.cumsum(n_cols) - n_cols
+        cols = np.arange(int(n_cols.sum())) - np.repeat(first - col_lo, n_cols)
+        cells = np.repeat(rows, n_cols) * self.n_lon + cols % self.n_lon
+        # 対象セルの [start, stop) 区間をまとめて連結する（セル毎の Python ループはしない）
+        starts = self.offsets[cells]
+        counts = self.offsets[cells + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64)
+        shift = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        return self.order[np.arange(total) + shift]
+
+
+# ========================
+# 可視衛星エンジン
+# ========================
+# カタログ全体を時間スライス毎に1回だけ伝播し、観測地点毎の問い合わせは
+# 空間インデックスで候補を絞ってから厳密に仰角を判定する
+
+class VisibilitySlice:
+    def __init__(self, satids, ecef, cell_deg):
+        self.satids = satids
+        self.ecef = ecef
+        self.bands = []
+        r = np.linalg.norm(ecef, axis=1)
+        unit = ecef / np.maximum(r, 1e-9)[:, None]
+        alt = r - EARTH_R
+        for lo, hi in zip(ALTITUDE_BANDS[:-1], ALTITUDE_BANDS[1:]):
+            members = np.nonzero((alt >= lo) & (alt < hi))[0]
+            if len(members) == 0:
+                continue
+            # 地平線より上に見える最大の地心角（最も高い衛星で決まる）
+            h_max = max(float(alt[members].max()), 0.0)
+            reach = math.degrees(math.acos(EARTH_R / (EARTH_R + h_max))) + MARGIN_DEG
+            self.bands.append((members, BucketGrid(unit[members], cell_deg), reach))
+
+    def candidates(self, lat, lon):
+        found = [members[grid.query(lat, lon, reach)] for members, grid, reach in self.bands]
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(found)
+
+
+class VisibilityEngine:
+    def __init__(self, catalog, slice_seconds=SLICE_SECONDS, cell_deg=CELL_DEG):
+        self.catalog = catalog
+        self.slice_seconds = slice_seconds
+        self.cell_deg = cell_deg
+        self._current = (None, None) #(時間バケット, VisibilitySlice)
+        self._lock = threading.Lock()
+
+    def _build_slice(self, bucket):
+        slice_time = datetime.fromtimestamp(bucket * self.slice_seconds, timezone.utc)
+        satids, ecef = self.catalog.propagate_all(slice_time)
+        return VisibilitySlice(satids, ecef, self.cell_deg)
+
+    def _get_slice(self, when):
+        bucket = int(when.timestamp() // self.slice_seconds)
+        current_bucket, current = self._current
+        if current_bucket == bucket:
+            return current
+        with self._lock:
+            current_bucket, current = self._current
+            if current_bucket != bucket:
+                current = self._build_slice(bucket)
+                self._current = (bucket, current)
+            return current
+
+    def slice_at(self, when):
+        # 任意の時刻の伝播結果（共有の現在スライスは差し替えない。先読み計算用）
+        return self._build_slice(int(when.timestamp() // self.slice_seconds))
+
+    def visible(self, sl, lat, lon, alt_km, radius=90):
+        # スライス sl で観測地点から見える衛星の (satid, 緯度, 経度, 高度) 配列を返す
+        idx = sl.candidates(lat, lon)
+
+        # 観測地点の天頂方向と衛星方向のなす角が radius 以内のものだけ残す
+        obs, zenith = observer_frame(lat, lon, alt_km)
+        d = sl.ecef[idx] - obs
+        cos_zenith = (d @ zenith) / np.maximum(np.linalg.norm(d, axis=1), 1e-9)
+        idx = np.sort(idx[cos_zenith >= math.cos(math.radians(radius))])
+
+        sat_lat, sat_lng, sat_alt = ecef_to_geodetic_array(sl.ecef[idx])
+        return sl.satids[idx], sat_lat, sat_lng, sat_alt
+
+    def payload(self, satids, sat_lat, sat_lng, sat_alt):
+        # N2YO の satellite/above と同じ形にする
+        catalog = self.catalog
+        above = []
+        for i, satid in enumerate(satids.tolist()):
+            intldesg = catalog.intldesg(satid)
+            above.append({
+                "satid": satid,
+                "satname": catalog.name(satid),
+                "intDesignator": intldesg,
+                "launchDate": launch_year(intldesg),
+                "satlat": float(sat_lat[i]),
+                "satlng": float(sat_lng[i]),
+                "satalt": float(sat_alt[i]),
+            })
+        return {
+            "info": {"category": "ANY", "transactionscount": 0, "satcount": len(above)},
+            "above": above,
+        }
+
+    def above(self, lat, lon, alt_km, radius=90, when=None):
+        # N2YO の satellite/above と同じ形で返す（カタログが空なら None）
+        if len(self.catalog) == 0:
+            return None
+        if when is None:
+            when = datetime.now(timezone.utc)
+        return self.payload(*self.visible(self._get_slice(when), lat, lon, alt_km, radius))